@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'eventra_backend.settings')
+# Serve the hot endpoints with the async views (eventra_backend/asgi_urls.py)
+os.environ.setdefault('Async_views', 'True')
 
 application = get_asgi_application()
@@ -0,0 +1,19 @@
+"""
+URL configuration used under ASGI (see asgi.py): the hot endpoints are
+served by the async views in events/async_views.py, everything else by
+the regular urls.py.
+"""
+from django.urls import include, path
+
+from events import async_views
+
+urlpatterns = [
+    path('api/events/', async_views.event_list, name='event-list-create'),
+    path('api/events/<int:event_id>/book/', async_views.create_booking, name='create-booking'),
+    path('api/bookings/<int:booking_id>/complete-payment/', async_views.complete_payment, name='complete-payment'),
+    path('api/verify-ticket/', async_views.volunteer_verify_ticket, name='verify-ticket'),
+    path('api/volunteer/verify-ticket/', async_views.volunteer_verify_ticket, name='volunteer_verify_ticket'),
+    path('api/admin/verify-ticket/', async_views.admin_verify_ticket, name='admin_verify_ticket'),
+
+    path('', include('eventra_backend.urls')),
+]
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import environ
 import os
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -32,11 +33,47 @@ ALLOWED_HOSTS = []
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Who sends media files (events/media.py): "django", or the proxy with "x-accel" (nginx) / "x-sendfile"
+MEDIA_DELIVERY = env('Media_delivery', default='django')
+# x-accel: the nginx `internal` location aliased to MEDIA_ROOT
+MEDIA_ACCEL_PREFIX = env('Media_accel_prefix', default='/protected-media/')
+
+# Where uploads are stored: "local" (MEDIA_ROOT) or "s3", any S3 compatible bucket (events/storage.py)
+MEDIA_STORAGE = env('Media_storage', default='local')
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    # Cold storage for the bookings of past events (events/archive.py), any Storage works (S3 too)
+    'archive': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {'location': env('Archive_dir', default=str(BASE_DIR / 'archive'))},
+    },
+}
+if MEDIA_STORAGE == 's3':
+    STORAGES['default'] = {
+        'BACKEND': 'events.storage.MediaStorage',
+        'OPTIONS': {
+            'bucket_name': env('S3_bucket'),
+            # e.g. http://localhost:9000 for MinIO, unset for AWS
+            'endpoint_url': env('S3_endpoint_url', default=None),
+            'access_key': env('S3_access_key', default=None),
+            'secret_key': env('S3_secret_key', default=None),
+            'region_name': env('S3_region', default=None),
+            # Public bucket or CDN domain: plain URLs that can be cached, not signed ones
+            'custom_domain': env('S3_custom_domain', default=None),
+            'querystring_auth': env.bool('S3_signed_urls', default=False),
+            'file_overwrite': False,
+        },
+    }
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=1),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),
+    # Tokens carry the user's roles, so scanners are checked without a query (events/scanner_auth.py)
+    "TOKEN_OBTAIN_SERIALIZER": "events.scanner_auth.RoleTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "events.scanner_auth.RoleTokenRefreshSerializer",
 }
 
 # Application definition
@@ -58,6 +95,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost so it times the whole request (see events/metrics.py)
+    'events.metrics.MetricsMiddleware',
+    # Sends a client's reads to the primary for a few seconds after it writes
+    'events.db_routing.PinAfterWriteMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -68,7 +109,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'eventra_backend.urls'
+# Under ASGI (asgi.py sets Async_views) the booking funnel runs on async views
+ASYNC_VIEWS = env.bool('Async_views', default=False)
+ROOT_URLCONF = 'eventra_backend.asgi_urls' if ASYNC_VIEWS else 'eventra_backend.urls'
 
 TEMPLATES = [
     {
@@ -99,9 +142,41 @@ DATABASES = {
         'PASSWORD': env('DB_password'),
         'HOST': env('DB_host'),
         'PORT': env('DB_port'),
+        # Keep connections open between requests instead of reconnecting every time,
+        # and check them before reuse so a restarted database doesn't fail a request
+        'CONN_MAX_AGE': env.int('DB_conn_max_age', default=60),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas, e.g. DB_replica_hosts=10.0.0.11,10.0.0.12:5433 (same name/user/password as the primary).
+# Only views marked @replica_reads read from them, see events/db_routing.py
+DATABASE_REPLICAS = []
+for i, replica_host in enumerate(env.list('DB_replica_hosts', default=[])):
+    replica_host, _, replica_port = replica_host.partition(':')
+    DATABASES[f'replica_{i}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port or DATABASES['default']['PORT'],
+        # Tests run against the primary's test database
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{i}')
+DATABASE_ROUTERS = ['events.db_routing.ReplicaRouter']
+# How long a client that just wrote something keeps reading from the primary
+REPLICA_STICKY_SECONDS = env.int('DB_replica_sticky_seconds', default=5)
+
+
+# Cache (the event listing is cached here, see events/listing.py)
+# Use a shared cache such as rediscache://127.0.0.1:6379/1 when running several workers
+CACHES = {
+    'default': env.cache('Cache_url', default='locmemcache://'),
+}
+# Event edits invalidate the cached listing, seat counts don't: this is also how late they can show
+EVENT_LIST_CACHE_SECONDS = env.int('Event_list_cache_seconds', default=10)
+# Full event listing and booking lists serialized from .values() rows (events/fast_serializers.py)
+FAST_SERIALIZERS = env.bool('Fast_serializers', default=True)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -124,6 +199,11 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    # orjson when it is installed, same output as DRF's JSONRenderer (events/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': (
+        'events.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
@@ -152,7 +232,9 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 #Automated email system configuration
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Emails are queued in the outbox and sent by `manage.py send_outbox`.
+# Set Email_backend=django.core.mail.backends.console.EmailBackend to print them locally instead
+EMAIL_BACKEND = env('Email_backend', default='django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST=env('Email_host')
 EMAIL_PORT=env.int('Email_port')
 EMAIL_USE_TLS=env.bool('Email_use_tls')
@@ -161,3 +243,46 @@ EMAIL_HOST_PASSWORD=env('Email_pass')
 DEFAULT_FROM_EMAIL = env('Email_id')
 
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key', 'admission-pass')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed', 'Retry-After']
+
+# Request metrics at /metrics (events/metrics.py). Only these addresses may scrape it
+METRICS_ALLOWED_IPS = env.list('Metrics_allowed_ips', default=['127.0.0.1', '::1'])
+# Log queries slower than this many ms with the code that ran them (unset = off)
+METRICS_SLOW_QUERY_MS = env.float('Metrics_slow_query_ms', default=None)
+
+# Signs the offline verification manifests for door scanners (events/manifest.py)
+SCANNER_MANIFEST_KEY = env('Scanner_manifest_key', default=SECRET_KEY)
+# Trust the role claims in scanners' tokens instead of loading the user on every check-in (events/scanner_auth.py)
+SCANNER_STATELESS_AUTH = env.bool('Scanner_stateless_auth', default=True)
+# ...for this long after the token was issued; older tokens load the user again until they are refreshed
+SCANNER_CLAIMS_MAX_MINUTES = env.int('Scanner_claims_max_minutes', default=15)
+
+# How long a pending booking keeps its seats before `manage.py expire_holds` releases them
+SEAT_HOLD_MINUTES = env.int('Seat_hold_minutes', default=10)
+
+# How long a customer promoted from an event's waitlist has to pay for the seats they got (events/waitlist.py)
+WAITLIST_HOLD_MINUTES = env.int('Waitlist_hold_minutes', default=60)
+
+# Retries of booking / payment requests with the same Idempotency-Key replay the first response this long
+IDEMPOTENCY_KEY_HOURS = env.int('Idempotency_key_hours', default=24)
+# A request still holding its key after this long is taken to have crashed and its retry runs the action.
+# Keep it above the server's / proxy's request timeout, or a slow request and its retry both run
+IDEMPOTENCY_LOCK_SECONDS = env.int('Idempotency_lock_seconds', default=600)
+
+# Token-bucket rate limits per client IP (and per roll number for bookings), see events/throttling.py.
+# "N/s", "N/min", "N/hour" or "N/day"; empty = no limit.
+# Throttle_store=cache keeps the buckets in the cache (shared by all workers with Redis)
+THROTTLE_RATES = {
+    'listing': env('Throttle_listing', default=''),
+    'booking': env('Throttle_booking', default=''),
+    'booking_roll_number': env('Throttle_booking_roll_number', default=''),
+    'waiting_room': env('Throttle_waiting_room', default=''),
+}
+THROTTLE_STORE = env('Throttle_store', default='local')
+
+# How long an admission pass from an event's waiting room lets its holder book
+ADMISSION_PASS_MINUTES = env.int('Admission_pass_minutes', default=10)
+
+# Admin changelists past this many rows (the planner's estimate) show an estimated count instead of COUNT(*)
+ADMIN_EXACT_COUNT_LIMIT = env.int('Admin_exact_count_limit', default=10000)
@@ -16,8 +16,6 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -32,7 +30,9 @@ from events.views import (
     volunteer_verify_ticket,
     admin_profile,
     admin_verify_ticket,
+    metrics_view,
 )
+from events import media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -50,4 +50,7 @@ urlpatterns = [
     path('api/admin/profile/', admin_profile, name='admin_profile'),
     path('api/admin/verify-ticket/', admin_verify_ticket, name='admin_verify_ticket'),
 
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    # Prometheus metrics (events/metrics.py)
+    path('metrics', metrics_view, name='metrics'),
+
+] + media.urlpatterns()  # Posters (events/media.py)
\ No newline at end of file
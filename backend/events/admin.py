@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Event, Booking, Ticket
+from .models import Event, Booking, BookingArchive, Ticket, OutboxEmail, WaitlistEntry
+from . import changelists, exports, inventory
 
 # Register the Event model with admin
 @admin.register(Event)
@@ -11,6 +12,11 @@ class EventAdmin(admin.ModelAdmin):
     list_filter = ['event_type', 'event_date', 'is_active']
     
     search_fields = ['title', 'venue']
+
+    actions = ['use_sharded_seats', 'use_single_seat_counter']
+
+    # Bookings change it with conditional UPDATEs; editing total_seats adds / removes the difference
+    readonly_fields = ['available_seats']
     
     fieldsets = (
         ('Basic Info', {
@@ -22,26 +28,55 @@ class EventAdmin(admin.ModelAdmin):
         ('Tickets', {
             'fields': ('ticket_price', 'total_seats', 'available_seats')
         }),
+        ('Waiting room', {
+            # Customers let into booking per minute when it opens, empty = no waiting room
+            'fields': ('admission_rate',)
+        }),
         ('Status', {
             'fields': ('is_active',)
         })
     )
 
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.available_seats = obj.total_seats
+        super().save_model(request, obj, form, change)
+
+    @admin.action(description='Switch to sharded seat counter (hot events)')
+    def use_sharded_seats(self, request, queryset):
+        for event in queryset:
+            inventory.enable_sharding(event)
+        self.message_user(request, f"{queryset.count()} event(s) now use sharded seats")
+
+    @admin.action(description='Switch back to a single seat counter')
+    def use_single_seat_counter(self, request, queryset):
+        for event in queryset:
+            inventory.disable_sharding(event)
+        self.message_user(request, f"{queryset.count()} event(s) now use a single seat counter")
+
 class TicketInline(admin.TabularInline):
     # This shows tickets INSIDE the booking form
     model = Ticket
     extra = 0  # Don't show extra empty forms
     readonly_fields = ['otp_code', 'is_verified', 'verified_at']
+    raw_id_fields = ['verified_by']
 
 @admin.register(Booking)
 class BookingAdmin(admin.ModelAdmin):
     list_display = ['customer_name', 'event', 'number_of_tickets', 
                    'total_amount', 'payment_status', 'created_at']
     list_filter = ['payment_status', 'event__event_type']
-    search_fields = ['customer_name', 'roll_number', 'phone']
+    # Name anywhere, roll number and phone from the start (indexes in migration 0016)
+    search_fields = ['customer_name', '^roll_number', '^phone']
+
+    # Large table: events joined in, estimated counts (see events/changelists.py)
+    list_select_related = ['event']
+    paginator = changelists.EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['export_csv']
     
     # Make total_amount read-only since it's calculated automatically
-    readonly_fields = ['total_amount', 'created_at']
+    readonly_fields = ['total_amount', 'hold_expires_at', 'created_at']
     
     # Group fields logically
     fieldsets = (
@@ -52,15 +87,71 @@ class BookingAdmin(admin.ModelAdmin):
             'fields': ('customer_name', 'roll_number', 'section', 'email', 'phone')
         }),
         ('Booking Details', {
-            'fields': ('number_of_tickets', 'total_amount', 'payment_status', 'payment_id')
+            'fields': ('number_of_tickets', 'total_amount', 'payment_status', 'payment_id', 'hold_expires_at')
         }),
     )
     
     inlines = [TicketInline]
 
+    @admin.action(description='Export as CSV')
+    def export_csv(self, request, queryset):
+        # Streamed, so exporting the whole filtered list doesn't load it into memory
+        return exports.stream_bookings(queryset.prefetch_related('tickets').order_by('id'), 'csv', 'bookings')
+
 @admin.register(Ticket)
 class TicketAdmin(admin.ModelAdmin):
     list_display = ['booking', 'ticket_number', 'otp_code', 'is_verified']
     list_filter = ['is_verified']
-    search_fields = ['otp_code', 'booking__customer_name']
-    readonly_fields = ['otp_code']
\ No newline at end of file
+    search_fields = ['booking__customer_name']
+    search_help_text = 'OTP or customer name'
+    readonly_fields = ['otp_code']
+    # The change form would otherwise put every booking in a select
+    raw_id_fields = ['booking', 'verified_by']
+
+    # Booking.__str__ shows the event too, so both are joined in
+    list_select_related = ['booking__event']
+    paginator = changelists.EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['export_csv']
+
+    def get_search_results(self, request, queryset, search_term):
+        # A six digit term is an OTP: one lookup on its unique index instead of matching names
+        term = search_term.strip()
+        if len(term) == 6 and term.isdigit():
+            return queryset.filter(otp_code=term), False
+        return super().get_search_results(request, queryset, search_term)
+
+    @admin.action(description='Export as CSV')
+    def export_csv(self, request, queryset):
+        return exports.stream_tickets(queryset.order_by('id'), 'tickets')
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ['customer_name', 'event', 'number_of_tickets', 'status', 'created_at', 'promoted_at']
+    list_filter = ['status']
+    search_fields = ['customer_name', '^roll_number']
+    list_select_related = ['event']
+    raw_id_fields = ['booking']
+    readonly_fields = ['created_at', 'promoted_at']
+
+@admin.register(BookingArchive)
+class BookingArchiveAdmin(admin.ModelAdmin):
+    # Written by archive_bookings, removed by restore_bookings; editing a row would desync it from its file
+    list_display = ['event', 'bookings', 'tickets', 'file', 'created_at']
+    list_select_related = ['event']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['recipients']
+    readonly_fields = ['attempts', 'last_error', 'created_at', 'sent_at']
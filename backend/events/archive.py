@@ -0,0 +1,209 @@
+"""
+Archival of the bookings of past events.
+
+Live traffic only ever touches upcoming events, but Booking and Ticket
+keep every booking ever made, so their indexes, vacuums and admin counts
+grow with the history. ``archive_event`` moves an event's bookings, with
+their tickets, out of the two tables into one gzipped JSON Lines file in
+the ``archive`` storage (STORAGES['archive']: a directory by default,
+any Storage, S3 included, works), and ``restore_event`` puts them back.
+``manage.py archive_bookings`` archives every event older than N days,
+``manage.py restore_bookings`` restores events. A file is deleted with
+its BookingArchive row, after a restore or with the event.
+
+An event is archived in three steps, each safe to repeat:
+
+1. its bookings up to the current highest id are read a batch at a time
+   (keyset pages on booking_event_id_idx) and streamed into the file:
+   a header line, then one line per booking with its tickets;
+2. a BookingArchive row records the file, the counts, the last booking
+   id and what the archived rows add to the event's stats;
+3. the archived bookings are deleted a batch at a time, one short
+   transaction each (tickets go with them).
+
+A run that stops between 2 and 3 is finished by the next one. The stats
+(events/stats.py) are running totals and don't change; ``stats.actual``
+adds the archives' totals, so ``reconcile_stats`` still agrees with them.
+
+Declarative partitioning of Booking/Ticket by event date would need the
+date on both tables and composite primary keys on Postgres, and doesn't
+exist on SQLite; moving whole past events out keeps the same small hot
+set on every database.
+"""
+import collections
+import datetime
+import gzip
+import itertools
+import json
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.storage import storages
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+from .models import Booking, BookingArchive, Event, Ticket
+
+BATCH_SIZE = 500
+FORMAT_VERSION = 1
+
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder cuts times to milliseconds, restored rows must get the exact values back
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def storage():
+    return storages['archive']
+
+
+def archivable(older_than_days):
+    """Events that took place more than `older_than_days` ago and still have bookings, oldest first."""
+    cutoff = timezone.localdate() - datetime.timedelta(days=older_than_days)
+    has_bookings = Exists(Booking.objects.filter(event=OuterRef('pk')))
+    return Event.objects.filter(has_bookings, event_date__lt=cutoff).order_by('event_date', 'id')
+
+
+def _empty_totals():
+    return {'paid_bookings': 0, 'tickets_sold': 0, 'revenue': 0, 'pending_bookings': 0, 'pending_seats': 0,
+            'checked_in': 0}
+
+
+def _count(totals, booking, tickets):
+    # The same fields stats.actual counts from the live tables
+    if booking['payment_status'] == 'completed':
+        totals['paid_bookings'] += 1
+        totals['tickets_sold'] += booking['number_of_tickets']
+        totals['revenue'] += booking['total_amount']
+    elif booking['payment_status'] == 'pending':
+        totals['pending_bookings'] += 1
+        totals['pending_seats'] += booking['number_of_tickets']
+    totals['checked_in'] += sum(1 for ticket in tickets if ticket['is_verified'])
+
+
+def _booking_batches(event_id, last_id, batch_size):
+    after = 0
+    while True:
+        batch = list(
+            Booking.objects.filter(event_id=event_id, id__gt=after, id__lte=last_id).order_by('id').values()[:batch_size]
+        )
+        if not batch:
+            return
+        after = batch[-1]['id']
+        tickets = collections.defaultdict(list)
+        for ticket in Ticket.objects.filter(booking_id__in=[b['id'] for b in batch]).order_by('id').values():
+            tickets[ticket['booking_id']].append(ticket)
+        yield [(booking, tickets[booking['id']]) for booking in batch]
+
+
+def _delete_archived(event_id, last_id, batch_size):
+    deleted = 0
+    while True:
+        ids = list(
+            Booking.objects.filter(event_id=event_id, id__lte=last_id).order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            Booking.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+
+
+def finish(event_id, batch_size=BATCH_SIZE):
+    """Delete what the event's archives hold but is still in Booking (a run that stopped early)."""
+    last_id = BookingArchive.objects.filter(event_id=event_id).aggregate(last=Max('last_booking_id'))['last']
+    if last_id is None:
+        return 0
+    return _delete_archived(event_id, last_id, batch_size)
+
+
+def archive_event(event, batch_size=BATCH_SIZE):
+    """Move the event's bookings and tickets to the archive storage. Returns the BookingArchive, None if none."""
+    finish(event.id, batch_size)
+    last_id = Booking.objects.filter(event=event).aggregate(last=Max('id'))['last']
+    if last_id is None:
+        return None
+
+    bookings = tickets = 0
+    totals = _empty_totals()
+    encoder = ArchiveEncoder(separators=(',', ':'))
+    # Only one batch is ever in memory; the file is spooled on disk and handed to the storage at the end
+    with tempfile.TemporaryFile() as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as out:
+            header = {'version': FORMAT_VERSION, 'event': event.id, 'title': event.title, 'event_date': event.event_date}
+            out.write(encoder.encode(header).encode() + b'\n')
+            for batch in _booking_batches(event.id, last_id, batch_size):
+                for booking, booking_tickets in batch:
+                    _count(totals, booking, booking_tickets)
+                    out.write(encoder.encode({**booking, 'tickets': booking_tickets}).encode() + b'\n')
+                    tickets += len(booking_tickets)
+                bookings += len(batch)
+        raw.seek(0)
+        name = storage().save(f'bookings/event-{event.id}-{timezone.now():%Y%m%d%H%M%S}.jsonl.gz', File(raw))
+
+    archive = BookingArchive.objects.create(
+        event=event, file=name, bookings=bookings, tickets=tickets, last_booking_id=last_id, totals=totals,
+    )
+    _delete_archived(event.id, last_id, batch_size)
+    return archive
+
+
+def _parse(model, row):
+    # Values come back as JSON strings / numbers; the fields turn them into dates, decimals...
+    return {name: model._meta.get_field(name).to_python(value) for name, value in row.items()}
+
+
+def _restore_batch(rows):
+    present = set(Booking.objects.filter(id__in=[row['id'] for row in rows]).values_list('id', flat=True))
+    rows = [row for row in rows if row['id'] not in present]  # Restored by a run that stopped early
+    if not rows:
+        return 0, 0
+
+    bookings, tickets = [], []
+    for row in rows:
+        booking_tickets = row.pop('tickets')
+        bookings.append(Booking(**_parse(Booking, row)))
+        tickets.extend(Ticket(**_parse(Ticket, ticket)) for ticket in booking_tickets)
+    # Scanner accounts deleted since then
+    users = set(User.objects.filter(id__in={t.verified_by_id for t in tickets} - {None}).values_list('id', flat=True))
+    for ticket in tickets:
+        if ticket.verified_by_id not in users:
+            ticket.verified_by_id = None
+
+    created_at = [instance.created_at for instance in itertools.chain(bookings, tickets)]
+    with transaction.atomic():
+        Booking.objects.bulk_create(bookings)
+        Ticket.objects.bulk_create(tickets)
+        # created_at is auto_now_add, so the archived dates are put back afterwards
+        for instance, value in zip(itertools.chain(bookings, tickets), created_at):
+            instance.created_at = value
+        Booking.objects.bulk_update(bookings, ['created_at'])
+        Ticket.objects.bulk_update(tickets, ['created_at'])
+    return len(bookings), len(tickets)
+
+
+def restore_event(event_id, batch_size=BATCH_SIZE):
+    """Put the archived bookings and tickets of the event back. Returns (bookings, tickets) restored."""
+    restored = [0, 0]
+    for archive in BookingArchive.objects.filter(event_id=event_id).order_by('id'):
+        with storage().open(archive.file, 'rb') as raw, gzip.open(raw, 'rt', encoding='utf-8') as lines:
+            header = json.loads(next(lines))
+            if header.get('version') != FORMAT_VERSION or header.get('event') != event_id:
+                raise ValueError(f'{archive.file} is not a version {FORMAT_VERSION} archive of event {event_id}')
+            rows = (json.loads(line) for line in lines)
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                bookings, tickets = _restore_batch(batch)
+                restored[0] += bookings
+                restored[1] += tickets
+        archive.delete()  # The file goes once that commits (signals.booking_archive_deleted)
+    return tuple(restored)
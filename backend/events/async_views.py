@@ -0,0 +1,169 @@
+"""
+Async versions of the hot endpoints: event listing, booking, payment and
+ticket verification. Under ASGI (eventra_backend/asgi.py) they replace
+the DRF views at the same URLs, see eventra_backend/asgi_urls.py.
+
+Responses are the same as the DRF views', both call the same code in
+bookings.py and checkin.py. Django 4.2's ORM and transactions are
+synchronous underneath, so each view does all of its database work in a
+single ``sync_to_async`` call (one hop to a worker thread instead of one
+per query) and stays on the event loop for the rest. A cached event
+listing is served without leaving the event loop at all.
+"""
+import json
+import math
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from rest_framework.exceptions import AuthenticationFailed, Throttled
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import bookings, checkin, idempotency, listing, scanner_auth, throttling, waiting_room
+from .views import EventListCreateView
+
+_event_list_view = EventListCreateView.as_view()
+_jwt = scanner_auth.ScannerAuthentication()
+
+NOT_FOUND = {'detail': 'Not found.'}
+NOT_AUTHENTICATED = 'Authentication credentials were not provided.'
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+def _csrf_exempt(view):
+    # django.views.decorators.csrf.csrf_exempt would turn the view back into a sync one on 4.2
+    view.csrf_exempt = True
+    return view
+
+
+def _method_not_allowed(request):
+    response = _json({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+    response['Allow'] = 'POST'
+    return response
+
+
+def _body(request):
+    """The request data like DRF's request.data, None if the JSON is malformed."""
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST
+
+
+def _parse_error():
+    return _json({'detail': 'JSON parse error'}, status=400)
+
+
+def _throttled(wait):
+    # Same body and header as DRF's Throttled
+    response = _json({'detail': Throttled(wait).detail}, status=429)
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+async def _idempotent(request, scope, data, action):
+    # A quick retry is answered from memory without leaving the event loop,
+    # everything else (key claim, action, stored response) in one thread hop
+    key = idempotency.key_of(request)
+    replay = idempotency.cached(key, scope, data)
+    if replay is None:
+        try:
+            replay = await sync_to_async(idempotency.run)(key, scope, data, action)
+        except Http404:
+            return _json(NOT_FOUND, status=404)
+    data, status_code, headers = replay
+    response = _json(data, status=status_code)
+    for name, value in headers.items():
+        response[name] = value
+    return response
+
+
+@_csrf_exempt
+async def event_list(request):
+    if request.method == 'GET':
+        wait = await throttling.acheck(request, 'listing')
+        if wait:
+            return _throttled(wait)
+        response = await listing.acached_response(request)
+        if response is not None:
+            return response
+    # Cache miss (or creating an event): the DRF view renders it and fills the cache
+    return await sync_to_async(_event_list_view)(request)
+
+
+@_csrf_exempt
+async def create_booking(request, event_id):
+    if request.method != 'POST':
+        return _method_not_allowed(request)
+    data = _body(request)
+    if data is None:
+        return _parse_error()
+    wait = await throttling.acheck(request, 'booking', data)
+    if wait:
+        return _throttled(wait)
+    admission_pass = waiting_room.pass_of(request)
+    return await _idempotent(request, f'create_booking:{event_id}', data,
+                             lambda: bookings.create_booking(event_id, data, admission_pass))
+
+
+@_csrf_exempt
+async def complete_payment(request, booking_id):
+    if request.method != 'POST':
+        return _method_not_allowed(request)
+    data = _body(request)
+    if data is None:
+        return _parse_error()
+    return await _idempotent(request, f'complete_payment:{booking_id}', data,
+                             lambda: bookings.complete_payment(booking_id, data.get('payment_id')))
+
+
+def _verify(request, otp_code, admin):
+    # Runs in a worker thread: token check (user lookup only for tokens without roles) and the verify UPDATE in one hop
+    try:
+        auth = _jwt.authenticate(request)
+    except AuthenticationFailed as e:
+        auth, detail = None, e.detail
+    else:
+        detail = NOT_AUTHENTICATED
+    if auth is None:
+        response = _json(detail if isinstance(detail, dict) else {'detail': detail}, status=401)
+        response['WWW-Authenticate'] = _jwt.authenticate_header(request)
+        return response
+
+    user = auth[0]
+    if admin:
+        if not user.is_staff:
+            return _json({'error': 'Admin access required'}, status=403)
+        message = 'Ticket verified successfully by Admin'
+    else:
+        if not scanner_auth.is_volunteer(user):
+            return _json({'error': 'Only volunteers can verify tickets'}, status=403)
+        message = 'Ticket verified successfully'
+
+    data, status_code = checkin.verify_single(otp_code, user, message)
+    return _json(data, status=status_code)
+
+
+@_csrf_exempt
+async def volunteer_verify_ticket(request):
+    if request.method != 'POST':
+        return _method_not_allowed(request)
+    data = _body(request)
+    if data is None:
+        return _parse_error()
+    return await sync_to_async(_verify)(request, data.get('otp_code'), admin=False)
+
+
+@_csrf_exempt
+async def admin_verify_ticket(request):
+    if request.method != 'POST':
+        return _method_not_allowed(request)
+    data = _body(request)
+    if data is None:
+        return _parse_error()
+    return await sync_to_async(_verify)(request, data.get('otp_code'), admin=True)
@@ -0,0 +1,144 @@
+"""
+The booking funnel: create a pending booking, then complete its payment.
+
+Shared by the DRF views in views.py and the async views in
+async_views.py, so both return exactly the same responses. Each function
+returns ``(response data, HTTP status)`` and raises Http404 for unknown
+ids.
+"""
+import random
+
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+
+from . import holds, inventory, outbox, stats, tickets, waiting_room, waitlist
+from .models import Booking, Event
+from .serializers import BookingSerializer, BookingWithTicketsSerializer
+
+NOT_ENOUGH_SEATS = {'error': 'Not enough seats available'}
+WAITLIST_FIRST = {'error': 'Seats go to the waitlist first, join it instead'}
+
+
+def create_booking(event_id, data, admission_pass=None):
+    """
+    Step 1: Create a booking with PENDING status and hold its seats
+    for SEAT_HOLD_MINUTES. Events with a waiting room want the customer's
+    admission pass (events/waiting_room.py).
+    """
+    event = get_object_or_404(Event, id=event_id)
+    refused = waiting_room.check_pass(event, admission_pass)
+    if refused is not None:
+        return refused
+    # Ensure tickets_requested is an integer, default to 1
+    tickets_requested = int(data.get('number_of_tickets', 1))
+
+    if inventory.seats_left(event) < tickets_requested:
+        return NOT_ENOUGH_SEATS, status.HTTP_400_BAD_REQUEST
+    # Seats freed while people are queued are theirs, even before promote gets to them
+    if waitlist.is_queued(event.id):
+        return WAITLIST_FIRST, status.HTTP_400_BAD_REQUEST
+
+    booking_data = data.copy()
+    booking_data['event'] = event.id
+    # Ensure payment status is pending for the first step
+    booking_data['payment_status'] = 'pending'
+    booking_data['number_of_tickets'] = tickets_requested
+
+    serializer = BookingSerializer(data=booking_data)
+    if not serializer.is_valid():
+        return serializer.errors, status.HTTP_400_BAD_REQUEST
+
+    # One booking per admission pass; given back if this one doesn't go through
+    if not waiting_room.claim_pass(event, admission_pass):
+        return waiting_room.USED_PASS, status.HTTP_403_FORBIDDEN
+    booked = False
+
+    # Hold the seats while the customer pays. Tickets are NOT created yet;
+    # if they never pay, `manage.py expire_holds` gives the seats back.
+    try:
+        with transaction.atomic():
+            inventory.take_seats(event, tickets_requested)
+            booking = serializer.save(hold_expires_at=holds.hold_expiry())
+            stats.record(event, pending_bookings=1, pending_seats=tickets_requested)
+        booked = True
+    except inventory.NotEnoughSeats:
+        return NOT_ENOUGH_SEATS, status.HTTP_400_BAD_REQUEST
+    finally:
+        if not booked:
+            waiting_room.release_pass(event, admission_pass)
+
+    # Return booking details without tickets for the next step (payment)
+    response_data = BookingSerializer(booking).data
+    response_data['message'] = "Booking initiated. Proceed to payment."
+    return response_data, status.HTTP_201_CREATED
+
+
+def complete_payment(booking_id, payment_id=None):
+    """Step 2: mark the booking paid, mint its tickets and queue the confirmation email."""
+    booking = get_object_or_404(Booking.objects.select_related('event'), id=booking_id)
+
+    # If already paid → return full serializer (required by frontend)
+    if booking.payment_status == 'completed':
+        serializer = BookingWithTicketsSerializer(booking)
+        return {"message": "Payment already completed.", **serializer.data}, status.HTTP_200_OK
+
+    if payment_id is None:
+        payment_id = f'PAY-{booking_id}-{random.randint(1000,9999)}'
+    event = booking.event
+
+    try:
+        with transaction.atomic():
+            # Mark payment as completed. These are conditional UPDATEs, so if two
+            # requests for the same booking race, only one of them gets claimed=1.
+            # A booking that still holds its seats just keeps them...
+            claimed = Booking.objects.filter(
+                id=booking.id, payment_status='pending', hold_expires_at__isnull=False
+            ).update(payment_status='completed', payment_id=payment_id, hold_expires_at=None)
+            previous_status = 'pending'
+
+            if not claimed:
+                # ...otherwise (hold already expired) the seats have to be taken again.
+                # Lock the row to know which status it leaves, the stats count pending ones
+                previous_status = Booking.objects.select_for_update().filter(id=booking.id).values_list(
+                    'payment_status', flat=True
+                ).first()
+                if previous_status not in (None, 'completed'):
+                    claimed = Booking.objects.filter(id=booking.id, payment_status=previous_status).update(
+                        payment_status='completed', payment_id=payment_id, hold_expires_at=None
+                    )
+                if claimed:
+                    # Deduct seats (atomic, never goes below zero)
+                    inventory.take_seats(event, booking.number_of_tickets)
+
+            if claimed:
+                count = booking.number_of_tickets
+                was_pending = previous_status == 'pending'
+                stats.record(
+                    event, paid_bookings=1, tickets_sold=count, revenue=booking.total_amount,
+                    pending_bookings=-1 if was_pending else 0, pending_seats=-count if was_pending else 0,
+                )
+
+                # Create tickets (one bulk INSERT)
+                if not booking.tickets.exists():
+                    tickets.mint_tickets(booking)
+
+                # Queue the confirmation email; `manage.py send_outbox` sends it,
+                # so this response doesn't wait on the mail server
+                if booking.email:
+                    outbox.queue_email(
+                        subject=f"Ticket Booking Confirmation for {event.title}",
+                        message=f"Your payment for {event.title} is complete. Booking ID: {booking.id}.",
+                        recipient_list=[booking.email],
+                    )
+    except inventory.NotEnoughSeats:
+        return NOT_ENOUGH_SEATS, status.HTTP_400_BAD_REQUEST
+
+    # Only reload what the UPDATEs changed, the joined event stays cached
+    booking.refresh_from_db(fields=['payment_status', 'payment_id', 'hold_expires_at'])
+
+    serializer = BookingWithTicketsSerializer(booking)
+    # Someone else completed it while we were waiting
+    if not claimed:
+        return {"message": "Payment already completed.", **serializer.data}, status.HTTP_200_OK
+    return serializer.data, status.HTTP_200_OK
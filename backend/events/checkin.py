@@ -0,0 +1,144 @@
+"""
+Ticket check-in at the gate.
+
+``verify_codes`` checks in any number of OTPs with one conditional
+``UPDATE ... WHERE is_verified = false RETURNING`` per chunk, so when two
+scanners submit the same code at the same moment exactly one of them sees
+it as ``verified`` and the other as ``already_used``. A second query only
+reads back the details for the response, and one UPDATE per event adds
+the check-ins to its stats (events/stats.py) in the same transaction.
+"""
+import collections
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import scanner_auth, stats
+from .models import Booking, Ticket
+
+VERIFIED = 'verified'
+ALREADY_USED = 'already_used'
+INVALID = 'invalid'
+
+CHUNK_SIZE = 500  # Keeps the IN (...) list under every backend's parameter limit
+
+
+def can_verify(user):
+    # Volunteers and admins can both check people in (a TokenUser for scanners, see scanner_auth.py)
+    return user.is_staff or scanner_auth.is_volunteer(user)
+
+
+def _mark_verified(codes, user, now, event_id):
+    """Verify the still-unverified tickets among `codes`, return the codes we flipped."""
+    if connection.vendor in ('postgresql', 'sqlite'):
+        qn = connection.ops.quote_name
+        placeholders = ', '.join(['%s'] * len(codes))
+        params = [True, connection.ops.adapt_datetimefield_value(now), user.id, *codes, False]
+        event_filter = ''
+        if event_id is not None:
+            event_filter = (
+                f"AND {qn('booking_id')} IN (SELECT {qn('id')} FROM {qn(Booking._meta.db_table)} "
+                f"WHERE {qn('event_id')} = %s) "
+            )
+            params.append(event_id)
+        sql = (
+            f"UPDATE {qn(Ticket._meta.db_table)} "
+            f"SET {qn('is_verified')} = %s, {qn('verified_at')} = %s, {qn('verified_by_id')} = %s "
+            f"WHERE {qn('otp_code')} IN ({placeholders}) AND {qn('is_verified')} = %s "
+            f"{event_filter}"
+            f"RETURNING {qn('otp_code')}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return {row[0] for row in cursor.fetchall()}
+
+    # No UPDATE ... RETURNING here: lock the rows first, then flip exactly those
+    with transaction.atomic():
+        unverified = _tickets(codes, event_id).filter(is_verified=False)
+        flipped = set(unverified.select_for_update().values_list('otp_code', flat=True))
+        Ticket.objects.filter(otp_code__in=flipped).update(is_verified=True, verified_at=now, verified_by_id=user.id)
+    return flipped
+
+
+def _tickets(codes, event_id):
+    tickets = Ticket.objects.filter(otp_code__in=codes)
+    if event_id is not None:
+        tickets = tickets.filter(booking__event_id=event_id)
+    return tickets
+
+
+def verify_codes(otp_codes, user, event_id=None):
+    """
+    Check in a batch of OTP codes. Returns one result dict per input code, in order,
+    with 'status' set to VERIFIED, ALREADY_USED or INVALID.
+    With `event_id`, codes of other events' tickets count as INVALID.
+    """
+    codes = [str(code).strip() for code in otp_codes]
+    unique_codes = list(dict.fromkeys(code for code in codes if code))
+    now = timezone.now()
+
+    # The check-ins and the event stats counting them commit together
+    with transaction.atomic():
+        flipped = set()
+        for start in range(0, len(unique_codes), CHUNK_SIZE):
+            flipped |= _mark_verified(unique_codes[start:start + CHUNK_SIZE], user, now, event_id)
+
+        found = {}
+        for start in range(0, len(unique_codes), CHUNK_SIZE):
+            chunk = unique_codes[start:start + CHUNK_SIZE]
+            for ticket in _tickets(chunk, event_id).select_related('booking__event', 'verified_by'):
+                found[ticket.otp_code] = ticket
+
+        checked_in = collections.Counter(found[code].booking.event for code in flipped if code in found)
+        for event, count in checked_in.items():
+            stats.record(event, checked_in=count)
+
+    results = []
+    seen = set()
+    for code in codes:
+        ticket = found.get(code)
+        if ticket is None:
+            results.append({'otp_code': code, 'status': INVALID})
+            continue
+
+        result = {
+            'otp_code': code,
+            'status': VERIFIED if code in flipped and code not in seen else ALREADY_USED,
+            'event': ticket.booking.event.title,
+            'customer': ticket.booking.customer_name,
+            'ticket_number': ticket.ticket_number,
+            'verified_at': ticket.verified_at,
+            'verified_by': ticket.verified_by.username if ticket.verified_by else None,
+        }
+        seen.add(code)
+        results.append(result)
+    return results
+
+
+def verify_single(otp_code, user, success_message):
+    """The single-ticket verify endpoints: returns (response data, HTTP status)."""
+    if not otp_code:
+        return {'error': 'OTP code is required'}, 400
+
+    result = verify_codes([otp_code], user)[0]
+
+    if result['status'] == INVALID:
+        return {'error': 'Invalid OTP code'}, 404
+
+    if result['status'] == ALREADY_USED:
+        return {
+            'error': 'Ticket already verified',
+            'verified_at': result['verified_at'],
+            'verified_by': result['verified_by']
+        }, 400
+
+    return {
+        'success': True,
+        'message': success_message,
+        'ticket': {
+            'otp_code': result['otp_code'],
+            'event': result['event'],
+            'customer': result['customer'],
+            'ticket_number': result['ticket_number']
+        }
+    }, 200
@@ -0,0 +1,142 @@
+"""
+Read replica routing.
+
+Every query goes to ``default`` (the primary) unless the view opted in
+with ``@replica_reads``. For GET/HEAD requests those views read from one
+of ``settings.DATABASE_REPLICAS``, picked once per request so the whole
+response comes from a single snapshot. Writes always go to the primary.
+
+Read-your-writes: after any successful POST/PUT/PATCH/DELETE,
+``PinAfterWriteMiddleware`` pins the client (by IP) to the primary for
+REPLICA_STICKY_SECONDS, so someone who just booked or paid sees their
+own booking and the new seat count instead of a lagging replica.
+
+A replica that fails with a database error is skipped for
+REPLICA_RETRY_SECONDS and the request is served again from the primary.
+
+With no replicas configured all of this is a no-op.
+"""
+import contextlib
+import contextvars
+import functools
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import InterfaceError, OperationalError
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+REPLICA_RETRY_SECONDS = 30
+
+# Replica alias this request reads from, None = primary
+_replica = contextvars.ContextVar('events_db_replica', default=None)
+
+# alias -> time.monotonic() until which it is skipped
+_down = {}
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def choose_replica():
+    now = time.monotonic()
+    healthy = [alias for alias in replicas() if _down.get(alias, 0) <= now]
+    return random.choice(healthy) if healthy else None
+
+
+def mark_down(alias):
+    logger.warning('Replica %s failed, reading from the primary for %ss', alias, REPLICA_RETRY_SECONDS)
+    _down[alias] = time.monotonic() + REPLICA_RETRY_SECONDS
+
+
+def _pin_key(request):
+    return f"db:pin:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def pin(request):
+    cache.set(_pin_key(request), 1, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(request):
+    return bool(cache.get(_pin_key(request)))
+
+
+@contextlib.contextmanager
+def use_replica(alias):
+    token = _replica.set(alias)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def use_primary():
+    return use_replica(None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _replica.get() or 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db not in replicas()
+
+
+def replica_reads(view):
+    """Let GET/HEAD requests of this view read from a replica."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in SAFE_METHODS or not replicas() or is_pinned(request):
+            return view(request, *args, **kwargs)
+        alias = choose_replica()
+        if alias is None:
+            return view(request, *args, **kwargs)
+        try:
+            with use_replica(alias):
+                return view(request, *args, **kwargs)
+        except (OperationalError, InterfaceError):
+            mark_down(alias)
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class PinAfterWriteMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def should_pin(self, request, response):
+        return request.method not in SAFE_METHODS and response.status_code < 400 and replicas()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if self.should_pin(request, response):
+            pin(request)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.should_pin(request, response):
+            await cache.aset(_pin_key(request), 1, settings.REPLICA_STICKY_SECONDS)
+        return response
@@ -0,0 +1,88 @@
+"""
+Streaming exports of an event's bookings (and of the admin's filtered
+booking and ticket changelists).
+
+Rows are read with ``.iterator()`` (tickets prefetched per chunk) and
+written out as they come, so memory stays flat however many bookings the
+event has. The JSON export goes through the fast serializer
+(events/fast_serializers.py) when it is on.
+"""
+import csv
+
+from django.http import StreamingHttpResponse
+
+from . import fast_serializers, renderers
+from .serializers import BookingWithTicketsSerializer
+
+CHUNK_SIZE = 500
+
+CSV_COLUMNS = [
+    'id', 'customer_name', 'roll_number', 'section', 'email', 'phone',
+    'number_of_tickets', 'total_amount', 'payment_status', 'created_at',
+    'ticket_otps', 'tickets_verified',
+]
+
+TICKET_CSV_COLUMNS = [
+    'id', 'event', 'booking', 'customer_name', 'ticket_number', 'otp_code', 'is_verified', 'verified_at',
+]
+
+
+class _Echo:
+    # csv.writer wants a file, this just hands back each formatted line
+    def write(self, value):
+        return value
+
+
+def _json_rows(bookings):
+    fast = fast_serializers.for_class(BookingWithTicketsSerializer)
+    if fast is not None:
+        rows = fast.iterate(bookings, chunk_size=CHUNK_SIZE)
+    else:
+        rows = (BookingWithTicketsSerializer(booking).data for booking in bookings.iterator(chunk_size=CHUNK_SIZE))
+    yield b'['
+    for i, data in enumerate(rows):
+        yield (b',' if i else b'') + renderers.dumps(data)
+    yield b']'
+
+
+def _csv_rows(bookings):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for booking in bookings.iterator(chunk_size=CHUNK_SIZE):
+        tickets = list(booking.tickets.all())
+        yield writer.writerow([
+            booking.id, booking.customer_name, booking.roll_number, booking.section,
+            booking.email or '', booking.phone, booking.number_of_tickets, booking.total_amount,
+            booking.payment_status, booking.created_at.isoformat(),
+            ' '.join(ticket.otp_code for ticket in tickets),
+            sum(1 for ticket in tickets if ticket.is_verified),
+        ])
+
+
+def _ticket_csv_rows(tickets):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(TICKET_CSV_COLUMNS)
+    rows = tickets.values_list(
+        'id', 'booking__event__title', 'booking_id', 'booking__customer_name', 'ticket_number', 'otp_code',
+        'is_verified', 'verified_at',
+    )
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        *values, verified_at = row
+        yield writer.writerow([*values, verified_at.isoformat() if verified_at else ''])
+
+
+def stream_tickets(tickets, filename):
+    response = StreamingHttpResponse(_ticket_csv_rows(tickets), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
+
+def stream_bookings(bookings, kind, filename):
+    """`bookings` should already have select_related('event') / prefetch_related('tickets')."""
+    if kind == 'csv':
+        response = StreamingHttpResponse(_csv_rows(bookings), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    else:
+        response = StreamingHttpResponse(_json_rows(bookings), content_type='application/json')
+        response['Content-Disposition'] = f'attachment; filename="{filename}.json"'
+    return response
@@ -0,0 +1,224 @@
+"""
+Fast path for serializing large read-only lists: the full event listing,
+and an event's bookings (the unpaged list and the JSON export).
+
+DRF's ModelSerializer builds a model instance per row, then calls every
+field's get_attribute / to_representation, following dotted sources such
+as ``event.title`` through the related object. On thousands of rows that
+is most of the CPU time of the response.
+
+``FastSerializer`` compiles a serializer class once into (output name,
+ORM lookup, converter) mappers, reads the rows with ``.values()`` (a join
+for dotted sources, one query per chunk for a nested ``many=True``
+serializer) and builds the dicts directly. The output is the same as
+DRF's: plain strings, numbers and booleans are passed through, dates and
+times get ``isoformat()``, file fields their URL, and anything else
+(decimals, datetimes) still goes through the DRF field's own
+to_representation. SerializerMethodFields need a fast version passed in
+``method_fields``; a field it can't compile raises ``Unsupported``.
+
+Paged responses are left to DRF, their pages are small and the paginator
+has already built the instances. FAST_SERIALIZERS=False in the .env
+(Fast_serializers) turns the fast path off.
+"""
+import collections
+import functools
+import itertools
+
+from django.conf import settings
+from rest_framework import serializers
+from rest_framework.settings import ISO_8601, api_settings
+
+from . import metrics, posters
+from .serializers import (
+    BookingWithTicketsSerializer, EventCompactSerializer, EventListSerializer, TicketSerializer,
+)
+
+CHUNK_SIZE = 2000
+
+
+class Unsupported(Exception):
+    pass
+
+
+# Field types whose to_representation gives back what the database returns
+_PASS_THROUGH = (
+    serializers.CharField, serializers.IntegerField, serializers.BooleanField,
+    serializers.ChoiceField, serializers.ReadOnlyField,
+)
+# Still converted by the DRF field itself, only the instance and attribute lookups are skipped
+_DRF_CONVERTED = (serializers.DecimalField, serializers.DateTimeField, serializers.FloatField)
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+def _file_url(model_field):
+    storage = model_field.storage
+
+    def bind(context):
+        request = context.get('request')
+
+        def url(name):
+            if not name:
+                return None
+            value = storage.url(name)
+            return request.build_absolute_uri(value) if request is not None else value
+        return url
+    return bind
+
+
+# Kinds of compiled fields
+VALUE, METHOD, NESTED = 'value', 'method', 'nested'
+
+
+class FastSerializer:
+    def __init__(self, serializer_class, method_fields=None):
+        """
+        `method_fields`: {name: (lookups, bind)} for SerializerMethodFields, where
+        bind(context) returns a function taking the looked up values.
+        """
+        self.serializer_class = serializer_class
+        self.method_fields = method_fields or {}
+
+    @functools.cached_property
+    def fields(self):
+        """
+        [(name, kind, spec)] in the serializer's field order:
+        VALUE: (lookup, bind), bind(context) -> converter or None to pass the value through
+        METHOD: (lookups, bind), bind(context) -> function of the values
+        NESTED: (related model, foreign key name, FastSerializer of the child)
+        """
+        serializer = self.serializer_class()
+        model = serializer.Meta.model
+        fields = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name in self.method_fields:
+                lookups, bind = self.method_fields[name]
+                fields.append((name, METHOD, (tuple(lookups), bind)))
+            elif isinstance(field, serializers.ListSerializer):
+                relation = model._meta.get_field(field.source)
+                child = FastSerializer(type(field.child))
+                fields.append((name, NESTED, (relation.related_model, relation.field.name, child)))
+            elif field.source == '*' or isinstance(field, (serializers.SerializerMethodField,
+                                                           serializers.BaseSerializer)):
+                raise Unsupported(f'{self.serializer_class.__name__}.{name}')
+            else:
+                fields.append((name, VALUE, ('__'.join(field.source_attrs), self._converter(field, model))))
+        return fields
+
+    def _converter(self, field, model):
+        if isinstance(field, serializers.FileField):
+            if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+                raise Unsupported(field.field_name)
+            return _file_url(model._meta.get_field(field.source))
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            # .values() already gives the id
+            if field.pk_field is not None:
+                raise Unsupported(field.field_name)
+            return None
+        if isinstance(field, serializers.DateField):
+            if getattr(field, 'format', api_settings.DATE_FORMAT) != ISO_8601:
+                raise Unsupported(field.field_name)
+            return lambda context: _isoformat
+        if isinstance(field, serializers.TimeField):
+            if getattr(field, 'format', api_settings.TIME_FORMAT) != ISO_8601:
+                raise Unsupported(field.field_name)
+            return lambda context: _isoformat
+        if isinstance(field, _DRF_CONVERTED):
+            return lambda context: field.to_representation
+        if isinstance(field, _PASS_THROUGH):
+            return None
+        raise Unsupported(field.field_name)
+
+    def lookups(self):
+        lookups = {}
+        for _, kind, spec in self.fields:
+            if kind == VALUE:
+                lookups[spec[0]] = None
+            elif kind == METHOD:
+                lookups.update(dict.fromkeys(spec[0]))
+            else:
+                lookups['pk'] = None
+        return list(lookups)
+
+    def _children(self, spec, context, parent_ids):
+        """{parent id: [child dicts]} in one query."""
+        related_model, foreign_key, child = spec
+        lookups = child.lookups()
+        if foreign_key not in lookups:
+            lookups.append(foreign_key)
+        rows = list(
+            related_model.objects.filter(**{f'{foreign_key}__in': parent_ids}).order_by('pk').values(*lookups)
+        )
+        by_parent = collections.defaultdict(list)
+        for row, item in zip(rows, child._build(rows, context)):
+            by_parent[row[foreign_key]].append(item)
+        return by_parent
+
+    def _build(self, rows, context):
+        """The dicts of `rows` (from ``.values(*self.lookups())``)."""
+        bound = []
+        for name, kind, spec in self.fields:
+            if kind == NESTED:
+                bound.append((name, kind, self._children(spec, context, [row['pk'] for row in rows])))
+            else:
+                key, bind = spec
+                bound.append((name, kind, (key, bind(context) if bind is not None else None)))
+
+        result = []
+        for row in rows:
+            item = {}
+            for name, kind, spec in bound:
+                if kind == VALUE:
+                    key, convert = spec
+                    value = row[key]
+                    item[name] = value if value is None or convert is None else convert(value)
+                elif kind == METHOD:
+                    keys, function = spec
+                    item[name] = function(*[row[key] for key in keys])
+                else:
+                    item[name] = spec.get(row['pk'], [])
+            result.append(item)
+        return result
+
+    def iterate(self, queryset, context=None, chunk_size=CHUNK_SIZE):
+        """Yield the serialized rows of `queryset` (in its order), a chunk at a time."""
+        context = context or {}
+        rows = queryset.prefetch_related(None).values(*self.lookups()).iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return
+            with metrics.timed_serialization():
+                items = self._build(chunk, context)
+            yield from items
+
+    def serialize(self, queryset, context=None):
+        """The list DRF's ``serializer_class(queryset, many=True).data`` would give."""
+        return list(self.iterate(queryset, context))
+
+
+def _poster_variants(context):
+    request = context.get('request')
+    return lambda poster, variants: posters.variant_urls_of(poster, variants, request)
+
+
+_POSTER_VARIANTS = {'poster_variants': (('poster', 'poster_variants'), _poster_variants)}
+
+REGISTRY = {
+    EventListSerializer: FastSerializer(EventListSerializer, method_fields=_POSTER_VARIANTS),
+    EventCompactSerializer: FastSerializer(EventCompactSerializer, method_fields=_POSTER_VARIANTS),
+    BookingWithTicketsSerializer: FastSerializer(BookingWithTicketsSerializer),
+    TicketSerializer: FastSerializer(TicketSerializer),
+}
+
+
+def for_class(serializer_class):
+    """The FastSerializer standing in for `serializer_class`, None if there is none or it is turned off."""
+    if not settings.FAST_SERIALIZERS:
+        return None
+    return REGISTRY.get(serializer_class)
@@ -0,0 +1,106 @@
+"""
+Time-boxed seat holds for pending bookings.
+
+create_booking takes the seats straight away and stamps the booking with
+``hold_expires_at``. If the customer pays before then, complete_payment
+just keeps those seats. If they walk away, the ``expire_holds`` command
+flips the stale bookings to ``expired`` and gives their seats back, a
+batch at a time, with one UPDATE per batch plus one per event touched.
+Expired bookings are deleted after a retention window so the Booking
+table only ever holds real sales and live checkouts.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import inventory, stats, waitlist
+from .models import Booking, Event
+
+
+def hold_expiry():
+    """When a hold placed right now runs out."""
+    return timezone.now() + datetime.timedelta(minutes=settings.SEAT_HOLD_MINUTES)
+
+
+def _expire(ids, now):
+    """Expire the still-pending, stale bookings among `ids`; [(event_id, number_of_tickets)] of those flipped."""
+    if connection.vendor in ('postgresql', 'sqlite'):
+        qn = connection.ops.quote_name
+        placeholders = ', '.join(['%s'] * len(ids))
+        sql = (
+            f"UPDATE {qn(Booking._meta.db_table)} SET {qn('payment_status')} = %s, {qn('hold_expires_at')} = NULL "
+            f"WHERE {qn('id')} IN ({placeholders}) AND {qn('payment_status')} = %s AND {qn('hold_expires_at')} <= %s "
+            f"RETURNING {qn('event_id')}, {qn('number_of_tickets')}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, ['expired', *ids, 'pending', connection.ops.adapt_datetimefield_value(now)])
+            return cursor.fetchall()
+
+    # No UPDATE ... RETURNING here: flip the rows one by one and keep those whose UPDATE matched
+    flipped = []
+    for booking in Booking.objects.filter(id__in=ids).values('id', 'event_id', 'number_of_tickets'):
+        if Booking.objects.filter(id=booking['id'], payment_status='pending', hold_expires_at__lte=now).update(
+            payment_status='expired', hold_expires_at=None
+        ):
+            flipped.append((booking['event_id'], booking['number_of_tickets']))
+    return flipped
+
+
+def expire_stale_holds(batch_size=500, now=None):
+    """
+    Expire one batch of pending bookings whose hold ran out.
+    Returns (bookings expired, seats released); call again until it returns 0 bookings,
+    which it only does once there are no stale holds left.
+    """
+    now = now or timezone.now()
+
+    while True:
+        with transaction.atomic():
+            # Oldest holds first; walks booking_pending_hold_idx
+            stale = Booking.objects.filter(
+                payment_status='pending', hold_expires_at__lte=now
+            ).order_by('hold_expires_at')
+            if connection.features.has_select_for_update_skip_locked:
+                # Let several sweepers run side by side without stepping on each other
+                stale = stale.select_for_update(skip_locked=True)
+            ids = list(stale.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return 0, 0
+
+            # Only the rows this call flipped give seats back: a sweeper that couldn't skip locked rows, or
+            # complete_payment reclaiming a hold, may have got to some of them first
+            flipped = _expire(ids, now)
+            if not flipped:
+                # All of them; they no longer match, the next SELECT gets the batch after them
+                continue
+
+            # Hand the seats back, one UPDATE per event rather than per booking
+            seats_by_event, bookings_by_event = {}, {}
+            for event_id, seats in flipped:
+                seats_by_event[event_id] = seats_by_event.get(event_id, 0) + seats
+                bookings_by_event[event_id] = bookings_by_event.get(event_id, 0) + 1
+            for event in Event.objects.filter(id__in=seats_by_event):
+                inventory.release_seats(event, seats_by_event[event.id])
+                # The seats go to the event's waitlist first, if it has one
+                waitlist.promote_on_commit(event.id)
+                stats.record(event, pending_bookings=-bookings_by_event[event.id],
+                             pending_seats=-seats_by_event[event.id])
+
+        return len(flipped), sum(seats_by_event.values())
+
+
+def purge_expired(older_than, batch_size=500):
+    """Delete expired bookings created before `older_than`, a batch at a time."""
+    deleted = 0
+    while True:
+        ids = list(
+            Booking.objects.filter(payment_status='expired', created_at__lt=older_than)
+            .order_by('created_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        Booking.objects.filter(id__in=ids, payment_status='expired').delete()
+        deleted += len(ids)
@@ -0,0 +1,211 @@
+"""
+Idempotency keys for create_booking and complete_payment.
+
+A client that sends ``Idempotency-Key: <unique string>`` can retry the
+request (timeouts, double clicks, flaky mobile networks) and get the
+first response back instead of a second booking or a second payment run:
+
+1. The key is claimed with an INSERT on its unique column before the
+   action runs. A concurrent retry hits the unique constraint and gets
+   409 (still running) instead of racing the first request to the seats.
+2. The response is stored on the key once the action returns, with a
+   fingerprint (sha256 of the endpoint and the request body). A retry
+   with the same body replays it with ``Idempotent-Replayed: true``; the
+   same key with a different body is a client bug and gets 422.
+3. Finished responses are also kept in a small per-process LRU for
+   CACHE_SECONDS, so quick retries don't touch the database at all.
+
+Keys live for IDEMPOTENCY_KEY_HOURS (``purge`` runs with the expire_holds
+sweep). If the action raises or returns a 5xx, the key is released so
+the retry runs for real. So it is for 403 and 429: the only ones the
+actions give are the waiting room's refusals (events/waiting_room.py),
+made before anything ran, and the retry after ``wait_seconds`` or with a
+new admission pass has to get in.
+
+A claim with no response yet can't tell a crashed worker from a slow
+one, and taking over a slow one's claim runs the action twice (a second
+booking). It is only taken over after IDEMPOTENCY_LOCK_SECONDS, which
+must stay above the longest a request can run (the server's or the
+proxy's request timeout), so the worker holding it is gone by then.
+"""
+import collections
+import datetime
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+
+CACHE_SIZE = 10000
+CACHE_SECONDS = 60
+
+REPLAYED = {'Idempotent-Replayed': 'true'}
+# Refused before the action did anything, the retry must run again
+RELEASED_STATUSES = {403, 429}
+
+
+def key_of(request):
+    """The request's Idempotency-Key header, None if it has none."""
+    return request.META.get(HEADER, '').strip() or None
+
+
+def fingerprint(scope, payload):
+    if hasattr(payload, 'lists'):
+        # QueryDict (form posts): keep repeated fields
+        payload = dict(payload.lists())
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':'), cls=JSONEncoder)
+    return hashlib.sha256(f'{scope}\n{body}'.encode()).hexdigest()
+
+
+class _LRU:
+    """key -> (fingerprint, data, status), dropped after `ttl` seconds."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_recent = _LRU(CACHE_SIZE, CACHE_SECONDS)
+
+
+def _reused():
+    return {'error': 'This Idempotency-Key was already used for a different request'}, 422, {}
+
+
+def _replay(fp, entry):
+    stored_fp, data, status = entry
+    if stored_fp != fp:
+        return _reused()
+    return data, status, REPLAYED
+
+
+def cached(key, scope, payload):
+    """
+    The in-memory replay for this key as (data, status, headers), None on a miss.
+    Doesn't touch the database, so the async views call it on the event loop.
+    """
+    if key is None or len(key) > MAX_KEY_LENGTH:
+        return None
+    entry = _recent.get(key)
+    if entry is None:
+        return None
+    return _replay(fingerprint(scope, payload), entry)
+
+
+def _claim(key, fp):
+    """Returns (IdempotencyKey, True) if we own the key now, (existing one, False) otherwise."""
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(key=key, fingerprint=fp, created_at=now), True
+    except IntegrityError:
+        pass
+
+    record = IdempotencyKey.objects.filter(key=key).first()
+    if record is None:
+        # Purged in between, it's ours
+        return _claim(key, fp)
+
+    expired = record.created_at < now - datetime.timedelta(hours=settings.IDEMPOTENCY_KEY_HOURS)
+    lock = datetime.timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+    abandoned = record.status_code is None and record.created_at < now - lock
+    if expired or abandoned:
+        # Conditional on created_at, so only one retry takes it over
+        taken = IdempotencyKey.objects.filter(id=record.id, created_at=record.created_at).update(
+            fingerprint=fp, status_code=None, response=None, created_at=now
+        )
+        if taken:
+            record.fingerprint, record.status_code, record.response, record.created_at = fp, None, None, now
+            return record, True
+        record.refresh_from_db()
+    return record, False
+
+
+def run(key, scope, payload, action):
+    """
+    Run `action` (returning (data, status)) at most once per key.
+    Returns (data, status, extra response headers).
+    """
+    if key is None:
+        data, status = action()
+        return data, status, {}
+    if len(key) > MAX_KEY_LENGTH:
+        return {'error': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters'}, 400, {}
+
+    fp = fingerprint(scope, payload)
+    entry = _recent.get(key)
+    if entry is not None:
+        return _replay(fp, entry)
+
+    record, owned = _claim(key, fp)
+    if not owned:
+        if record.fingerprint != fp:
+            return _reused()
+        if record.status_code is None:
+            return {'error': 'A request with this Idempotency-Key is still being processed'}, 409, {'Retry-After': '1'}
+        _recent.put(key, (fp, record.response, record.status_code))
+        return record.response, record.status_code, REPLAYED
+
+    try:
+        data, status = action()
+    except BaseException:
+        IdempotencyKey.objects.filter(id=record.id).delete()
+        raise
+    if status >= 500 or status in RELEASED_STATUSES:
+        IdempotencyKey.objects.filter(id=record.id).delete()
+        return data, status, {}
+
+    # Store what the client saw, with dates and decimals already turned into JSON
+    snapshot = json.loads(json.dumps(data, cls=JSONEncoder))
+    IdempotencyKey.objects.filter(id=record.id).update(status_code=status, response=snapshot)
+    _recent.put(key, (fp, snapshot, status))
+    return data, status, {}
+
+
+def purge(older_than, batch_size=500):
+    """Delete keys created before `older_than`, a batch at a time."""
+    deleted = 0
+    while True:
+        ids = list(
+            IdempotencyKey.objects.filter(created_at__lt=older_than)
+            .order_by('created_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        IdempotencyKey.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
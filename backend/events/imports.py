@@ -0,0 +1,193 @@
+"""
+Bulk import of events and past bookings from CSV or JSON Lines files
+(``manage.py bulk_import`` and POST /api/import/<kind>/ for admins).
+
+The file is read one row at a time and handled CHUNK_SIZE rows at a
+time: every row is validated with the API's serializer (EventSerializer,
+BookingImportSerializer), the valid rows of a chunk are written with one
+bulk_create per table inside one transaction, and every rejected row is
+reported with its line number and errors. Only one chunk is ever held in
+memory, whatever the size of the file.
+
+bulk_create skips Model.save() and the post_save signals, so what they
+would have done is done here, once per chunk:
+
+* events: ``available_seats`` defaults to ``total_seats``, each event
+  gets its EventStats row and the listing cache is invalidated.
+* bookings: ``total_amount`` is the event's price times the tickets.
+  Only finished bookings can be imported (completed, failed, expired), a
+  seat hold can't. Completed ones take their seats, get their tickets
+  minted in one INSERT and are added to the event stats; a booking that
+  no longer fits in its event is rejected.
+"""
+import collections
+import csv
+import itertools
+import json
+
+from django.db import transaction
+
+from . import inventory, listing, stats, tickets
+from .models import Booking, Event, EventStats
+from .serializers import BookingImportSerializer, EventSerializer
+
+CHUNK_SIZE = 500
+FORMATS = ('csv', 'jsonl')
+KINDS = ('events', 'bookings')
+
+
+def guess_format(filename):
+    """'csv' or 'jsonl' from the file name, None if it's neither."""
+    name = filename.lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return None
+
+
+def read_rows(file, fmt):
+    """
+    Yield (line number, row, error) from a text file, one of row / error
+    being None. Empty CSV cells count as not given.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, {key: value for key, value in row.items() if key and value not in ('', None)}, None
+        return
+
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, None, {'non_field_errors': [f'Invalid JSON: {e}']}
+            continue
+        if not isinstance(row, dict):
+            yield number, None, {'non_field_errors': ['Expected a JSON object']}
+        else:
+            yield number, row, None
+
+
+class Report:
+    """What an import did. Rejected rows go to `on_error(line, errors)` as they are found."""
+
+    def __init__(self, on_error=None):
+        self.created = 0
+        self.failed = 0
+        self.on_error = on_error
+
+    def reject(self, line, errors):
+        self.failed += 1
+        if self.on_error is not None:
+            self.on_error(line, errors)
+
+
+def _write_events(chunk, report):
+    events = []
+    for line, data in chunk:
+        data.setdefault('available_seats', data.get('total_seats', 0))
+        events.append(Event(**data))
+
+    with transaction.atomic():
+        events = Event.objects.bulk_create(events)
+        EventStats.objects.bulk_create([EventStats(event=event) for event in events])
+        listing.invalidate_on_commit()
+    report.created += len(events)
+
+
+def _fit_bookings(event, bookings, report):
+    """Take the seats of `event`'s completed bookings, returns the bookings that fit."""
+    try:
+        inventory.take_seats(event, sum(booking.number_of_tickets for _, booking in bookings))
+        return bookings
+    except inventory.NotEnoughSeats:
+        pass
+    # Not all of them fit: one at a time, so the ones that do still go in
+    fitting = []
+    for line, booking in bookings:
+        try:
+            inventory.take_seats(event, booking.number_of_tickets)
+        except inventory.NotEnoughSeats:
+            report.reject(line, {'number_of_tickets': ['Not enough seats available']})
+        else:
+            fitting.append((line, booking))
+    return fitting
+
+
+def _write_bookings(chunk, report):
+    # One query for the events of the whole chunk instead of one per row
+    events = Event.objects.in_bulk({data['event'] for _, data in chunk})
+    rows = []  # (line, booking, created_at from the file)
+    for line, data in chunk:
+        event = events.get(data.pop('event'))
+        if event is None:
+            report.reject(line, {'event': ['Event not found']})
+            continue
+        created_at = data.pop('created_at', None)
+        booking = Booking(event=event, total_amount=event.ticket_price * data['number_of_tickets'], **data)
+        rows.append((line, booking, created_at))
+
+    with transaction.atomic():
+        paid = collections.defaultdict(list)
+        for line, booking, _ in rows:
+            if booking.payment_status == 'completed':
+                paid[booking.event_id].append((line, booking))
+        for event_id, event_rows in paid.items():
+            paid[event_id] = [booking for _, booking in _fit_bookings(events[event_id], event_rows, report)]
+        fitting = {id(booking) for event_bookings in paid.values() for booking in event_bookings}
+        rows = [row for row in rows if row[1].payment_status != 'completed' or id(row[1]) in fitting]
+
+        Booking.objects.bulk_create([booking for _, booking, _ in rows])
+        # created_at is auto_now_add, so dates from the file are put back afterwards
+        dated = []
+        for _, booking, created_at in rows:
+            if created_at is not None:
+                booking.created_at = created_at
+                dated.append(booking)
+        if dated:
+            Booking.objects.bulk_update(dated, ['created_at'])
+
+        if fitting:
+            tickets.mint_for_bookings([booking for event_bookings in paid.values() for booking in event_bookings])
+        for event_id, event_bookings in paid.items():
+            stats.record(
+                events[event_id], paid_bookings=len(event_bookings),
+                tickets_sold=sum(booking.number_of_tickets for booking in event_bookings),
+                revenue=sum(booking.total_amount for booking in event_bookings),
+            )
+    report.created += len(rows)
+
+
+def _validate(kind, data):
+    if kind == 'events':
+        serializer = EventSerializer(data=data)
+    else:
+        serializer = BookingImportSerializer(data=data)
+    if not serializer.is_valid():
+        return None, serializer.errors
+    return dict(serializer.validated_data), None
+
+
+def import_rows(kind, rows, chunk_size=CHUNK_SIZE, on_error=None):
+    """Import (line, row, error) tuples from ``read_rows`` as `kind` ('events' or 'bookings'). Returns a Report."""
+    report = Report(on_error)
+    write = _write_events if kind == 'events' else _write_bookings
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, chunk_size))
+        if not batch:
+            return report
+        chunk = []
+        for line, row, error in batch:
+            data = None
+            if error is None:
+                data, error = _validate(kind, row)
+            if error is not None:
+                report.reject(line, error)
+            else:
+                chunk.append((line, data))
+        if chunk:
+            write(chunk, report)
@@ -0,0 +1,195 @@
+"""
+Seat inventory for events.
+
+Every seat change goes through this module so the database does the
+counting: a decrement is a single conditional UPDATE
+(``available_seats >= n``), which means two workers can never both take
+the last seat, and nothing here reads a count into Python and writes it
+back.
+
+Normal events keep their count on the Event row. Hot events can be
+switched to sharded mode with ``enable_sharding``: the count is split
+across SeatShard rows and each booking only locks the shard it lands on,
+so thousands of concurrent payments don't all queue on one row lock.
+In sharded mode ``Event.available_seats`` is only a display value that
+``sync_available_seats`` refreshes (see the ``sync_seats`` command).
+
+Capacity edits (admin, API) go through ``change_capacity`` from
+Event.save, which never writes the counter itself: a save from an
+instance read before a booking would give the booked seats back.
+
+Seat counts don't invalidate the cached event listing (events/listing.py):
+during an on-sale rush every booking would empty it. Cached pages show
+them up to EVENT_LIST_CACHE_SECONDS late; bookings always check the live
+count. Switching sharding on or off (admin actions) still invalidates.
+"""
+import random
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest, Least
+
+from . import listing
+from .models import Event, SeatShard
+
+
+class NotEnoughSeats(Exception):
+    pass
+
+
+def seats_left(event):
+    """Current number of seats that can still be taken for this event."""
+    if event.seat_shards:
+        total = SeatShard.objects.filter(event=event).aggregate(total=Sum('available_seats'))['total']
+        return total or 0
+    return event.available_seats
+
+
+def take_seats(event, count):
+    """Remove `count` seats from the event or raise NotEnoughSeats."""
+    if count <= 0:
+        return
+
+    if event.seat_shards:
+        _take_from_shards(event, count)
+        return
+
+    updated = Event.objects.filter(id=event.id, available_seats__gte=count).update(
+        available_seats=F('available_seats') - count
+    )
+    if not updated:
+        raise NotEnoughSeats()
+
+
+def release_seats(event, count):
+    """Give `count` seats back to the event (cancellations, expired holds...)."""
+    if count <= 0:
+        return
+
+    if event.seat_shards:
+        shard_index = random.randrange(event.seat_shards)
+        SeatShard.objects.filter(event=event, shard_index=shard_index).update(
+            available_seats=F('available_seats') + count
+        )
+        return
+
+    # Never go above total_seats, even if the admin shrank the event meanwhile
+    Event.objects.filter(id=event.id).update(
+        available_seats=Least(F('available_seats') + count, F('total_seats'))
+    )
+
+
+def change_capacity(event, total_seats):
+    """
+    Set the event's total_seats and apply the difference to its available
+    seats (never below zero), as a delta so seats taken meanwhile stay taken.
+    Returns the difference.
+    """
+    with transaction.atomic():
+        current = Event.objects.select_for_update().filter(id=event.id).values('total_seats', 'seat_shards').first()
+        if current is None or current['total_seats'] == total_seats:
+            return 0
+        delta = total_seats - current['total_seats']
+        Event.objects.filter(id=event.id).update(total_seats=total_seats)
+        if not current['seat_shards']:
+            Event.objects.filter(id=event.id).update(available_seats=Greatest(F('available_seats') + delta, 0))
+            return delta
+
+        if delta > 0:
+            shard_index = random.randrange(current['seat_shards'])
+            SeatShard.objects.filter(event_id=event.id, shard_index=shard_index).update(
+                available_seats=F('available_seats') + delta
+            )
+        else:
+            # Take what is left, up to the seats removed
+            remaining = -delta
+            shards = SeatShard.objects.select_for_update().filter(event_id=event.id, available_seats__gt=0)
+            for shard in shards.order_by('shard_index'):
+                taken = min(shard.available_seats, remaining)
+                SeatShard.objects.filter(id=shard.id).update(available_seats=F('available_seats') - taken)
+                remaining -= taken
+                if not remaining:
+                    break
+        total = SeatShard.objects.filter(event_id=event.id).aggregate(total=Sum('available_seats'))['total']
+        Event.objects.filter(id=event.id).update(available_seats=total or 0)
+    return delta
+
+
+def _take_from_shards(event, count):
+    # Fast path: start at a random shard and take everything from the first
+    # one that has enough. Each attempt is one conditional UPDATE on one row.
+    indexes = list(range(event.seat_shards))
+    start = random.randrange(len(indexes))
+    for shard_index in indexes[start:] + indexes[:start]:
+        updated = SeatShard.objects.filter(
+            event=event, shard_index=shard_index, available_seats__gte=count
+        ).update(available_seats=F('available_seats') - count)
+        if updated:
+            return
+
+    # Slow path: no single shard has enough left (the pool is nearly drained),
+    # so lock the remaining shards in a fixed order and take from several.
+    with transaction.atomic():
+        shards = list(
+            SeatShard.objects.select_for_update()
+            .filter(event=event, available_seats__gt=0)
+            .order_by('shard_index')
+        )
+        if sum(shard.available_seats for shard in shards) < count:
+            raise NotEnoughSeats()
+
+        remaining = count
+        for shard in shards:
+            taken = min(shard.available_seats, remaining)
+            SeatShard.objects.filter(id=shard.id).update(available_seats=F('available_seats') - taken)
+            remaining -= taken
+            if not remaining:
+                break
+
+
+@transaction.atomic
+def enable_sharding(event, shards=8):
+    """Split the event's remaining seats across `shards` SeatShard rows."""
+    if shards < 1:
+        raise ValueError('shards must be at least 1')
+
+    event = Event.objects.select_for_update().get(id=event.id)
+    # Re-sharding an already sharded event: hold the old shards while we count them
+    old_shards = list(SeatShard.objects.select_for_update().filter(event=event))
+    if event.seat_shards:
+        total = sum(shard.available_seats for shard in old_shards)
+    else:
+        total = event.available_seats
+    SeatShard.objects.filter(event=event).delete()
+
+    base, extra = divmod(total, shards)
+    SeatShard.objects.bulk_create([
+        SeatShard(event=event, shard_index=i, available_seats=base + (1 if i < extra else 0))
+        for i in range(shards)
+    ])
+    Event.objects.filter(id=event.id).update(seat_shards=shards, available_seats=total)
+    listing.invalidate_on_commit()
+
+
+@transaction.atomic
+def disable_sharding(event):
+    """Fold the shards back into Event.available_seats."""
+    event = Event.objects.select_for_update().get(id=event.id)
+    if not event.seat_shards:
+        return
+
+    shards = list(SeatShard.objects.select_for_update().filter(event=event))
+    total = sum(shard.available_seats for shard in shards)
+    SeatShard.objects.filter(event=event).delete()
+    Event.objects.filter(id=event.id).update(seat_shards=0, available_seats=total)
+    listing.invalidate_on_commit()
+
+
+def sync_available_seats(event):
+    """Refresh the display count of a sharded event from its shards."""
+    if not event.seat_shards:
+        return event.available_seats
+
+    total = seats_left(event)
+    Event.objects.filter(id=event.id).update(available_seats=total)
+    return total
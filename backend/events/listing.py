@@ -0,0 +1,123 @@
+"""
+Event listing: a compact projection and a versioned response cache with
+ETag / Last-Modified support (pagination lives in events/pagination.py).
+
+The rendered JSON of every listing URL is cached under the current list
+*version*. Changes to what the listing shows (Event save/delete
+signals, posters, imports) call ``invalidate`` after commit, which bumps
+the version so the next request renders fresh. Seat counts are the
+exception: bookings change them all the time, so they don't invalidate
+and a cached page shows them up to EVENT_LIST_CACHE_SECONDS late (the
+booking itself always checks the live count). Cache hits cost no queries
+and no serialization, and clients that send If-None-Match /
+If-Modified-Since get a 304.
+
+Set Cache_url in the .env to a shared cache (Redis, Memcached, database)
+when running more than one worker, otherwise each worker only sees its
+own invalidations.
+"""
+import contextlib
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from . import db_routing
+from .renderers import FastJSONRenderer
+
+VERSION_KEY = 'events:list:version'
+CHANGED_AT_KEY = 'events:list:changed_at'
+
+# ?view=compact drops heavy fields like description
+COMPACT_FIELDS = [
+    'id', 'title', 'event_type', 'organizer', 'venue', 'ticket_price', 'total_seats',
+    'available_seats', 'event_date', 'event_time', 'location', 'poster', 'poster_variants',
+]
+
+
+def is_compact(request):
+    return request.query_params.get('view') == 'compact'
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a lost key never brings back an old version number
+        cache.add(VERSION_KEY, time.time_ns() // 1000, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate():
+    """Make every cached listing stale. Use `invalidate_on_commit` from inside transactions."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        current_version()
+    cache.set(CHANGED_AT_KEY, time.time(), None)
+
+
+def invalidate_on_commit():
+    # Bumping before commit would let a reader cache the old rows under the new version
+    transaction.on_commit(invalidate)
+
+
+def _cache_key(request, version):
+    url = f'{request.scheme}://{request.get_host()}{request.get_full_path()}'
+    return f'events:list:{version}:{hashlib.md5(url.encode()).hexdigest()}'
+
+
+def _entry_response(request, entry):
+    response = HttpResponse(entry['content'], content_type='application/json')
+    response['ETag'] = entry['etag']
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    # Let clients keep a copy but always revalidate (cheap 304) before using it
+    patch_cache_control(response, max_age=0, must_revalidate=True)
+    return get_conditional_response(
+        request, etag=entry['etag'], last_modified=entry['last_modified'], response=response
+    )
+
+
+def cached_response(request, build_response):
+    """
+    Serve a listing from the cache, calling `build_response()` (which returns a
+    DRF Response) on a miss. Handles ETag / Last-Modified and 304s.
+    """
+    key = _cache_key(request, current_version())
+
+    entry = cache.get(key)
+    if entry is None:
+        # Right after a change a replica may not have it yet, and whatever we
+        # render here is cached for everyone: read it from the primary
+        changed_at = cache.get(CHANGED_AT_KEY)
+        recent = changed_at is not None and time.time() - changed_at < settings.REPLICA_STICKY_SECONDS
+        with db_routing.use_primary() if recent else contextlib.nullcontext():
+            response = build_response()
+        if response.status_code != 200:
+            return response
+        content = FastJSONRenderer().render(response.data)
+        entry = {
+            'content': content,
+            'etag': f'"{hashlib.md5(content).hexdigest()}"',
+            # When this copy was rendered: seat counts change without an invalidate()
+            'last_modified': int(time.time()),
+        }
+        cache.set(key, entry, settings.EVENT_LIST_CACHE_SECONDS)
+
+    return _entry_response(request, entry)
+
+
+async def acached_response(request):
+    """Async views: the cached response, or None on a miss (render it with the sync view then)."""
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        return None
+    entry = await cache.aget(_cache_key(request, version))
+    if entry is None:
+        return None
+    return _entry_response(request, entry)
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from events import archive
+
+
+class Command(BaseCommand):
+    help = "Move the bookings and tickets of past events to compressed files in the archive storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=180,
+                            help="Archive events that took place more than this many days ago")
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE,
+                            help="Bookings read and deleted per query / transaction")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only list the events that would be archived")
+
+    def handle(self, *args, **options):
+        events = archive.archivable(options['older_than_days'])
+        if options['dry_run']:
+            for event in events:
+                self.stdout.write(f"Event {event.id} ({event.title}, {event.event_date})")
+            self.stdout.write(self.style.SUCCESS(f"{events.count()} events to archive"))
+            return
+
+        archived = bookings = tickets = 0
+        for event in events.iterator():
+            result = archive.archive_event(event, batch_size=options['batch_size'])
+            if result is None:
+                continue
+            archived += 1
+            bookings += result.bookings
+            tickets += result.tickets
+            self.stdout.write(f"Event {event.id}: {result.bookings} bookings, {result.tickets} tickets -> {result.file}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {bookings} bookings and {tickets} tickets of {archived} events"
+        ))
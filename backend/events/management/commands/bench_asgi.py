@@ -0,0 +1,240 @@
+import asyncio
+import datetime
+import json
+import logging
+import threading
+import time
+import uuid
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client, override_settings
+from django.urls import clear_url_caches
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from events.management.commands.bench_funnel import percentile
+from events.models import Event, Volunteer
+
+def close_connection():
+    connection.close()
+
+
+MODES = {
+    # mode: urlconf
+    'wsgi': 'eventra_backend.urls',
+    'asgi': 'eventra_backend.asgi_urls',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare how many booking funnels per second the sync (WSGI, fixed worker threads) and the "
+        "async (ASGI) views get through when every database round trip is slow"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=200)
+        parser.add_argument('--threads', type=int, default=8,
+                            help="WSGI worker threads, like gunicorn --threads")
+        parser.add_argument('--concurrency', type=int, default=64,
+                            help="Customers in flight at once on the ASGI side")
+        parser.add_argument('--db-latency-ms', type=float, default=10,
+                            help="Simulated network round trip added to every query (0 = none)")
+        parser.add_argument('--events', type=int, default=8,
+                            help="Spread customers over this many events so they don't all queue on one row")
+        parser.add_argument('--mode', choices=list(MODES), action='append',
+                            help="Only run this mode (repeatable); default both")
+
+    def handle(self, *args, **options):
+        latency = options['db_latency_ms'] / 1000
+
+        def slow_query(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            if slow_query not in connection.execute_wrappers:
+                connection.execute_wrappers.append(slow_query)
+
+        self.stdout.write(
+            f"{options['customers']} customers, {options['db_latency_ms']} ms per query, "
+            f"WSGI {options['threads']} threads, ASGI concurrency {options['concurrency']}, {connection.vendor}"
+        )
+        if connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING(
+                "SQLite lets one writer in at a time, high concurrency ends in 'database is locked' "
+                "errors there. Compare on Postgres."
+            ))
+        self.stdout.write(f"{'mode':>5} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} "
+                          f"{'p95 ms':>8} {'p99 ms':>8} {'threads':>8}")
+
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        try:
+            for mode in options['mode'] or list(MODES):
+                events, token, cleanup = self.setup(options)
+                if latency:
+                    connection_created.connect(add_latency)
+                    for conn in connections.all():
+                        add_latency(None, conn)
+                try:
+                    # The test clients' Host is always "testserver", like under `manage.py test`
+                    with override_settings(ROOT_URLCONF=MODES[mode], DATABASE_REPLICAS=[],
+                                           ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                        clear_url_caches()
+                        if mode == 'wsgi':
+                            stats = self.run_wsgi(events, token, options)
+                        else:
+                            stats = asyncio.run(self.run_asgi(events, token, options))
+                finally:
+                    connection_created.disconnect(add_latency)
+                    for conn in connections.all():
+                        if slow_query in conn.execute_wrappers:
+                            conn.execute_wrappers.remove(slow_query)
+                    clear_url_caches()
+                    cleanup()
+                self.report(mode, stats)
+        finally:
+            request_logger.setLevel(level)
+
+    def setup(self, options):
+        seats = options['customers'] * 4
+        events = [
+            Event.objects.create(
+                title=f'ASGI benchmark {uuid.uuid4().hex[:8]}', organizer='bench', venue='bench',
+                location='bench', description='', ticket_price=100, total_seats=seats, available_seats=seats,
+                event_date=datetime.date.today() + datetime.timedelta(days=30), event_time=datetime.time(0, 0),
+            )
+            for _ in range(options['events'])
+        ]
+        user = User.objects.create_user(username=f'bench-{uuid.uuid4().hex[:12]}')
+        Volunteer.objects.create(user=user, name='Bench volunteer')
+        token = str(RefreshToken.for_user(user).access_token)
+
+        def cleanup():
+            for event in events:
+                event.delete()
+            user.delete()
+        return events, token, cleanup
+
+    @staticmethod
+    def steps(events, token, n):
+        """The requests of customer n: (method, path, body, headers, expected status) generators."""
+        event = events[n % len(events)]
+        yield 'GET', '/api/events/', None, {}, 200
+        booking = yield 'POST', f'/api/events/{event.id}/book/', {
+            'customer_name': f'Bench {n}', 'roll_number': str(n), 'section': 'A',
+            'phone': '0000000000', 'number_of_tickets': 2,
+        }, {}, 201
+        if booking is None:
+            return
+        paid = yield 'POST', f"/api/bookings/{booking['id']}/complete-payment/", {}, {}, 200
+        if paid is None:
+            return
+        for ticket in paid.get('tickets', []):
+            yield ('POST', '/api/volunteer/verify-ticket/', {'otp_code': ticket['otp_code']},
+                   {'Authorization': f'Bearer {token}'}, 200)
+
+    def run_wsgi(self, events, token, options):
+        stats = {'latencies': [], 'errors': 0, 'threads': 0}
+        lock = threading.Lock()
+        todo = list(range(options['customers']))
+
+        def worker():
+            client = Client(raise_request_exception=False)
+            try:
+                while True:
+                    with lock:
+                        if not todo:
+                            return
+                        n = todo.pop()
+                    steps = self.steps(events, token, n)
+                    body = None
+                    try:
+                        method, path, data, headers, expected = next(steps)
+                        while True:
+                            started = time.perf_counter()
+                            if method == 'GET':
+                                response = client.get(path, headers=headers)
+                            else:
+                                response = client.post(path, data, content_type='application/json', headers=headers)
+                            body = self.record(stats, lock, started, response, expected)
+                            method, path, data, headers, expected = steps.send(body)
+                    except StopIteration:
+                        pass
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        stats['threads'] = threading.active_count()
+        for thread in threads:
+            thread.join()
+        stats['elapsed'] = time.perf_counter() - started
+        return stats
+
+    async def run_asgi(self, events, token, options):
+        stats = {'latencies': [], 'errors': 0, 'threads': 0}
+        lock = threading.Lock()
+        todo = list(range(options['customers']))
+        client = AsyncClient(raise_request_exception=False)
+
+        async def customer(n):
+            # What the ASGI handler does per request: its own thread for the sync parts
+            async with ThreadSensitiveContext():
+                steps = self.steps(events, token, n)
+                try:
+                    method, path, data, headers, expected = next(steps)
+                    while True:
+                        started = time.perf_counter()
+                        if method == 'GET':
+                            response = await client.get(path, headers=headers)
+                        else:
+                            response = await client.post(path, data, content_type='application/json', headers=headers)
+                        body = self.record(stats, lock, started, response, expected)
+                        stats['threads'] = max(stats['threads'], threading.active_count())
+                        method, path, data, headers, expected = steps.send(body)
+                except StopIteration:
+                    pass
+                finally:
+                    # Resolve `connection` in the customer's thread, not the event loop's
+                    await sync_to_async(close_connection)()
+
+        async def worker():
+            while todo:
+                await customer(todo.pop())
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(options['concurrency'])])
+        stats['elapsed'] = time.perf_counter() - started
+        return stats
+
+    @staticmethod
+    def record(stats, lock, started, response, expected):
+        latency = time.perf_counter() - started
+        ok = response.status_code == expected
+        with lock:
+            stats['latencies'].append(latency)
+            if not ok:
+                stats['errors'] += 1
+        return json.loads(response.content) if ok and response.content else None
+
+    def report(self, mode, stats):
+        latencies = stats['latencies']
+
+        def ms(pct):
+            value = percentile(latencies, pct)
+            return round(value * 1000, 1) if value is not None else 0
+
+        rps = len(latencies) / stats['elapsed'] if stats['elapsed'] else 0
+        self.stdout.write(
+            f"{mode:>5} {len(latencies):>9} {stats['errors']:>7} {rps:>8.1f} {ms(50):>8} "
+            f"{ms(95):>8} {ms(99):>8} {stats['threads']:>8}"
+        )
@@ -0,0 +1,285 @@
+import datetime
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.test import Client
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from events import inventory
+from events.models import Booking, Event, Ticket, Volunteer
+
+STAGES = ['list', 'book', 'pay', 'verify']
+
+
+def percentile(values, pct):
+    # Nearest rank, good enough for latency reports
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[rank]
+
+
+class InProcessTransport:
+    """Goes through the whole Django stack (middleware, DRF, DB) without a socket."""
+
+    def __init__(self):
+        self.local = threading.local()
+        hosts = [host for host in settings.ALLOWED_HOSTS if host not in ('*',) and not host.startswith('.')]
+        self.host = hosts[0] if hosts else 'localhost'
+
+    def request(self, method, path, data=None, token=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(raise_request_exception=False, SERVER_NAME=self.host)
+        extra = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+        if method == 'GET':
+            response = client.get(path, **extra)
+        else:
+            response = client.post(path, data or {}, content_type='application/json', **extra)
+        try:
+            body = json.loads(response.content) if response.content else None
+        except ValueError:
+            body = None
+        return response.status_code, body
+
+    def close(self):
+        # Each worker thread has its own DB connection
+        connection.close()
+
+
+class HttpTransport:
+    """Talks to a running server. It must use the same database as this command."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, data=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        body = json.dumps(data or {}).encode() if method != 'GET' else None
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=30) as response:
+                status, content = response.status, response.read()
+        except urllib.error.HTTPError as error:
+            status, content = error.code, error.read()
+        try:
+            return status, json.loads(content) if content else None
+        except ValueError:
+            return status, None
+
+    def close(self):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the booking funnel (list events -> book -> pay -> verify) on a throwaway event "
+        "and check nothing was oversold"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=200,
+                            help="Customers going through the funnel")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--tickets', type=int, default=2, help="Tickets per booking (1-4)")
+        parser.add_argument('--seats', type=int,
+                            help="Seats of the event (default: half the demand, so it sells out under load)")
+        parser.add_argument('--url', help="Base URL of a running server, e.g. http://127.0.0.1:8000. "
+                                          "Without it requests go through the Django stack in-process")
+        parser.add_argument('--save', metavar='PATH', help="Write the results as a JSON baseline")
+        parser.add_argument('--compare', metavar='PATH', help="Fail if slower than this baseline")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Allowed p95 / throughput regression against --compare (0.25 = 25%%)")
+
+    def handle(self, *args, **options):
+        customers = options['customers']
+        per_booking = options['tickets']
+        seats = options['seats'] or max(1, customers * per_booking // 2)
+        transport = HttpTransport(options['url']) if options['url'] else InProcessTransport()
+
+        event = Event.objects.create(
+            title=f'Funnel benchmark {uuid.uuid4().hex[:8]}', organizer='bench', venue='bench',
+            location='bench', description='', ticket_price=100, total_seats=seats, available_seats=seats,
+            event_date=datetime.date.today() + datetime.timedelta(days=30), event_time=datetime.time(0, 0),
+        )
+        user = User.objects.create_user(username=f'bench-{uuid.uuid4().hex[:12]}')
+        Volunteer.objects.create(user=user, name='Bench volunteer')
+        token = str(RefreshToken.for_user(user).access_token)
+
+        try:
+            stats, elapsed = self.run_funnel(transport, event, token, customers, options['concurrency'], per_booking)
+            checks = self.consistency_checks(event, stats)
+        finally:
+            event.delete()
+            user.delete()
+
+        result = {
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'target': options['url'] or 'in-process',
+            'options': {
+                'customers': customers, 'concurrency': options['concurrency'],
+                'tickets': per_booking, 'seats': seats,
+            },
+            'elapsed_s': round(elapsed, 3),
+            'stages': {stage: self.summarize(stats[stage], elapsed) for stage in STAGES},
+            'checks': checks,
+        }
+        self.report(result)
+
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump(result, f, indent=2)
+            self.stdout.write(f"Saved baseline to {options['save']}")
+
+        problems = [f'check failed: {name}' for name, ok in checks.items() if not ok]
+        if options['compare']:
+            with open(options['compare']) as f:
+                problems += self.regressions(json.load(f), result, options['tolerance'])
+        if problems:
+            raise CommandError('\n'.join(problems))
+
+    def run_funnel(self, transport, event, token, customers, concurrency, per_booking):
+        stats = {stage: {'latencies': [], 'statuses': Counter(), 'errors': 0} for stage in STAGES}
+        lock = threading.Lock()
+        todo = queue.Queue()
+        for n in range(customers):
+            todo.put(n)
+
+        def timed(stage, method, path, data=None, token=None, expected=(200,)):
+            started = time.perf_counter()
+            try:
+                status, body = transport.request(method, path, data, token)
+            except Exception:
+                status, body = 'exception', None
+            latency = time.perf_counter() - started
+            with lock:
+                stats[stage]['latencies'].append(latency)
+                stats[stage]['statuses'][str(status)] += 1
+                if status not in expected:
+                    stats[stage]['errors'] += 1
+            return status, body
+
+        def customer(n):
+            timed('list', 'GET', '/api/events/')
+            status, booking = timed('book', 'POST', f'/api/events/{event.id}/book/', {
+                'customer_name': f'Bench {n}', 'roll_number': str(n), 'section': 'A',
+                'phone': '0000000000', 'number_of_tickets': per_booking,
+            }, expected=(201, 400))  # 400 = sold out
+            if status != 201:
+                return
+            status, paid = timed('pay', 'POST', f"/api/bookings/{booking['id']}/complete-payment/")
+            if status != 200:
+                return
+            for ticket in paid.get('tickets', []):
+                timed('verify', 'POST', '/api/volunteer/verify-ticket/',
+                      {'otp_code': ticket['otp_code']}, token=token)
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        n = todo.get_nowait()
+                    except queue.Empty:
+                        return
+                    customer(n)
+            finally:
+                transport.close()
+
+        # Sold out 400s and lock timeouts are counted in the report, don't log each one
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        started = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            request_logger.setLevel(level)
+        return stats, time.perf_counter() - started
+
+    def consistency_checks(self, event, stats):
+        event.refresh_from_db()
+        bookings = Booking.objects.filter(event=event)
+        sold = bookings.filter(payment_status='completed').aggregate(n=Sum('number_of_tickets'))['n'] or 0
+        held = bookings.filter(payment_status='pending').aggregate(n=Sum('number_of_tickets'))['n'] or 0
+        tickets = Ticket.objects.filter(booking__event=event)
+        seats_left = inventory.seats_left(event)
+
+        return {
+            'no_oversell': sold <= event.total_seats,
+            'seats_never_negative': seats_left >= 0,
+            'seats_add_up': seats_left + held + sold == event.total_seats,
+            'one_ticket_per_seat_sold': tickets.count() == sold,
+            'bookings_match_responses': bookings.count() == stats['book']['statuses']['201'],
+            'payments_match_responses': (
+                bookings.filter(payment_status='completed').count() == stats['pay']['statuses']['200']
+            ),
+            'verifications_match_responses': (
+                tickets.filter(is_verified=True).count() == stats['verify']['statuses']['200']
+            ),
+        }
+
+    def summarize(self, stage, elapsed):
+        latencies = stage['latencies']
+
+        def ms(value):
+            return None if value is None else round(value * 1000, 2)
+
+        return {
+            'requests': len(latencies),
+            'errors': stage['errors'],
+            'statuses': dict(stage['statuses']),
+            'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+            'p50_ms': ms(percentile(latencies, 50)),
+            'p95_ms': ms(percentile(latencies, 95)),
+            'p99_ms': ms(percentile(latencies, 99)),
+        }
+
+    def regressions(self, baseline, result, tolerance):
+        problems = []
+        for stage, now in result['stages'].items():
+            before = baseline.get('stages', {}).get(stage)
+            if not before or not now['requests']:
+                continue
+            if before.get('p95_ms') and now['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                problems.append(f"{stage}: p95 {now['p95_ms']} ms vs {before['p95_ms']} ms in the baseline")
+            if before.get('rps') and now['rps'] < before['rps'] * (1 - tolerance):
+                problems.append(f"{stage}: {now['rps']} req/s vs {before['rps']} req/s in the baseline")
+        return problems
+
+    def report(self, result):
+        options = result['options']
+        self.stdout.write(
+            f"{options['customers']} customers, concurrency {options['concurrency']}, "
+            f"{options['seats']} seats, {result['database']} via {result['target']}, "
+            f"{result['elapsed_s']} s"
+        )
+        self.stdout.write(f"{'stage':>8} {'requests':>9} {'errors':>7} {'req/s':>8} "
+                          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+        for stage, row in result['stages'].items():
+            self.stdout.write(
+                f"{stage:>8} {row['requests']:>9} {row['errors']:>7} {row['rps'] or 0:>8} "
+                f"{row['p50_ms'] or 0:>8} {row['p95_ms'] or 0:>8} {row['p99_ms'] or 0:>8}  {row['statuses']}"
+            )
+        for name, ok in result['checks'].items():
+            self.stdout.write(f"{'ok  ' if ok else 'FAIL'} {name}")
@@ -0,0 +1,73 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from events import fast_serializers, renderers, tickets
+from events.models import Booking, Event
+from events.serializers import BookingWithTicketsSerializer, EventListSerializer
+
+
+class Command(BaseCommand):
+    help = ("Compare DRF serializers + JSONRenderer with the fast serializers + renderer on the event listing "
+            "and booking list (uses throwaway inactive events)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3, help="Best of this many runs")
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        events = Event.objects.bulk_create([
+            Event(title=f'Serializer benchmark {i}', organizer='bench', venue='bench', location='bench',
+                  description='Benchmark event ' * 8, ticket_price=100, total_seats=rows, available_seats=rows,
+                  event_date=datetime.date.today(), event_time=datetime.time(0, 0), is_active=False)
+            for i in range(rows)
+        ], batch_size=1000)
+        try:
+            event = events[0]
+            with transaction.atomic():
+                bookings = Booking.objects.bulk_create([
+                    Booking(event=event, customer_name=f'Bench {i}', roll_number=str(i), section='A', phone='0',
+                            number_of_tickets=2, total_amount=200, payment_status='completed')
+                    for i in range(rows)
+                ], batch_size=1000)
+                for start in range(0, rows, 1000):
+                    tickets.mint_for_bookings(bookings[start:start + 1000])
+
+            self.stdout.write(f"{'':>22} {'DRF ms':>10} {'fast ms':>10} {'speedup':>8}")
+            self.compare(
+                'event listing', EventListSerializer,
+                Event.objects.filter(id__in=[e.id for e in events]).order_by('event_date', 'id'), options['repeat'],
+            )
+            self.compare(
+                'bookings + tickets', BookingWithTicketsSerializer,
+                Booking.objects.filter(event=event).select_related('event').prefetch_related('tickets').order_by('id'),
+                options['repeat'],
+            )
+        finally:
+            Event.objects.filter(id__in=[e.id for e in events]).delete()
+
+    def best_of(self, repeat, function):
+        best, result = None, None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def compare(self, label, serializer_class, queryset, repeat):
+        # Even with FAST_SERIALIZERS off
+        fast = fast_serializers.REGISTRY[serializer_class]
+        drf_time, drf_content = self.best_of(
+            repeat, lambda: JSONRenderer().render(serializer_class(queryset.all(), many=True).data)
+        )
+        fast_time, fast_content = self.best_of(repeat, lambda: renderers.dumps(fast.serialize(queryset.all())))
+        if drf_content != fast_content:
+            raise CommandError(f"{label}: the fast path's output differs from DRF's")
+        self.stdout.write(
+            f"{label:>22} {drf_time * 1000:>10.1f} {fast_time * 1000:>10.1f} {drf_time / fast_time:>7.1f}x"
+        )
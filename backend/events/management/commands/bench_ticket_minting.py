@@ -0,0 +1,84 @@
+import datetime
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+
+from events.models import Booking, Event, Ticket
+from events.tickets import mint_tickets
+
+
+def legacy_mint(booking):
+    # What complete_payment used to do: one INSERT per ticket, random OTP,
+    # and a retry whenever the random code is already taken
+    retries = 0
+    for i in range(booking.number_of_tickets):
+        while True:
+            code = ''.join(random.choices(string.digits, k=6))
+            try:
+                with transaction.atomic():
+                    Ticket.objects.create(booking=booking, ticket_number=i + 1, otp_code=code)
+                break
+            except IntegrityError:
+                retries += 1
+    return retries
+
+
+class Command(BaseCommand):
+    help = "Benchmark ticket minting throughput as the Ticket table grows (uses a throwaway event)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickets', type=int, default=200000)
+        parser.add_argument('--per-booking', type=int, default=4)
+        parser.add_argument('--slices', type=int, default=10)
+        parser.add_argument('--legacy', action='store_true',
+                            help="Benchmark the old per-row, random-OTP path instead")
+
+    def handle(self, *args, **options):
+        per_booking = options['per_booking']
+        bookings_needed = options['tickets'] // per_booking
+        slice_size = max(1, bookings_needed // options['slices'])
+
+        event = Event.objects.create(
+            title='Minting benchmark', organizer='bench', venue='bench', location='bench',
+            description='', total_seats=options['tickets'], available_seats=options['tickets'],
+            event_date=datetime.date.today(), event_time=datetime.time(0, 0), is_active=False,
+        )
+        try:
+            Booking.objects.bulk_create([
+                Booking(event=event, customer_name='Bench', roll_number=str(i), section='A',
+                        phone='0', number_of_tickets=per_booking, total_amount=0,
+                        payment_status='completed')
+                for i in range(bookings_needed)
+            ], batch_size=1000)
+            bookings = Booking.objects.filter(event=event).order_by('id')
+
+            self.stdout.write(f"{'tickets in table':>18} {'tickets/s':>12} {'retries':>8}")
+            batch = []
+            for booking in bookings.iterator(chunk_size=1000):
+                batch.append(booking)
+                if len(batch) < slice_size:
+                    continue
+                self.run_slice(batch, options['legacy'])
+                batch = []
+            if batch:
+                self.run_slice(batch, options['legacy'])
+        finally:
+            event.delete()
+
+    def run_slice(self, bookings, legacy):
+        retries = 0
+        started = time.perf_counter()
+        # One transaction per slice so the numbers measure minting, not an fsync per commit
+        with transaction.atomic():
+            for booking in bookings:
+                if legacy:
+                    retries += legacy_mint(booking)
+                else:
+                    mint_tickets(booking)
+        elapsed = time.perf_counter() - started
+
+        minted = sum(booking.number_of_tickets for booking in bookings)
+        self.stdout.write(f"{Ticket.objects.count():>18} {minted / elapsed:>12.0f} {retries:>8}")
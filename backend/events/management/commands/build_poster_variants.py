@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from events import posters
+from events.models import Event
+
+
+class Command(BaseCommand):
+    help = "Build the resized listing variants of event posters that don't have up to date ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Rebuild every poster's variants, e.g. after changing posters.SIZES")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running as a worker, picking up uploads the request could not process")
+        parser.add_argument('--interval', type=float, default=60,
+                            help="Seconds between passes in --loop mode")
+
+    def handle(self, *args, **options):
+        rebuild = options['rebuild']
+        while True:
+            built = 0
+            events = Event.objects.only('id', 'poster', 'poster_variants').order_by('id')
+            for event in events.iterator(chunk_size=200):
+                if posters.refresh(event, force=rebuild):
+                    built += 1
+            if built:
+                self.stdout.write(self.style.SUCCESS(f"Updated poster variants of {built} events"))
+            if not options['loop']:
+                break
+            rebuild = False
+            time.sleep(options['interval'])
@@ -0,0 +1,46 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from events import imports
+
+
+class Command(BaseCommand):
+    help = "Import events or past bookings from a CSV or JSON Lines file, a chunk of rows per transaction"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=imports.KINDS)
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=imports.FORMATS,
+                            help="csv or jsonl (one JSON object per line), guessed from the file name if not given")
+        parser.add_argument('--batch-size', type=int, default=imports.CHUNK_SIZE,
+                            help="Rows validated and written per transaction")
+        parser.add_argument('--errors',
+                            help="Write the rejected rows (line, errors) to this CSV file instead of the output")
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or imports.guess_format(options['path'])
+        if fmt is None:
+            raise CommandError("Can't tell the format from the file name, pass --format")
+
+        errors_file = open(options['errors'], 'w', newline='') if options['errors'] else None
+        if errors_file is not None:
+            writer = csv.writer(errors_file)
+            writer.writerow(['line', 'errors'])
+            on_error = lambda line, errors: writer.writerow([line, json.dumps(errors)])
+        else:
+            on_error = lambda line, errors: self.stderr.write(f"Line {line}: {json.dumps(errors)}")
+
+        try:
+            # utf-8-sig drops the BOM spreadsheet programs put in front of CSV exports
+            with open(options['path'], encoding='utf-8-sig', newline='') as file:
+                report = imports.import_rows(
+                    options['kind'], imports.read_rows(file, fmt), chunk_size=options['batch_size'], on_error=on_error
+                )
+        finally:
+            if errors_file is not None:
+                errors_file.close()
+
+        summary = f"Imported {report.created} {options['kind']}, rejected {report.failed} rows"
+        self.stdout.write(self.style.SUCCESS(summary) if not report.failed else self.style.WARNING(summary))
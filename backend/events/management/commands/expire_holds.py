@@ -0,0 +1,55 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from events import holds, idempotency, waitlist
+
+
+class Command(BaseCommand):
+    help = "Expire pending bookings whose seat hold ran out and give their seats back"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--purge-after-hours', type=int, default=24,
+                            help="Delete expired bookings older than this (0 = keep them)")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running as a worker instead of exiting after one sweep")
+        parser.add_argument('--interval', type=float, default=30,
+                            help="Seconds to sleep between sweeps in --loop mode")
+
+    def handle(self, *args, **options):
+        while True:
+            self.sweep(options['batch_size'], options['purge_after_hours'])
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def sweep(self, batch_size, purge_after_hours):
+        bookings = seats = 0
+        while True:
+            expired, released = holds.expire_stale_holds(batch_size=batch_size)
+            if not expired:
+                break
+            bookings += expired
+            seats += released
+
+        # Expired holds already promoted their event's waitlist, this catches anything that didn't run
+        promoted = waitlist.promote_all(batch_size=batch_size)
+
+        purged = 0
+        if purge_after_hours:
+            cutoff = timezone.now() - datetime.timedelta(hours=purge_after_hours)
+            purged = holds.purge_expired(cutoff, batch_size=batch_size)
+
+        # Retries past this can't be replayed anymore anyway
+        keys = idempotency.purge(
+            timezone.now() - datetime.timedelta(hours=settings.IDEMPOTENCY_KEY_HOURS), batch_size=batch_size
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Expired {bookings} bookings, released {seats} seats, promoted {promoted} waitlisted customers, "
+            f"purged {purged} old bookings and {keys} old idempotency keys"
+        ))
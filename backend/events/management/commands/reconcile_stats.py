@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from events import stats
+from events.models import Event
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-event sales and attendance stats from the bookings and tickets, report and fix drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Events recounted per transaction")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report the drift, don't fix it")
+        parser.add_argument('--check', action='store_true',
+                            help="Exit with an error if any event drifted (for cron alerts)")
+
+    def handle(self, *args, **options):
+        fix = not options['dry_run']
+        checked = drifted = 0
+        last_id = 0
+        while True:
+            # Keyset batches, each recounted with one aggregate per table
+            ids = list(
+                Event.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            checked += len(ids)
+
+            drift = stats.reconcile(ids, fix=fix)
+            drifted += len(drift)
+            for event_id, fields in drift.items():
+                changes = ', '.join(f"{field} {stored} -> {actual}" for field, (stored, actual) in fields.items())
+                self.stdout.write(f"Event {event_id}: {changes}")
+
+        summary = f"Checked {checked} events, {drifted} drifted"
+        if drifted and fix:
+            summary += " (fixed)"
+        if drifted and options['check']:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary) if not drifted else self.style.WARNING(summary))
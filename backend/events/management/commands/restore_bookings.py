@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from events import archive
+from events.models import BookingArchive
+
+
+class Command(BaseCommand):
+    help = "Put the archived bookings and tickets of events back into the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_ids', nargs='+', type=int)
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE,
+                            help="Bookings inserted per transaction")
+
+    def handle(self, *args, **options):
+        missing = set(options['event_ids']) - set(
+            BookingArchive.objects.filter(event_id__in=options['event_ids']).values_list('event_id', flat=True)
+        )
+        if missing:
+            raise CommandError(f"No archived bookings for event(s) {', '.join(map(str, sorted(missing)))}")
+
+        for event_id in options['event_ids']:
+            bookings, tickets = archive.restore_event(event_id, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Event {event_id}: restored {bookings} bookings and {tickets} tickets"))
@@ -0,0 +1,53 @@
+import datetime
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from events import outbox
+
+
+class Command(BaseCommand):
+    help = "Send queued emails from the outbox (booking confirmations etc.)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--purge-sent-days', type=int, default=7,
+                            help="Delete sent emails older than this (0 = keep them)")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running as a worker instead of exiting once the outbox is empty")
+        parser.add_argument('--interval', type=float, default=5,
+                            help="Seconds to sleep when the outbox is empty in --loop mode")
+
+    def handle(self, *args, **options):
+        # One mail server connection for the whole run
+        connection = get_connection()
+        try:
+            while True:
+                self.drain(connection, options['batch_size'])
+                if options['purge_sent_days']:
+                    outbox.purge_sent(timezone.now() - datetime.timedelta(days=options['purge_sent_days']))
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            connection.close()
+
+    def drain(self, connection, batch_size):
+        sent = failed = 0
+        while True:
+            try:
+                batch_sent, batch_failed = outbox.send_pending(batch_size, connection=connection)
+            except Exception as exc:
+                # Mail server unreachable: the leased rows are retried after the lease runs out
+                self.stderr.write(f"Outbox batch failed: {exc!r}")
+                connection.close()
+                break
+            if not batch_sent and not batch_failed:
+                break
+            sent += batch_sent
+            failed += batch_failed
+
+        if sent or failed:
+            self.stdout.write(self.style.SUCCESS(f"Sent {sent} emails, {failed} failed (will retry)"))
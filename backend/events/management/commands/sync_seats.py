@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from events import inventory
+from events.models import Event
+
+
+class Command(BaseCommand):
+    help = "Refresh Event.available_seats for events that use the sharded seat counter"
+
+    def handle(self, *args, **options):
+        events = Event.objects.filter(seat_shards__gt=0)
+        for event in events:
+            total = inventory.sync_available_seats(event)
+            self.stdout.write(f"{event.title}: {total} seats left across {event.seat_shards} shards")
+        self.stdout.write(self.style.SUCCESS(f"Synced {len(events)} sharded events"))
@@ -0,0 +1,130 @@
+"""
+Offline verification manifests for door scanners.
+
+A manifest lists every ticket of one event as a hash of its OTP (the
+first 8 bytes of sha256(salt + otp)), packed into sorted binary arrays
+and base64 encoded: ``valid`` for tickets not checked in yet, ``used``
+for tickets already checked in. A scanner looks a scanned code up with a
+binary search, admits the guest locally, and uploads its check-ins later
+through ``reconcile``.
+
+``version`` is a server timestamp in microseconds. Passing it back as
+``since`` returns only tickets created or checked in after it (with a
+small overlap, since hashes are idempotent to merge).
+
+The manifest is signed with HMAC-SHA256 using SCANNER_MANIFEST_KEY.
+Scanner devices provisioned with that key can check the signature
+before trusting a manifest. Note that with only 10^6 possible OTPs the
+hashes keep codes out of plain sight but are not a secret from someone
+holding the salt.
+"""
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+import time
+
+from django.conf import settings
+from django.db.models import Case, Q, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import checkin
+from .models import Ticket
+
+HASH_BYTES = 8
+# Tickets that committed slightly out of order still make it into the next delta
+DELTA_OVERLAP = datetime.timedelta(seconds=60)
+
+
+def _key():
+    return settings.SCANNER_MANIFEST_KEY.encode()
+
+
+def event_salt(event_id):
+    return hmac.new(_key(), f'manifest-salt:{event_id}'.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def hash_code(salt, otp_code):
+    return hashlib.sha256(f'{salt}{otp_code}'.encode()).digest()[:HASH_BYTES]
+
+
+def _pack(hashes):
+    return base64.b64encode(b''.join(sorted(hashes))).decode()
+
+
+def sign(payload):
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()
+    return hmac.new(_key(), body, hashlib.sha256).hexdigest()
+
+
+def build_manifest(event, since=None):
+    """Full manifest for the event, or only the changes after version `since`."""
+    version = time.time_ns() // 1000
+    salt = event_salt(event.id)
+
+    tickets = Ticket.objects.filter(booking__event=event)
+    if since is not None:
+        cutoff = datetime.datetime.fromtimestamp(since / 1e6, tz=datetime.timezone.utc) - DELTA_OVERLAP
+        tickets = tickets.filter(Q(created_at__gte=cutoff) | Q(verified_at__gte=cutoff))
+
+    valid, used = [], []
+    for otp_code, is_verified in tickets.values_list('otp_code', 'is_verified').iterator(chunk_size=2000):
+        (used if is_verified else valid).append(hash_code(salt, otp_code))
+
+    payload = {
+        'event': event.id,
+        'version': version,
+        'since': since,
+        'full': since is None,
+        'hash': f'sha256/{HASH_BYTES}',
+        'salt': salt,
+        'valid': _pack(valid),
+        'used': _pack(used),
+        'count': len(valid) + len(used),
+    }
+    payload['signature'] = sign(payload)
+    return payload
+
+
+def reconcile(event, checkins, user):
+    """
+    Apply check-ins recorded offline: [{'otp_code': ..., 'scanned_at': iso8601}, ...].
+    Set-based: one conditional UPDATE claims every first use, a second one
+    writes the real scan times. Codes that were already used (online, by
+    another scanner, or twice in this upload) come back as conflicts.
+    """
+    scanned_at = {}
+    codes = []
+    for item in checkins:
+        code = str(item.get('otp_code', '')).strip()
+        codes.append(code)
+        when = parse_datetime(str(item.get('scanned_at') or ''))
+        if when is not None and code not in scanned_at:
+            scanned_at[code] = when if timezone.is_aware(when) else timezone.make_aware(when, datetime.timezone.utc)
+
+    results = checkin.verify_codes(codes, user, event_id=event.id)
+
+    # The claim above stamped "now", put the time the guest actually came in
+    verified = [r['otp_code'] for r in results if r['status'] == checkin.VERIFIED and r['otp_code'] in scanned_at]
+    for start in range(0, len(verified), checkin.CHUNK_SIZE):
+        chunk = verified[start:start + checkin.CHUNK_SIZE]
+        Ticket.objects.filter(otp_code__in=chunk).update(
+            verified_at=Case(*[When(otp_code=code, then=Value(scanned_at[code])) for code in chunk])
+        )
+    for result in results:
+        if result['status'] == checkin.VERIFIED and result['otp_code'] in scanned_at:
+            result['verified_at'] = scanned_at[result['otp_code']]
+
+    conflicts = []
+    for result in results:
+        if result['status'] == checkin.ALREADY_USED:
+            conflict = dict(result, uploaded_scanned_at=scanned_at.get(result['otp_code']))
+            conflicts.append(conflict)
+
+    return {
+        'verified': sum(1 for r in results if r['status'] == checkin.VERIFIED),
+        'conflicts': conflicts,
+        'invalid': [r['otp_code'] for r in results if r['status'] == checkin.INVALID],
+    }
@@ -0,0 +1,189 @@
+"""
+Delivery of uploaded media (posters and their variants) under MEDIA_URL.
+
+Django's ``static()`` helper has the workers read and stream every file,
+so a listing page with 50 posters holds 50 workers. Here MEDIA_DELIVERY
+(Media_delivery in the .env) picks who sends the bytes:
+
+* ``x-accel``: nginx. The view only checks the name and answers with an
+  ``X-Accel-Redirect`` to MEDIA_ACCEL_PREFIX, an ``internal`` location
+  aliased to MEDIA_ROOT; nginx sends the file, ranges and ETags included.
+* ``x-sendfile``: Apache (mod_xsendfile), lighttpd, Caddy. Same idea with
+  the absolute path in ``X-Sendfile``.
+* ``django`` (default): the view sends the file itself, with a strong
+  ETag, Last-Modified, If-None-Match / If-Modified-Since (304) and
+  single Range requests (206, If-Range honoured). Full files go through
+  FileResponse, so the WSGI server can use sendfile.
+
+Either way the response carries the Cache-Control: variants have a hash
+of their content in the name (events/posters.py) and are cached for a
+year as immutable, uploaded originals for an hour.
+
+With MEDIA_STORAGE=s3 (events/storage.py) uploads live in an S3
+compatible bucket, their URLs point there and nothing is routed here.
+"""
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote, urlsplit
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.urls import re_path
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from . import posters
+
+DELIVERY_MODES = ('django', 'x-accel', 'x-sendfile')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+ORIGINAL = 'public, max-age=3600'
+
+BLOCK_SIZE = 64 * 1024
+
+_single_range = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def cache_control(name):
+    """The Cache-Control for the media file `name`."""
+    # Same name, same bytes: a changed variant gets a new name
+    if name.startswith(posters.VARIANT_DIR + '/'):
+        return IMMUTABLE
+    return ORIGINAL
+
+
+def content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def byte_range(header, size):
+    """
+    (first, last) byte of a single range ``Range`` header, both included.
+    None to send the whole file (no header, several ranges or one we don't
+    understand, which RFC 9110 says to ignore). Raises RangeNotSatisfiable.
+    """
+    match = _single_range.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # bytes=-N: the last N bytes
+        if int(last) == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(0, size - int(last)), size - 1
+    first = int(first)
+    if first >= size:
+        raise RangeNotSatisfiable
+    last = int(last) if last else size - 1
+    if last < first:
+        return None
+    return first, min(last, size - 1)
+
+
+def _etag(st):
+    # Changes whenever the file is rewritten, like nginx's; no need to hash the content
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and date == last_modified
+
+
+def _read(path, first, length):
+    with open(path, 'rb') as f:
+        f.seek(first)
+        while length > 0:
+            block = f.read(min(BLOCK_SIZE, length))
+            if not block:
+                return
+            length -= len(block)
+            yield block
+
+
+def _proxied(name, path):
+    response = HttpResponse(content_type=content_type(name))
+    response['Cache-Control'] = cache_control(name)
+    if settings.MEDIA_DELIVERY == 'x-accel':
+        response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + name)
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+@require_safe
+def serve(request, name):
+    try:
+        # Rejects names that would leave MEDIA_ROOT
+        path = default_storage.path(name)
+    except (SuspiciousFileOperation, NotImplementedError, ValueError):
+        raise Http404
+    if settings.MEDIA_DELIVERY != 'django':
+        # Missing files are the proxy's 404, the worker doesn't even stat them
+        return _proxied(name, path)
+
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404
+
+    etag, last_modified, size = _etag(st), int(st.st_mtime), st.st_size
+    headers = HttpResponse(content_type=content_type(name))
+    headers['ETag'] = etag
+    headers['Last-Modified'] = http_date(last_modified)
+    headers['Cache-Control'] = cache_control(name)
+    headers['Accept-Ranges'] = 'bytes'
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified, response=headers)
+    if conditional is not headers:
+        return conditional  # 304 with the validators, or 412
+
+    selected = None
+    if _if_range_matches(request, etag, last_modified):
+        try:
+            selected = byte_range(request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if selected is not None:
+        first, last = selected
+        response = StreamingHttpResponse(
+            _read(path, first, last - first + 1) if request.method == 'GET' else (), status=206,
+        )
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+        response['Content-Length'] = last - first + 1
+    elif request.method == 'HEAD':
+        response = HttpResponse()
+        response['Content-Length'] = size
+    else:
+        response = FileResponse(open(path, 'rb'))
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def urlpatterns():
+    """The route serving MEDIA_URL, none when the media URLs point elsewhere (S3, a CDN)."""
+    prefix = settings.MEDIA_URL
+    if not prefix or urlsplit(prefix).netloc or settings.MEDIA_STORAGE != 'local':
+        return []
+    return [re_path(r'^%s(?P<name>.+)$' % re.escape(prefix.lstrip('/')), serve, name='media')]
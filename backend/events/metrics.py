@@ -0,0 +1,222 @@
+"""
+Per-view request metrics, exposed in Prometheus text format at /metrics.
+
+``MetricsMiddleware`` records for every request, keyed by view name
+(``create_booking``, ``complete_payment``, ``EventListCreateView`` ...):
+wall time, number and time of DB queries, time spent in serializers
+(through ``TimedSerializerMixin``) and response size. Everything goes
+into fixed-bucket histograms kept in this process, so the cost per
+request is a few counters and one lock.
+
+Queries are timed by a wrapper that signals.py installs on every
+database connection as it is opened, so queries that async views run in
+worker threads are counted too. Set METRICS_SLOW_QUERY_MS to log every
+query slower than that to the ``events.slow_queries`` logger, together
+with the app code that ran it.
+
+Each worker process keeps its own numbers; scrape every worker, or run
+a single one, to see the full picture.
+"""
+import bisect
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+import traceback
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+slow_query_logger = logging.getLogger('events.slow_queries')
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+METRICS = {
+    # name: (help, buckets)
+    'request_seconds': ('Wall time of the request', TIME_BUCKETS),
+    'db_queries': ('Database queries per request', COUNT_BUCKETS),
+    'db_seconds': ('Time spent in database queries per request', TIME_BUCKETS),
+    'serializer_seconds': ('Time spent in DRF serializers per request', TIME_BUCKETS),
+    'response_bytes': ('Response body size (0 for streamed responses)', SIZE_BUCKETS),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_lock = threading.Lock()
+_histograms = {}  # (metric, view) -> Histogram
+_responses = {}  # (view, status) -> count
+
+# Stats of the request being handled in this thread / task
+_current = contextvars.ContextVar('events_metrics_request', default=None)
+
+
+def observe_request(view, stats, status_code):
+    with _lock:
+        for metric, value in stats.items():
+            histogram = _histograms.get((metric, view))
+            if histogram is None:
+                histogram = _histograms[(metric, view)] = Histogram(METRICS[metric][1])
+            histogram.observe(value)
+        _responses[(view, status_code)] = _responses.get((view, status_code), 0) + 1
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _responses.clear()
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        for metric, (help_text, buckets) in METRICS.items():
+            name = f'eventra_{metric}'
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for (hist_metric, view), histogram in sorted(_histograms.items()):
+                if hist_metric != metric:
+                    continue
+                view = _label(view)
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{view="{view}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{view="{view}"}} {histogram.count}')
+
+        lines.append('# HELP eventra_responses_total Responses by view and status code')
+        lines.append('# TYPE eventra_responses_total counter')
+        for (view, status_code), count in sorted(_responses.items()):
+            lines.append(f'eventra_responses_total{{view="{_label(view)}",status="{status_code}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def _app_stack():
+    # Only our own frames, innermost last: where in the app did this query come from?
+    base = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in traceback.extract_stack()[:-3]
+        if frame.filename.startswith(base) and 'site-packages' not in frame.filename
+    ]
+    return ''.join(traceback.format_list(frames[-5:]))
+
+
+def query_timer(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        # Not inside a request (management commands, workers)
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats['db_queries'] += 1
+        stats['db_seconds'] += elapsed
+        slow_ms = getattr(settings, 'METRICS_SLOW_QUERY_MS', None)
+        if slow_ms is not None and elapsed * 1000 >= slow_ms:
+            slow_query_logger.warning('Slow query (%.1f ms): %s\n%s', elapsed * 1000, sql, _app_stack())
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """connection_created receiver: time every query of every connection, in any thread."""
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    func = getattr(match.func, 'view_class', match.func)
+    return func.__name__
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats = {'db_queries': 0, 'db_seconds': 0.0, 'serializer_seconds': 0.0, 'serializer_depth': 0}
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.observe(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        # Queries run in sync_to_async threads; they inherit the context, so they still count here
+        stats = {'db_queries': 0, 'db_seconds': 0.0, 'serializer_seconds': 0.0, 'serializer_depth': 0}
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.observe(request, response, stats, started)
+        return response
+
+    def observe(self, request, response, stats, started):
+        observe_request(_view_name(request), {
+            'request_seconds': time.perf_counter() - started,
+            'db_queries': stats['db_queries'],
+            'db_seconds': stats['db_seconds'],
+            'serializer_seconds': stats['serializer_seconds'],
+            'response_bytes': 0 if response.streaming else len(response.content),
+        }, response.status_code)
+
+
+@contextlib.contextmanager
+def timed_serialization():
+    """Adds the time spent in the block to the request's serializer time."""
+    stats = _current.get()
+    # Nested serializers run inside their parent's timing
+    if stats is None or stats['serializer_depth']:
+        yield
+        return
+
+    stats['serializer_depth'] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats['serializer_seconds'] += time.perf_counter() - started
+        stats['serializer_depth'] -= 1
+
+
+class TimedSerializerMixin:
+    """Adds the serializer's to_representation time to the request metrics."""
+
+    def to_representation(self, instance):
+        with timed_serialization():
+            return super().to_representation(instance)
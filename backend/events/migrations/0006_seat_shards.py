@@ -0,0 +1,31 @@
+# Generated by Django 4.2.26 on 2026-10-18 17:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0005_volunteer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='seat_shards',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='SeatShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard_index', models.PositiveSmallIntegerField()),
+                ('available_seats', models.PositiveIntegerField(default=0)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seat_shard_set', to='events.event')),
+            ],
+            options={
+                'unique_together': {('event', 'shard_index')},
+            },
+        ),
+    ]
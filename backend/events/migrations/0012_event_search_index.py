@@ -0,0 +1,33 @@
+from django.db import migrations
+
+# Same expression as events.search.VECTOR_SQL, so search queries can use the index
+CREATE_INDEX = """
+CREATE INDEX IF NOT EXISTS event_search_idx ON events_event USING gin ((
+    setweight(to_tsvector('english', coalesce("events_event"."title", '')), 'A') ||
+    setweight(to_tsvector('english', coalesce("events_event"."organizer", '') || ' ' ||
+        coalesce("events_event"."venue", '')), 'B') ||
+    setweight(to_tsvector('english', coalesce("events_event"."description", '')), 'C')
+))
+"""
+
+
+def create_index(apps, schema_editor):
+    # Full-text search is Postgres only; other databases use the in-memory index in events/search.py
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_INDEX)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS event_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0011_event_poster_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
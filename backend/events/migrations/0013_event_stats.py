@@ -0,0 +1,34 @@
+# Generated by Django 4.2.26 on 2026-10-18 18:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0012_event_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard_index', models.PositiveSmallIntegerField(default=0)),
+                ('paid_bookings', models.IntegerField(default=0)),
+                ('tickets_sold', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('pending_bookings', models.IntegerField(default=0)),
+                ('pending_seats', models.IntegerField(default=0)),
+                ('checked_in', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats_shards', to='events.event')),
+            ],
+            options={
+                'verbose_name_plural': 'event stats',
+                'unique_together': {('event', 'shard_index')},
+            },
+        ),
+    ]
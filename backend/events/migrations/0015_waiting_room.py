@@ -0,0 +1,27 @@
+# Generated by Django 4.2.26 on 2026-10-18 18:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0014_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='admission_rate',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='WaitingRoom',
+            fields=[
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='waiting_room', serialize=False, to='events.event')),
+                ('next_slot_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
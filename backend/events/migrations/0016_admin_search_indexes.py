@@ -0,0 +1,43 @@
+from django.db import migrations
+
+# The expressions match what the admin's searches compile to on Postgres:
+# `customer_name` (icontains) -> UPPER("customer_name"::text) LIKE UPPER('%term%'), a trigram GIN index
+# `^roll_number`, `^phone` (istartswith) -> UPPER(...::text) LIKE UPPER('term%'), a pattern_ops btree
+INDEXES = {
+    'booking_name_trgm_idx':
+        'ON events_booking USING gin ((UPPER("customer_name"::text)) gin_trgm_ops)',
+    'booking_roll_number_prefix_idx':
+        'ON events_booking ((UPPER("roll_number"::text)) text_pattern_ops)',
+    'booking_phone_prefix_idx':
+        'ON events_booking ((UPPER("phone"::text)) text_pattern_ops)',
+}
+
+
+def create_indexes(apps, schema_editor):
+    # Postgres only, like the event search index (0012)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, definition in INDEXES.items():
+        # CONCURRENTLY: bookings stay writable while a big table is indexed
+        schema_editor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('events', '0015_waiting_room'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.26 on 2026-10-18 19:45
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0017_waitlist_entry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.CharField(max_length=255)),
+                ('bookings', models.PositiveIntegerField()),
+                ('tickets', models.PositiveIntegerField()),
+                ('last_booking_id', models.BigIntegerField()),
+                ('totals', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='booking_archives', to='events.event')),
+            ],
+        ),
+    ]
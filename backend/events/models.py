@@ -1,9 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator, MaxValueValidator
-import random
-import string
-from django.core.mail import send_mail
+from django.utils import timezone
 
 # Create your models here.
 class Event(models.Model):
@@ -30,20 +29,109 @@ class Event(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
     poster = models.ImageField(upload_to='posters/', blank=True, null=True)
+    # Resized WebP/JPEG copies of the poster for the listing, see events/posters.py
+    poster_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    # 0 = seats are counted on this row (normal events)
+    # N > 0 = seats are split across N SeatShard rows (hot events, see events/inventory.py)
+    seat_shards = models.PositiveSmallIntegerField(default=0)
+
+    # Customers let into booking per minute through the waiting room (events/waiting_room.py).
+    # Empty = no waiting room, anyone can book
+    admission_rate = models.PositiveIntegerField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Event listing: active events in date order (cursor pages use event_date, id)
+            models.Index(fields=['event_date', 'id'], name='event_active_date_idx', condition=models.Q(is_active=True)),
+        ]
+
+    # Written with UPDATEs only (events/inventory.py, events/posters.py); a save of an instance
+    # read before a booking must not put the old count back
+    MANAGED_FIELDS = ('total_seats', 'available_seats', 'seat_shards', 'poster_variants')
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or kwargs.get('update_fields') is not None:
+            return super().save(*args, **kwargs)
+        from . import inventory, waitlist
+
+        deferred = self.get_deferred_fields()
+        kwargs['update_fields'] = [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.name not in self.MANAGED_FIELDS and field.attname not in deferred
+        ]
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # A new total_seats is applied as a delta on the live counter
+            delta = inventory.change_capacity(self, self.total_seats) if 'total_seats' not in deferred else 0
+            if delta:
+                self.available_seats = Event.objects.values_list('available_seats', flat=True).get(id=self.id)
+            if delta > 0:
+                # Seats added go to the waitlist before anyone else
+                waitlist.promote_on_commit(self.id)
 
     def __str__(self):
         return self.title
 
+class SeatShard(models.Model):
+    # One slice of a hot event's seat pool. Payments pick a shard at random
+    # so concurrent bookings don't all queue up on the same Event row lock.
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='seat_shard_set')
+    shard_index = models.PositiveSmallIntegerField()
+    available_seats = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['event', 'shard_index']
+
+    def __str__(self):
+        return f"{self.event.title} - shard {self.shard_index} ({self.available_seats} seats)"
+
+class WaitingRoom(models.Model):
+    # Queue of an event with an admission_rate: the next slot to hand out (events/waiting_room.py).
+    # Its own row so joining the queue doesn't lock the Event row bookings update
+    event = models.OneToOneField(Event, on_delete=models.CASCADE, primary_key=True, related_name='waiting_room')
+    next_slot_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.event.title} - waiting room"
+
+class EventStats(models.Model):
+    # Running sales and attendance totals of an event, updated in the same
+    # transactions as the bookings and check-ins they count (events/stats.py).
+    # Hot events spread them over several rows like SeatShard; an event's
+    # numbers are the sum of its rows.
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='stats_shards')
+    shard_index = models.PositiveSmallIntegerField(default=0)
+
+    # Signed: a shard can be decremented for a booking counted on another shard
+    paid_bookings = models.IntegerField(default=0)
+    tickets_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    pending_bookings = models.IntegerField(default=0)
+    pending_seats = models.IntegerField(default=0)
+    checked_in = models.IntegerField(default=0)
+
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ['event', 'shard_index']
+        verbose_name_plural = 'event stats'
+
+    def __str__(self):
+        return f"{self.event.title} - stats shard {self.shard_index}"
+
 class Booking(models.Model):
     # Payment status options
     PAYMENT_STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('completed', 'Completed'), 
         ('failed', 'Failed'),
+        ('expired', 'Expired'),  # Seat hold ran out before payment (see events/holds.py)
     ]
     
     # Which event is this booking for?
-    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='bookings')
+    # No separate FK index: booking_event_id_idx below starts with event
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='bookings', db_index=False)
     
     # Customer information
     customer_name = models.CharField(max_length=100)
@@ -61,8 +149,23 @@ class Booking(models.Model):
     total_amount = models.DecimalField(max_digits=8, decimal_places=2)
     payment_status = models.CharField(max_length=10, choices=PAYMENT_STATUS_CHOICES, default='pending')
     payment_id = models.CharField(max_length=100, blank=True)  # From payment gateway
+
+    # Seats are held for a pending booking until this time. None = no seats held
+    hold_expires_at = models.DateTimeField(blank=True, null=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # event_bookings: one event's bookings in id order (keyset pages)
+            models.Index(fields=['event', 'id'], name='booking_event_id_idx'),
+            # Admin status filter by date, and purging old expired bookings
+            models.Index(fields=['payment_status', 'created_at'], name='booking_status_created_idx'),
+            # expire_holds: only pending bookings carry a hold, so only they are indexed
+            # (payment_status leads so planners match it against the status filter)
+            models.Index(fields=['payment_status', 'hold_expires_at'], name='booking_pending_hold_idx',
+                         condition=models.Q(payment_status='pending')),
+        ]
     
     def save(self, *args, **kwargs):
         # Calculate total amount before saving
@@ -77,11 +180,18 @@ class Booking(models.Model):
     def __str__(self):
         return f"{self.customer_name} - {self.event.title} ({self.number_of_tickets} tickets)"
 
-# Function to generate random 6-digit OTP
+# Function to generate a 6-digit OTP
 def generate_otp():
-    return ''.join(random.choices(string.digits, k=6))
+    # Codes come from a collision-free sequence (see events/otp.py),
+    # so this never has to retry on the unique constraint
+    from .otp import allocate
+    return allocate(1)[0]
     # This creates something like "482913"
 
+class OtpCounter(models.Model):
+    # Single row: the next unused position in the OTP sequence (events/otp.py)
+    next_position = models.BigIntegerField(default=0)
+
 class Ticket(models.Model):
     # Which booking does this ticket belong to?
     booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='tickets')
@@ -111,4 +221,95 @@ class Volunteer(models.Model):
     is_active = models.BooleanField(default=True)
     
     def __str__(self):
-        return f"{self.name} ({self.user.username})"
\ No newline at end of file
+        return f"{self.name} ({self.user.username})"
+
+class OutboxEmail(models.Model):
+    # Emails are written here in the same transaction as the booking and
+    # sent later by `manage.py send_outbox` (see events/outbox.py)
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),  # Gave up after outbox.MAX_ATTEMPTS
+    ]
+
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)  # Blank = DEFAULT_FROM_EMAIL
+    recipients = models.TextField()  # Comma separated
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.recipients} ({self.status})"
+
+class WaitlistEntry(models.Model):
+    # A customer queued for a sold out event; freed seats go to the oldest ones first (events/waitlist.py)
+    STATUS_CHOICES = [
+        ('waiting', 'Waiting'),
+        ('promoted', 'Promoted'),  # Got a pending booking holding the seats, see `booking`
+    ]
+
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='waitlist')
+    customer_name = models.CharField(max_length=100)
+    roll_number = models.CharField(max_length=20)
+    section = models.CharField(max_length=10)
+    email = models.EmailField(blank=True, null=True)
+    phone = models.CharField(max_length=15)
+    number_of_tickets = models.PositiveIntegerField(validators=[MinValueValidator(1), MaxValueValidator(4)])
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='waiting')
+    booking = models.OneToOneField(Booking, on_delete=models.SET_NULL, blank=True, null=True,
+                                   related_name='waitlist_entry')
+    created_at = models.DateTimeField(auto_now_add=True)
+    promoted_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Head of an event's queue, and positions in it
+            models.Index(fields=['event', 'id'], name='waitlist_waiting_idx', condition=models.Q(status='waiting')),
+        ]
+        constraints = [
+            # Joining twice just gives back the place you already have
+            models.UniqueConstraint(fields=['event', 'roll_number'], condition=models.Q(status='waiting'),
+                                    name='waitlist_one_per_roll_number'),
+        ]
+
+    def __str__(self):
+        return f"{self.customer_name} - {self.event.title} ({self.status})"
+
+class BookingArchive(models.Model):
+    # Bookings (and their tickets) of a past event moved out of the Booking / Ticket tables
+    # into a .jsonl.gz file in the "archive" storage (events/archive.py)
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='booking_archives')
+    file = models.CharField(max_length=255)  # Name in storages['archive']
+    bookings = models.PositiveIntegerField()
+    tickets = models.PositiveIntegerField()
+    # The event's bookings up to this id are in the file (and removed from Booking once archived)
+    last_booking_id = models.BigIntegerField()
+    # What the archived rows still count for in the event's stats (see stats.actual)
+    totals = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.event.title} - {self.bookings} bookings archived in {self.file}"
+
+class IdempotencyKey(models.Model):
+    # Response of a create_booking / complete_payment call made with an
+    # Idempotency-Key header; retries with the same key replay it (events/idempotency.py)
+    key = models.CharField(max_length=255, unique=True)
+    fingerprint = models.CharField(max_length=64)  # sha256 of the endpoint and request body
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)  # None = still running
+    response = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.status_code or 'running'})"
@@ -0,0 +1,94 @@
+"""
+Collision-free ticket OTPs.
+
+There are only 10^6 six-digit codes, so drawing them at random (the old
+``generate_otp``) collides more and more often as the Ticket table fills
+up. Instead every ticket gets the next *position* in a keyed permutation
+of 000000-999999: positions never repeat, and the permutation (a small
+Feistel network keyed from SECRET_KEY) keeps the codes unguessable from
+each other.
+
+Positions are handed out from the single OtpCounter row in blocks of
+BLOCK_SIZE, so a worker only touches that row once per block rather than
+once per ticket.
+"""
+import hashlib
+import hmac
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import OtpCounter
+
+KEYSPACE = 10 ** 6
+BLOCK_SIZE = 1000
+
+# 4-round Feistel network over 20 bits (2^20 >= KEYSPACE), 10 bits per half
+_HALF_BITS = 10
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 4
+
+_lock = threading.Lock()
+_block = {'next': 0, 'end': 0}
+_round_tables = None
+
+
+def _get_round_tables():
+    # The round function only ever sees 10-bit inputs, so precompute it once
+    global _round_tables
+    if _round_tables is None:
+        key = hashlib.sha256(f'{settings.SECRET_KEY}:ticket-otp'.encode()).digest()
+        _round_tables = [
+            [
+                int.from_bytes(hmac.new(key, bytes([r]) + value.to_bytes(2, 'big'), hashlib.sha256).digest()[:2], 'big')
+                & _HALF_MASK
+                for value in range(1 << _HALF_BITS)
+            ]
+            for r in range(_ROUNDS)
+        ]
+    return _round_tables
+
+
+def permute(position):
+    """Map a position in [0, KEYSPACE) to a unique code in [0, KEYSPACE)."""
+    tables = _get_round_tables()
+    value = position % KEYSPACE
+    while True:
+        left, right = value >> _HALF_BITS, value & _HALF_MASK
+        for table in tables:
+            left, right = right, left ^ table[right]
+        value = (left << _HALF_BITS) | right
+        # Cycle-walk: values past the keyspace get permuted again until they land inside
+        if value < KEYSPACE:
+            return value
+
+
+def _reserve_block(size):
+    with transaction.atomic():
+        counter, _ = OtpCounter.objects.select_for_update().get_or_create(id=1)
+        start = counter.next_position
+        OtpCounter.objects.filter(id=1).update(next_position=F('next_position') + size)
+    return start, start + size
+
+
+def allocate(count):
+    """Return `count` fresh OTP codes."""
+    with _lock:
+        if _block['end'] - _block['next'] < count:
+            _block['next'], _block['end'] = _reserve_block(max(BLOCK_SIZE, count))
+        start = _block['next']
+        _block['next'] += count
+
+    return [f'{permute(position):06d}' for position in range(start, start + count)]
+
+
+def discard_block():
+    """
+    Drop the cached block, e.g. after a code from it hit the unique constraint
+    (its reservation was rolled back with an outer transaction, or the counter
+    wrapped around the keyspace onto codes that are still in use).
+    """
+    with _lock:
+        _block['next'] = _block['end'] = 0
@@ -0,0 +1,118 @@
+"""
+Transactional email outbox.
+
+Views call ``queue_email`` inside their transaction, so the email row
+commits (or rolls back) together with the booking, and the request never
+waits on the mail server. ``manage.py send_outbox`` drains the table: it
+leases a batch of due rows, sends them over one open, reused connection,
+and reschedules failures with exponential backoff until MAX_ATTEMPTS.
+"""
+import datetime
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection as db_connection, transaction
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+MAX_ATTEMPTS = 6
+BACKOFF_SECONDS = 30  # 30s, 1m, 2m, 4m, 8m...
+MAX_BACKOFF_SECONDS = 60 * 60
+# How long a worker owns the rows it picked before another worker may retry them
+LEASE_SECONDS = 5 * 60
+
+
+def queue_email(subject, message, recipient_list, from_email=None):
+    """Store an email to be sent by the outbox worker."""
+    return OutboxEmail.objects.create(
+        subject=subject,
+        message=message,
+        from_email=from_email or '',
+        recipients=','.join(recipient_list),
+    )
+
+
+def queue_emails(emails):
+    """queue_email for many (subject, message, recipient_list) at once, in one INSERT."""
+    return OutboxEmail.objects.bulk_create([
+        OutboxEmail(subject=subject, message=message, from_email='', recipients=','.join(recipient_list))
+        for subject, message, recipient_list in emails
+    ])
+
+
+def backoff(attempts):
+    return datetime.timedelta(seconds=min(BACKOFF_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS))
+
+
+def _lease_batch(batch_size, now):
+    with transaction.atomic():
+        due = OutboxEmail.objects.filter(status='pending', next_attempt_at__lte=now).order_by('next_attempt_at')
+        if db_connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        emails = list(due[:batch_size])
+        OutboxEmail.objects.filter(id__in=[email.id for email in emails]).update(
+            next_attempt_at=now + datetime.timedelta(seconds=LEASE_SECONDS)
+        )
+    return emails
+
+
+def _build(email, connection):
+    return EmailMessage(
+        subject=email.subject,
+        body=email.message,
+        from_email=email.from_email or None,
+        to=email.recipients.split(','),
+        connection=connection,
+    )
+
+
+def send_pending(batch_size=100, connection=None):
+    """
+    Send one batch of due emails. Pass an open `connection` to reuse it across
+    batches. Returns (sent, failed); call again until both are 0.
+    """
+    now = timezone.now()
+    emails = _lease_batch(batch_size, now)
+    if not emails:
+        return 0, 0
+
+    own_connection = connection is None
+    connection = connection or get_connection()
+    connection.open()
+    errors = {}
+    try:
+        # One message per send_messages call on the already open connection:
+        # a refused recipient then fails only its own row, and the messages
+        # before it are never sent twice
+        for email in emails:
+            try:
+                connection.send_messages([_build(email, connection)])
+            except Exception as exc:
+                errors[email.id] = exc
+                # The server may have dropped us, reconnect for the next one
+                connection.close()
+    finally:
+        if own_connection:
+            connection.close()
+
+    OutboxEmail.objects.filter(id__in=[email.id for email in emails if email.id not in errors]).update(
+        status='sent', sent_at=timezone.now(), last_error=''
+    )
+    for email in emails:
+        if email.id not in errors:
+            continue
+        attempts = email.attempts + 1
+        OutboxEmail.objects.filter(id=email.id).update(
+            attempts=attempts,
+            status='failed' if attempts >= MAX_ATTEMPTS else 'pending',
+            next_attempt_at=now + backoff(attempts),
+            last_error=repr(errors[email.id]),
+        )
+
+    return len(emails) - len(errors), len(errors)
+
+
+def purge_sent(older_than):
+    """Delete sent emails older than `older_than`."""
+    deleted, _ = OutboxEmail.objects.filter(status='sent', sent_at__lt=older_than).delete()
+    return deleted
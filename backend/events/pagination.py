@@ -0,0 +1,55 @@
+import functools
+
+from django.core.paginator import Paginator
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class OptInCursorPagination(CursorPagination):
+    # Keyset (cursor) pages, but only when the client asks with ?page_size= or ?cursor=.
+    # Existing clients fetch the whole list in one go and keep getting a plain list.
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class EventCursorPagination(OptInCursorPagination):
+    ordering = ('event_date', 'id')
+
+
+class BookingCursorPagination(OptInCursorPagination):
+    page_size = 100
+    max_page_size = 1000
+    ordering = ('id',)
+
+
+class _CountedPaginator(Paginator):
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        if count is not None:
+            # Skip the COUNT(*) query, the caller already knows
+            self.__dict__['count'] = count
+
+
+class SearchPagination(PageNumberPagination):
+    # Search results are ordered by rank, so plain numbered pages
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    count = None
+
+    @property
+    def django_paginator_class(self):
+        return functools.partial(_CountedPaginator, count=self.count)
+
+    def paginate_queryset(self, queryset, request, view=None, count=None):
+        self.count = count
+        return super().paginate_queryset(queryset, request, view)
@@ -0,0 +1,192 @@
+"""
+Resized poster variants for the event listing.
+
+The uploaded poster is kept as is. After it is saved (see signals.py),
+``build_variants`` renders it at a few widths as WebP and JPEG and stores
+the files under ``posters/variants/<event id>/`` with a hash of their
+content in the name, so a URL never changes meaning and can be cached
+forever. The result is recorded on ``Event.poster_variants``::
+
+    {"source": "posters/gig.png",
+     "sizes": {"thumb": {"width": 160, "height": 90,
+                         "webp": "posters/variants/7/gig-160w.3f2a....webp",
+                         "jpeg": "posters/variants/7/gig-160w.91c0....jpg"}, ...}}
+
+Each event has its own directory, so two events with the same poster
+don't share files and replacing one's poster can delete its old
+variants. Variants stored before that (directly under
+``posters/variants/``) may be shared and are never deleted.
+
+``source`` is the poster the variants were made from; when it no longer
+matches ``Event.poster`` the variants are stale, the API stops exposing
+them and ``manage.py build_poster_variants`` rebuilds them.
+"""
+import hashlib
+import io
+import logging
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from . import listing
+from .models import Event
+
+logger = logging.getLogger(__name__)
+
+VARIANT_DIR = 'posters/variants'
+
+# name: width in pixels. Never upscaled, a small poster just gets a small variant
+SIZES = {
+    'thumb': 160,
+    'card': 480,
+    'large': 1200,
+}
+
+# format key: (Pillow format, extension, save options)
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def is_current(event):
+    variants = event.poster_variants or {}
+    return bool(event.poster) and variants.get('source') == event.poster.name
+
+
+def _render(image, width, pil_format, options):
+    if image.width > width:
+        height = max(1, round(image.height * width / image.width))
+        image = image.resize((width, height), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, pil_format, **options)
+    return image.size, buffer.getvalue()
+
+
+def _event_dir(event_id):
+    return f'{VARIANT_DIR}/{event_id}'
+
+
+def _store(content, event_id, stem, width, extension):
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    name = f'{_event_dir(event_id)}/{stem}-{width}w.{digest}.{extension}'
+    # Same content, same name: nothing to write
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(content))
+    return name
+
+
+def variant_files(variants):
+    for size in (variants or {}).get('sizes', {}).values():
+        for key in FORMATS:
+            if size.get(key):
+                yield size[key]
+
+
+def delete_files(event, names):
+    """Delete the event's own variant files among `names`."""
+    prefix = _event_dir(event.id) + '/'
+    for name in names:
+        if not name.startswith(prefix):
+            continue  # From before per-event directories, maybe another event's too
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.warning('Could not delete poster variant %s', name)
+
+
+def build_variants(event):
+    """
+    Render and store the variants of the event's current poster.
+    Returns the new poster_variants, or None if the poster was replaced meanwhile.
+    """
+    source = event.poster.name
+    with default_storage.open(source, 'rb') as f:
+        image = Image.open(f)
+        image = ImageOps.exif_transpose(image)
+        # WebP and JPEG both want plain RGB; flatten transparency onto white
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+
+    stem = os.path.splitext(os.path.basename(source))[0]
+    sizes = {}
+    for size_name, width in SIZES.items():
+        entry = {}
+        for key, (pil_format, extension, options) in FORMATS.items():
+            (entry['width'], entry['height']), content = _render(image, width, pil_format, options)
+            entry[key] = _store(content, event.id, stem, entry['width'], extension)
+        sizes[size_name] = entry
+
+    variants = {'source': source, 'sizes': sizes}
+    old = set(variant_files(event.poster_variants)) - set(variant_files(variants))
+
+    # Only if the poster wasn't replaced while we were rendering
+    if not Event.objects.filter(id=event.id, poster=source).update(poster_variants=variants):
+        return None
+    event.poster_variants = variants
+    delete_files(event, old)
+    listing.invalidate_on_commit()
+    return variants
+
+
+def clear_variants(event):
+    """The poster was removed: drop its variants."""
+    old = list(variant_files(event.poster_variants))
+    Event.objects.filter(id=event.id).update(poster_variants={})
+    event.poster_variants = {}
+    delete_files(event, old)
+    listing.invalidate_on_commit()
+
+
+def refresh(event, force=False):
+    """
+    Bring the event's variants in line with its poster. Returns True if anything changed.
+    Errors are logged; `manage.py build_poster_variants` picks the event up again later.
+    """
+    try:
+        if event.poster:
+            if force or not is_current(event):
+                return build_variants(event) is not None
+        elif event.poster_variants:
+            clear_variants(event)
+            return True
+    except Exception:
+        logger.exception('Could not build poster variants for event %s', event.id)
+    return False
+
+
+def refresh_on_commit(event):
+    transaction.on_commit(lambda: refresh(event))
+
+
+def variant_urls(event, request=None):
+    """{'thumb': {'width': .., 'height': .., 'webp': url, 'jpeg': url}, ...} or None if not built yet."""
+    return variant_urls_of(event.poster.name if event.poster else '', event.poster_variants, request)
+
+
+def variant_urls_of(poster_name, poster_variants, request=None):
+    """``variant_urls`` from the two column values (events/fast_serializers.py reads rows, not events)."""
+    poster_variants = poster_variants or {}
+    if not poster_name or poster_variants.get('source') != poster_name:
+        return None
+
+    def url(name):
+        value = default_storage.url(name)
+        return request.build_absolute_uri(value) if request is not None else value
+
+    return {
+        size_name: {
+            'width': size['width'],
+            'height': size['height'],
+            **{key: url(size[key]) for key in FORMATS},
+        }
+        for size_name, size in poster_variants['sizes'].items()
+    }
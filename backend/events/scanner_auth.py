@@ -0,0 +1,111 @@
+"""
+Authentication of door scanners without touching the database.
+
+JWTAuthentication loads the User row on every request, and the role
+check after it (``hasattr(user, 'volunteer_profile')``) costs another
+query, all before the check-in itself. Tokens now carry the roles:
+
+    is_staff          the user is an admin
+    volunteer         the user has a Volunteer profile
+    volunteer_active  ... and it is active
+
+They are written when the tokens are issued (volunteer_login and
+/api/token/) and again on every /api/token/refresh/. ``ScannerAuthentication``
+(the verify, batch, manifest and check-in upload endpoints) builds a
+TokenUser from those claims, so with SCANNER_STATELESS_AUTH on the
+check-in path only queries the Ticket table. Access tokens live a day, so
+the claims are only trusted for SCANNER_CLAIMS_MAX_MINUTES after the token
+was issued; older tokens, and tokens issued before the claims existed,
+get the User query (and its is_active check) until they are refreshed.
+
+Losing a role can't wait that long: deactivating or deleting a volunteer,
+or deactivating a user or taking their staff status away, ``revoke``s
+them. Their tokens issued until then are turned away, new ones (a login
+or refresh, with the new roles) are not. The marker stays in the cache
+for ACCESS_TOKEN_LIFETIME; with several processes the cache must be
+shared (Redis) for that to reach all of them.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# Present in every token that carries the roles
+ROLE_CLAIM = 'volunteer'
+
+
+def _revoked_key(user_id):
+    return f'scanner_auth:revoked:{user_id}'
+
+
+def add_role_claims(token, user):
+    volunteer = getattr(user, 'volunteer_profile', None)
+    token['is_staff'] = user.is_staff
+    token['volunteer'] = volunteer is not None
+    token['volunteer_active'] = volunteer is not None and volunteer.is_active
+    return token
+
+
+def tokens_for(user):
+    """A RefreshToken (its access_token included) with the user's roles."""
+    return add_role_claims(RefreshToken.for_user(user), user)
+
+
+def revoke(user_id):
+    """Turn away the tokens the user was issued until now."""
+    cache.set(_revoked_key(user_id), int(time.time()), api_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+
+
+def is_volunteer(user):
+    """Whether `user` is an active volunteer, from the token when it says so."""
+    if isinstance(user, TokenUser):
+        return bool(user.token.get('volunteer') and user.token.get('volunteer_active'))
+    volunteer = getattr(user, 'volunteer_profile', None)
+    return volunteer is not None and volunteer.is_active
+
+
+def _trusted(token):
+    issued_at = token.get('iat')
+    if not settings.SCANNER_STATELESS_AUTH or ROLE_CLAIM not in token or issued_at is None:
+        return False
+    return time.time() - issued_at < settings.SCANNER_CLAIMS_MAX_MINUTES * 60
+
+
+class ScannerAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if not _trusted(validated_token):
+            return super().get_user(validated_token)
+        user = TokenUser(validated_token)
+        revoked_at = cache.get(_revoked_key(user.id))
+        if revoked_at is not None and validated_token['iat'] <= revoked_at:
+            raise AuthenticationFailed('Access revoked, log in again', code='token_revoked')
+        return user
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    # /api/token/ (SIMPLE_JWT['TOKEN_OBTAIN_SERIALIZER'])
+    @classmethod
+    def get_token(cls, user):
+        return add_role_claims(super().get_token(user), user)
+
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    # /api/token/refresh/ (SIMPLE_JWT['TOKEN_REFRESH_SERIALIZER']): the new access token gets the current roles
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        refresh = self.token_class(attrs['refresh'])
+        user = (
+            User.objects.select_related('volunteer_profile')
+            .filter(**{api_settings.USER_ID_FIELD: refresh[api_settings.USER_ID_CLAIM]})
+            .first()
+        )
+        if user is not None:
+            data['access'] = str(add_role_claims(refresh.access_token, user))
+        return data
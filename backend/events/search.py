@@ -0,0 +1,248 @@
+"""
+Server-side event search with facets.
+
+Text search covers title, organizer, venue and description of active
+events, ranked so title hits come first, then organizer/venue, then
+description.
+
+* On Postgres it is full-text search: ``VECTOR_SQL`` is a weighted
+  tsvector, indexed by the GIN expression index ``event_search_idx``
+  (migration 0012). Queries use exactly the same expression so the
+  planner can use that index, with ``websearch_to_tsquery`` for the
+  user's input (quotes, ``-word`` and ``or`` work as on search engines).
+* Elsewhere (SQLite in development and tests) an inverted index of the
+  same fields is built in memory and rebuilt whenever the listing cache
+  version changes, i.e. whenever an event is edited (not on bookings). Every word of the
+  query has to match the start of a word of the event.
+
+Facets (event type, date, price band, availability) are counted with
+one aggregate query using conditional COUNTs. Each facet's counts apply
+every *other* selected filter, so picking "workshop" still shows how
+many conferences there are.
+"""
+import bisect
+import collections
+import datetime
+import re
+import threading
+
+from django.db import connection
+from django.db.models import Case, Count, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.fields import BooleanField
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from . import listing
+from .models import Event
+
+SEARCH_CONFIG = 'english'
+
+# Keep in sync with migration 0012_event_search_index, the index only helps if this is identical
+VECTOR_SQL = (
+    "setweight(to_tsvector('english', coalesce(\"events_event\".\"title\", '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(\"events_event\".\"organizer\", '') || ' ' || "
+    "coalesce(\"events_event\".\"venue\", '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(\"events_event\".\"description\", '')), 'C')"
+)
+
+# Fallback index: how much a hit in each field counts
+FIELD_WEIGHTS = {'title': 1.0, 'organizer': 0.4, 'venue': 0.4, 'description': 0.1}
+
+PRICE_BANDS = {
+    # value: (label, condition)
+    'free': ('Free', Q(ticket_price=0)),
+    'under_100': ('Under 100', Q(ticket_price__gt=0, ticket_price__lt=100)),
+    '100_500': ('100 to 500', Q(ticket_price__gte=100, ticket_price__lte=500)),
+    'over_500': ('Over 500', Q(ticket_price__gt=500)),
+}
+
+AVAILABILITY = {
+    'available': ('Seats available', Q(available_seats__gt=0)),
+    'sold_out': ('Sold out', Q(available_seats=0)),
+}
+
+MAX_QUERY_LENGTH = 200
+MAX_FALLBACK_HITS = 500
+
+_word = re.compile(r'\w+')
+
+
+def words(text):
+    return _word.findall((text or '').lower())
+
+
+def date_buckets(today=None):
+    today = today or timezone.localdate()
+    week = today + datetime.timedelta(days=7)
+    month = today + datetime.timedelta(days=30)
+    return {
+        'past': ('Past', Q(event_date__lt=today)),
+        'this_week': ('Next 7 days', Q(event_date__gte=today, event_date__lt=week)),
+        'this_month': ('Next 30 days', Q(event_date__gte=today, event_date__lt=month)),
+        'later': ('Later', Q(event_date__gte=month)),
+    }
+
+
+def facet_definitions():
+    return {
+        'event_type': {value: (label, Q(event_type=value)) for value, label in Event.EventType},
+        'date': date_buckets(),
+        'price': PRICE_BANDS,
+        'availability': AVAILABILITY,
+    }
+
+
+class _InvertedIndex:
+    """word -> {event id: score}, plus the sorted vocabulary for prefix lookups."""
+
+    def __init__(self, version):
+        self.version = version
+        postings = collections.defaultdict(dict)
+        rows = Event.objects.filter(is_active=True).values_list('id', *FIELD_WEIGHTS)
+        for event_id, *fields in rows.iterator(chunk_size=1000):
+            for weight, text in zip(FIELD_WEIGHTS.values(), fields):
+                for word in words(text):
+                    postings[word][event_id] = postings[word].get(event_id, 0) + weight
+        self.postings = dict(postings)
+        self.vocabulary = sorted(self.postings)
+
+    def lookup(self, term):
+        """Scores of events having a word that starts with `term`."""
+        scores = {}
+        start = bisect.bisect_left(self.vocabulary, term)
+        for word in self.vocabulary[start:]:
+            if not word.startswith(term):
+                break
+            # An exact match beats a longer word it is a prefix of
+            factor = 1.0 if word == term else 0.5
+            for event_id, score in self.postings[word].items():
+                scores[event_id] = max(scores.get(event_id, 0), score * factor)
+        return scores
+
+    def search(self, text):
+        scores = None
+        for term in dict.fromkeys(words(text)):
+            hits = self.lookup(term)
+            if scores is None:
+                scores = hits
+            else:
+                scores = {event_id: scores[event_id] + score for event_id, score in hits.items() if event_id in scores}
+            if not scores:
+                return {}
+        return scores or {}
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def inverted_index():
+    global _index
+    version = listing.current_version()
+    with _index_lock:
+        if _index is None or _index.version != version:
+            _index = _InvertedIndex(version)
+        return _index
+
+
+def text_filter(queryset, text):
+    """
+    Returns (`queryset` narrowed to events matching `text`, an expression to
+    annotate as the rank, higher is better).
+    """
+    if connection.vendor == 'postgresql':
+        query = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        matches = RawSQL(f"({VECTOR_SQL}) @@ {query}", [text], output_field=BooleanField())
+        rank = RawSQL(f"ts_rank({VECTOR_SQL}, {query})", [text], output_field=FloatField())
+        return queryset.filter(matches), rank
+
+    scores = inverted_index().search(text)
+    # Only the best hits, the CASE below has to stay a reasonable size
+    best = dict(sorted(scores.items(), key=lambda item: -item[1])[:MAX_FALLBACK_HITS])
+    rank = Case(
+        *[When(id=event_id, then=Value(score)) for event_id, score in best.items()],
+        default=Value(0.0), output_field=FloatField(),
+    )
+    return queryset.filter(id__in=best), rank
+
+
+def parse_selection(params, facets):
+    """The facet values picked in the query string, e.g. ?event_type=workshop,seminar&price=free"""
+    selected = {}
+    for name, buckets in facets.items():
+        values = [value for value in params.get(name, '').split(',') if value in buckets]
+        if values:
+            selected[name] = values
+    return selected
+
+
+def _selected_q(facets, selected, skip=None):
+    condition = Q()
+    for name, values in selected.items():
+        if name == skip:
+            continue
+        either = Q()
+        for value in values:
+            either |= facets[name][value][1]
+        condition &= either
+    return condition
+
+
+def _date(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError(f'{name} must be a date (YYYY-MM-DD)')
+    return parsed
+
+
+def search(params):
+    """
+    Run a search for the query params (q, facet selections, date_from, date_to).
+    Returns (ranked queryset of matching events, total count, facet counts).
+    Raises ValueError for malformed dates.
+    """
+    facets = facet_definitions()
+    selected = parse_selection(params, facets)
+    text = params.get('q', '').strip()[:MAX_QUERY_LENGTH]
+
+    events = Event.objects.filter(is_active=True)
+    date_from = _date(params, 'date_from')
+    date_to = _date(params, 'date_to')
+    if date_from:
+        events = events.filter(event_date__gte=date_from)
+    if date_to:
+        events = events.filter(event_date__lte=date_to)
+    rank = None
+    if text:
+        events, rank = text_filter(events, text)
+
+    # Total and every facet bucket in a single query
+    aggregates = {'total': Count('id', filter=_selected_q(facets, selected))}
+    for name, buckets in facets.items():
+        others = _selected_q(facets, selected, skip=name)
+        for value, (label, condition) in buckets.items():
+            aggregates[f'{name}__{value}'] = Count('id', filter=condition & others)
+    counts = events.aggregate(**aggregates)
+
+    facet_counts = {
+        name: [
+            {'value': value, 'label': label, 'count': counts[f'{name}__{value}'],
+             'selected': value in selected.get(name, ())}
+            for value, (label, condition) in buckets.items()
+        ]
+        for name, buckets in facets.items()
+    }
+
+    results = events.filter(_selected_q(facets, selected))
+    if rank is not None:
+        results = results.annotate(rank=rank).order_by('-rank', 'event_date', 'id')
+    else:
+        results = results.order_by('event_date', 'id')
+    return results, counts['total'], facet_counts
@@ -1,40 +1,85 @@
 from rest_framework import serializers
-from .models import Event, Booking, Ticket
+from .models import Event, Booking, Ticket, WaitlistEntry
+from .metrics import TimedSerializerMixin
+from . import posters
 
-class EventSerializer(serializers.ModelSerializer):
+class EventSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     poster = serializers.ImageField(required=False)
     class Meta:
         model = Event
         fields = '__all__'
+        # Managed by events/inventory.py and events/posters.py, not editable through the API
+        # (a new total_seats is applied to the available seats by Event.save)
+        read_only_fields = ['available_seats', 'seat_shards', 'poster_variants']
 
-class EventListSerializer(serializers.ModelSerializer):
+    def create(self, validated_data):
+        validated_data['available_seats'] = validated_data.get('total_seats', 0)
+        return super().create(validated_data)
+
+class PosterVariantsMixin(serializers.Serializer):
+    # Resized poster URLs for the listing cards (null until they are built)
+    poster_variants = serializers.SerializerMethodField()
+
+    def get_poster_variants(self, event):
+        return posters.variant_urls(event, self.context.get('request'))
+
+class EventListSerializer(TimedSerializerMixin, PosterVariantsMixin, serializers.ModelSerializer):
     class Meta:
         model = Event
         fields = [
             'id', 'title', 'event_type', 'organizer', 'venue', 'ticket_price','total_seats',
             'available_seats', 'event_date', 'event_time', 'location', 'is_active','created_at',
-            'poster', 'description'
+            'poster', 'poster_variants', 'description'
+        ]
+
+class EventCompactSerializer(TimedSerializerMixin, PosterVariantsMixin, serializers.ModelSerializer):
+    # Listing cards only need these, see listing.COMPACT_FIELDS
+    class Meta:
+        model = Event
+        fields = [
+            'id', 'title', 'event_type', 'organizer', 'venue', 'ticket_price', 'total_seats',
+            'available_seats', 'event_date', 'event_time', 'location', 'poster', 'poster_variants'
         ]
 
-class BookingSerializer(serializers.ModelSerializer):
+class BookingSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     # This converts booking data to/from JSON
     
     class Meta:
         model = Booking
         fields = ['id', 'event', 'customer_name', 'roll_number', 'section', 
                  'email', 'phone', 'number_of_tickets', 'total_amount', 
-                 'payment_status', 'created_at']
+                 'payment_status', 'hold_expires_at', 'created_at']
         
         # These fields are calculated automatically, user can't set them
-        read_only_fields = ['id', 'total_amount', 'payment_status', 'created_at']
+        read_only_fields = ['id', 'total_amount', 'payment_status', 'hold_expires_at', 'created_at']
+
+class BookingImportSerializer(BookingSerializer):
+    # Past bookings from a bulk import (events/imports.py): the event is looked up
+    # once per chunk, the status, payment id and date come from the file
+    event = serializers.IntegerField(min_value=1)
+    payment_status = serializers.ChoiceField(choices=['completed', 'failed', 'expired'], default='completed')
+    created_at = serializers.DateTimeField(required=False)
+
+    class Meta(BookingSerializer.Meta):
+        fields = ['event', 'customer_name', 'roll_number', 'section', 'email', 'phone',
+                  'number_of_tickets', 'payment_status', 'payment_id', 'created_at']
+        read_only_fields = []
+
+class WaitlistEntrySerializer(serializers.ModelSerializer):
+    # Same customer fields as a booking; the event comes from the URL (events/waitlist.py)
+    class Meta:
+        model = WaitlistEntry
+        fields = ['customer_name', 'roll_number', 'section', 'email', 'phone', 'number_of_tickets']
+        # The one-waiting-entry-per-roll-number constraint is handled by waitlist.join
+        validators = []
 
-class TicketSerializer(serializers.ModelSerializer):
+class TicketSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Ticket
         fields = ['id', 'ticket_number', 'otp_code', 'is_verified']
         read_only_fields = ['id', 'otp_code', 'is_verified']
 
-class BookingWithTicketsSerializer(serializers.ModelSerializer):
+class BookingWithTicketsSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     event_title = serializers.CharField(source='event.title', read_only=True)
     event_date = serializers.DateField(source='event.event_date', read_only=True)
     event_time = serializers.TimeField(source='event.event_time', read_only=True)
@@ -0,0 +1,75 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import archive, listing, metrics, posters, scanner_auth
+from .models import BookingArchive, Event, EventStats, Volunteer
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def event_changed(sender, **kwargs):
+    # The cached event listing is out of date now
+    listing.invalidate_on_commit()
+
+
+@receiver(post_save, sender=Event)
+def poster_changed(sender, instance, raw=False, **kwargs):
+    # New or replaced poster: render its listing variants once the upload is committed
+    if raw:
+        return
+    if instance.poster and not posters.is_current(instance) or not instance.poster and instance.poster_variants:
+        posters.refresh_on_commit(instance)
+
+
+@receiver(post_save, sender=Event)
+def event_created(sender, instance, created, raw=False, **kwargs):
+    # Start the stats row now, so the first booking only has to UPDATE it
+    if created and not raw:
+        EventStats.objects.create(event=instance)
+
+
+@receiver(post_save, sender=Volunteer)
+def volunteer_changed(sender, instance, raw=False, **kwargs):
+    # Tokens say whether the volunteer is active, turn them away as soon as that's no longer true
+    # (reactivating doesn't lift the marker: it may be the user's own, and new tokens get past it anyway)
+    if not raw and not instance.is_active:
+        scanner_auth.revoke(instance.user_id)
+
+
+@receiver(post_delete, sender=Volunteer)
+def volunteer_deleted(sender, instance, **kwargs):
+    scanner_auth.revoke(instance.user_id)
+
+
+ROLE_FIELDS = ('is_active', 'is_staff')
+
+
+@receiver(pre_save, sender=User)
+def user_roles_before(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Logins only save last_login, skip the lookup then
+    if raw or instance.pk is None or update_fields is not None and not set(update_fields) & set(ROLE_FIELDS):
+        instance._roles_before = None
+        return
+    instance._roles_before = User.objects.filter(pk=instance.pk).values(*ROLE_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def user_roles_changed(sender, instance, **kwargs):
+    # Deactivated or no longer staff: the role claims in their tokens are stale now
+    before = getattr(instance, '_roles_before', None)
+    if before and any(before[field] and not getattr(instance, field) for field in ROLE_FIELDS):
+        scanner_auth.revoke(instance.pk)
+
+
+@receiver(post_delete, sender=BookingArchive)
+def booking_archive_deleted(sender, instance, **kwargs):
+    # Restored, or its event was deleted: nothing points at the file anymore
+    name = instance.file
+    transaction.on_commit(lambda: archive.storage().delete(name))
+
+
+# Per-request query counts and timings (events/metrics.py)
+connection_created.connect(metrics.install_query_timer)
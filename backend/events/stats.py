@@ -0,0 +1,155 @@
+"""
+Per-event sales and attendance statistics.
+
+EventStats rows hold running totals (paid bookings, tickets sold,
+revenue, pending bookings and their seats, tickets checked in). They are
+never computed from Booking/Ticket on read: every change adds its delta
+with ``record`` inside the transaction that makes the change, so the
+numbers commit (or roll back) together with the booking or check-in:
+
+* create_booking: +1 pending booking (and its seats)
+* complete_payment: pending -> paid, tickets sold and revenue
+* expire_stale_holds: -pending bookings (and their seats)
+* verify_codes (single, batch and offline check-ins): +checked in
+
+Like seat inventory (events/inventory.py), the delta is a single
+``UPDATE ... SET x = x + n``. Sharded events spread their stats over
+``seat_shards`` rows so concurrent payments don't queue on one row; the
+dashboard sums an event's rows, which is at most ``seat_shards`` rows.
+
+Anything else that changes bookings (admin edits, deletes) is not
+tracked; ``reconcile`` recomputes the totals from scratch with one
+aggregate per table per batch of events, reports the drift and fixes it
+(``manage.py reconcile_stats``). Bookings moved to cold storage
+(events/archive.py) still count, with the totals saved in their
+BookingArchive.
+"""
+import decimal
+import random
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Q, Sum
+from django.utils import timezone
+
+from .models import Booking, BookingArchive, EventStats, Ticket
+
+FIELDS = ('paid_bookings', 'tickets_sold', 'revenue', 'pending_bookings', 'pending_seats', 'checked_in')
+
+PAID = Q(payment_status='completed')
+PENDING = Q(payment_status='pending')
+
+
+def _zero(field):
+    return decimal.Decimal('0.00') if field == 'revenue' else 0
+
+
+def record(event, **deltas):
+    """
+    Add `deltas` (field=amount) to the event's stats. Call it inside the
+    transaction that makes the change being counted.
+    """
+    deltas = {field: value for field, value in deltas.items() if value}
+    if not deltas:
+        return
+
+    shard_index = random.randrange(event.seat_shards) if event.seat_shards else 0
+    changes = {field: F(field) + value for field, value in deltas.items()}
+    rows = EventStats.objects.filter(event_id=event.id, shard_index=shard_index)
+    if rows.update(updated_at=timezone.now(), **changes):
+        return
+
+    # No row yet (events from before stats, or a new shard)
+    try:
+        with transaction.atomic():
+            EventStats.objects.create(event_id=event.id, shard_index=shard_index, **deltas)
+    except IntegrityError:
+        # Somebody else created it just now
+        rows.update(updated_at=timezone.now(), **changes)
+
+
+def for_event(event):
+    """The event's totals as a dict, plus `updated_at` (None if nothing was recorded yet)."""
+    sums = {field: Sum(field) for field in FIELDS}
+    totals = EventStats.objects.filter(event=event).aggregate(**sums, updated_at=Max('updated_at'))
+    result = {field: totals[field] or _zero(field) for field in FIELDS}
+    result['updated_at'] = totals['updated_at']
+    return result
+
+
+def actual(event_ids):
+    """Totals computed from Booking and Ticket (and archives) for these events: {event id: {field: value}}."""
+    totals = {event_id: {field: _zero(field) for field in FIELDS} for event_id in event_ids}
+
+    for event_id, archived in BookingArchive.objects.filter(event_id__in=event_ids).values_list('event_id', 'totals'):
+        for field in FIELDS:
+            # JSON keeps the revenue as a string
+            value = archived.get(field, 0)
+            totals[event_id][field] += decimal.Decimal(value) if field == 'revenue' else value
+
+    # Archived rows not deleted yet (an interrupted archive_bookings) are already in the totals above
+    bookings = (
+        Booking.objects.filter(event_id__in=event_ids)
+        .exclude(Exists(BookingArchive.objects.filter(event_id=OuterRef('event_id'), last_booking_id__gte=OuterRef('id'))))
+        .values('event_id')
+        .annotate(
+            paid_bookings=Count('id', filter=PAID),
+            tickets_sold=Sum('number_of_tickets', filter=PAID),
+            revenue=Sum('total_amount', filter=PAID),
+            pending_bookings=Count('id', filter=PENDING),
+            pending_seats=Sum('number_of_tickets', filter=PENDING),
+        )
+        .order_by()
+    )
+    for row in bookings:
+        event_id = row.pop('event_id')
+        for field, value in row.items():
+            totals[event_id][field] += value or 0
+
+    checked_in = (
+        Ticket.objects.filter(booking__event_id__in=event_ids, is_verified=True)
+        .exclude(Exists(BookingArchive.objects.filter(
+            event_id=OuterRef('booking__event_id'), last_booking_id__gte=OuterRef('booking_id'),
+        )))
+        .values('booking__event_id')
+        .annotate(checked_in=Count('id'))
+        .order_by()
+    )
+    for row in checked_in:
+        totals[row['booking__event_id']]['checked_in'] += row['checked_in']
+    return totals
+
+
+@transaction.atomic
+def reconcile(event_ids, fix=True):
+    """
+    Compare the stored stats of these events with `actual` ones.
+    Returns {event id: {field: (stored, actual)}} for the fields that drifted,
+    and with `fix` replaces the drifted events' rows with the actual totals.
+    """
+    # Lock the rows first: a booking committing meanwhile either waits for us and
+    # adds its delta to the fixed row, or is already visible to the recount
+    rows = EventStats.objects.select_for_update().filter(event_id__in=event_ids).order_by('event_id', 'shard_index')
+    stored = {event_id: {field: _zero(field) for field in FIELDS} for event_id in event_ids}
+    for row in rows.values('event_id', *FIELDS):
+        event_id = row.pop('event_id')
+        for field, value in row.items():
+            stored[event_id][field] += value
+
+    drift = {}
+    expected = actual(event_ids)
+    for event_id in event_ids:
+        fields = {
+            field: (stored[event_id][field], expected[event_id][field])
+            for field in FIELDS if stored[event_id][field] != expected[event_id][field]
+        }
+        if fields:
+            drift[event_id] = fields
+
+    if fix and drift:
+        now = timezone.now()
+        EventStats.objects.filter(event_id__in=drift).delete()
+        EventStats.objects.bulk_create([
+            EventStats(event_id=event_id, shard_index=0, updated_at=now, **expected[event_id])
+            for event_id in drift
+        ])
+    return drift
@@ -0,0 +1,19 @@
+"""
+Uploads in an S3 compatible bucket (MEDIA_STORAGE=s3), needs
+``pip install django-storages[s3]``. Any S3 API works: AWS, or MinIO
+running locally as a stand-in.
+
+Objects are uploaded with the Cache-Control events/media.py would have
+sent, so the bucket (or the CDN in front of it) serves posters with the
+same caching as MEDIA_DELIVERY does locally.
+"""
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from . import media
+
+
+class MediaStorage(S3Boto3Storage):
+    def get_object_parameters(self, name):
+        parameters = super().get_object_parameters(name)
+        parameters.setdefault('CacheControl', media.cache_control(name))
+        return parameters
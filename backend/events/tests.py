@@ -1,3 +1,1892 @@
-from django.test import TestCase
+import base64
+import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.http import Http404
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import (
+    archive, bookings, changelists, checkin, db_routing, exports, fast_serializers, holds, idempotency, imports,
+    inventory, listing, manifest, media, metrics, otp, outbox, posters, renderers, scanner_auth, stats, throttling,
+    tickets, waiting_room,
+)
+from .serializers import BookingWithTicketsSerializer, EventCompactSerializer, EventListSerializer
+from .models import (
+    Event, Booking, BookingArchive, EventStats, IdempotencyKey, OtpCounter, OutboxEmail, SeatShard, Ticket, Volunteer,
+    WaitingRoom, WaitlistEntry,
+)
+
+
+def make_event(seats=10, **kwargs):
+    data = {
+        'title': 'Test Event',
+        'organizer': 'Eventra',
+        'venue': 'Main Hall',
+        'location': 'Campus',
+        'description': 'Test event',
+        'ticket_price': 100,
+        'total_seats': seats,
+        'available_seats': seats,
+        'event_date': datetime.date.today() + datetime.timedelta(days=7),
+        'event_time': datetime.time(18, 0),
+    }
+    data.update(kwargs)
+    return Event.objects.create(**data)
+
+
+def make_booking(event, tickets=1, **kwargs):
+    data = {
+        'event': event,
+        'customer_name': 'Test User',
+        'roll_number': 'R001',
+        'section': 'A',
+        'phone': '9999999999',
+        'number_of_tickets': tickets,
+    }
+    data.update(kwargs)
+    return Booking.objects.create(**data)
+
+
+class InventoryTests(TestCase):
+    def test_take_seats_never_goes_below_zero(self):
+        event = make_event(seats=3)
+        inventory.take_seats(event, 2)
+        with self.assertRaises(inventory.NotEnoughSeats):
+            inventory.take_seats(event, 2)
+        event.refresh_from_db()
+        self.assertEqual(event.available_seats, 1)
+
+    def test_release_seats_is_capped_at_total(self):
+        event = make_event(seats=3)
+        inventory.take_seats(event, 1)
+        inventory.release_seats(event, 5)
+        event.refresh_from_db()
+        self.assertEqual(event.available_seats, 3)
+
+    def test_saving_a_stale_event_keeps_the_seat_count(self):
+        event = make_event(seats=5)
+        inventory.take_seats(event, 5)  # Sold out behind this instance's back
+        event.title = 'Renamed'
+        event.save()
+        event.refresh_from_db()
+        self.assertEqual((event.title, event.available_seats), ('Renamed', 0))
+
+        # More seats: the difference is added to what is left, fewer never go below zero
+        event.total_seats = 8
+        event.save()
+        self.assertEqual(event.available_seats, 3)
+        event.total_seats = 2
+        event.save()
+        event.refresh_from_db()
+        self.assertEqual((event.total_seats, event.available_seats), (2, 0))
+
+    def test_seat_count_is_read_only_in_the_api(self):
+        event = make_event(seats=5)
+        inventory.take_seats(event, 5)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        response = client.patch(f'/api/events/{event.id}/', {'available_seats': 5, 'total_seats': 6},
+                                format='multipart')
+        self.assertEqual(response.status_code, 200)
+        event.refresh_from_db()
+        self.assertEqual((event.total_seats, event.available_seats), (6, 1))
+
+    def test_sharded_capacity_changes(self):
+        event = make_event(seats=8)
+        inventory.enable_sharding(event, shards=4)
+        self.assertEqual(inventory.change_capacity(event, 5), -3)
+        self.assertEqual(inventory.seats_left(event), 5)
+        self.assertEqual(inventory.change_capacity(event, 7), 2)
+        event.refresh_from_db()
+        self.assertEqual((inventory.seats_left(event), event.available_seats), (7, 7))
+
+    def test_sharded_take_falls_back_to_several_shards(self):
+        event = make_event(seats=8)
+        inventory.enable_sharding(event, shards=4)
+        event.refresh_from_db()
+        self.assertEqual(event.seat_shards, 4)
+
+        # 2 seats per shard, so a request for 3 has to span shards
+        inventory.take_seats(event, 3)
+        self.assertEqual(inventory.seats_left(event), 5)
+
+        inventory.disable_sharding(event)
+        event.refresh_from_db()
+        self.assertEqual(event.seat_shards, 0)
+        self.assertEqual(event.available_seats, 5)
+        self.assertFalse(SeatShard.objects.filter(event=event).exists())
+
+    def test_complete_payment_rejects_oversell(self):
+        event = make_event(seats=2)
+        first = make_booking(event, tickets=2)
+        second = make_booking(event, tickets=1)
+        client = APIClient()
+
+        response = client.post(f'/api/bookings/{first.id}/complete-payment/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['tickets']), 2)
+
+        response = client.post(f'/api/bookings/{second.id}/complete-payment/')
+        self.assertEqual(response.status_code, 400)
+        second.refresh_from_db()
+        self.assertEqual(second.payment_status, 'pending')
+        self.assertEqual(second.tickets.count(), 0)
+
+        # Paying twice doesn't deduct twice
+        response = client.post(f'/api/bookings/{first.id}/complete-payment/')
+        self.assertEqual(response.status_code, 200)
+        event.refresh_from_db()
+        self.assertEqual(event.available_seats, 0)
+
+
+class SeatHoldTests(TestCase):
+    def book(self, event, tickets=1):
+        return APIClient().post(f'/api/events/{event.id}/book/', {
+            'customer_name': 'Test User', 'roll_number': 'R001', 'section': 'A',
+            'phone': '9999999999', 'number_of_tickets': tickets,
+        })
+
+    def test_create_booking_holds_seats(self):
+        event = make_event(seats=3)
+        response = self.book(event, tickets=2)
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNotNone(response.data['hold_expires_at'])
+        event.refresh_from_db()
+        self.assertEqual(event.available_seats, 1)
+
+        self.assertEqual(self.book(event, tickets=2).status_code, 400)
+
+        # Paying keeps the held seats instead of taking them again
+        response = APIClient().post(f"/api/bookings/{response.data['id']}/complete-payment/")
+        self.assertEqual(response.status_code, 200)
+        event.refresh_from_db()
+        self.assertEqual(event.available_seats, 1)
+
+    def test_sweeper_releases_stale_holds_in_batches(self):
+        event = make_event(seats=10)
+        for _ in range(3):
+            self.book(event, tickets=2)
+        fresh = self.book(event, tickets=1).data['id']
+        Booking.objects.exclude(id=fresh).update(hold_expires_at=timezone.now() - datetime.timedelta(minutes=1))
+
+        self.assertEqual(holds.expire_stale_holds(batch_size=2), (2, 4))
+        self.assertEqual(holds.expire_stale_holds(batch_size=2), (1, 2))
+        self.assertEqual(holds.expire_stale_holds(batch_size=2), (0, 0))
+        event.refresh_from_db()
+        self.assertEqual(event.available_seats, 9)
+        self.assertEqual(Booking.objects.get(id=fresh).payment_status, 'pending')
+
+        # Old expired bookings get purged by the command
+        Booking.objects.filter(payment_status='expired').update(created_at=timezone.now() - datetime.timedelta(days=2))
+        call_command('expire_holds', stdout=io.StringIO())
+        self.assertEqual(list(Booking.objects.values_list('id', flat=True)), [fresh])
+
+    def test_sweeper_only_releases_holds_it_expired(self):
+        event = make_event(seats=10)
+        first, second = self.book(event, tickets=2).data['id'], self.book(event, tickets=3).data['id']
+        Booking.objects.update(hold_expires_at=timezone.now() - datetime.timedelta(minutes=1))
+        expire = holds._expire
+
+        def raced(ids, now):
+            # Another sweeper expires the first booking between our SELECT and UPDATE
+            Booking.objects.filter(id=first).update(payment_status='expired', hold_expires_at=None)
+            return expire(ids, now)
+
+        with mock.patch('events.holds._expire', side_effect=raced):
+            self.assertEqual(holds.expire_stale_holds(), (1, 3))
+        event.refresh_from_db()
+        self.assertEqual(event.available_seats, 8)
+        self.assertEqual(Booking.objects.get(id=second).payment_status, 'expired')
+        self.assertEqual(holds._expire([first, second], timezone.now()), [])
+
+    def test_sweeper_goes_on_past_a_batch_taken_by_someone_else(self):
+        event = make_event(seats=10)
+        first, second = self.book(event, tickets=2).data['id'], self.book(event, tickets=3).data['id']
+        Booking.objects.filter(id=first).update(hold_expires_at=timezone.now() - datetime.timedelta(minutes=2))
+        Booking.objects.filter(id=second).update(hold_expires_at=timezone.now() - datetime.timedelta(minutes=1))
+        expire = holds._expire
+
+        def raced(ids, now):
+            # Another sweeper gets to the whole first batch between our SELECT and UPDATE
+            if ids == [first]:
+                Booking.objects.filter(id=first).update(payment_status='expired', hold_expires_at=None)
+            return expire(ids, now)
+
+        with mock.patch('events.holds._expire', side_effect=raced):
+            self.assertEqual(holds.expire_stale_holds(batch_size=1), (1, 3))
+        self.assertEqual(Booking.objects.get(id=second).payment_status, 'expired')
+
+    def test_paying_after_expiry_takes_seats_again(self):
+        event = make_event(seats=2)
+        booking_id = self.book(event, tickets=2).data['id']
+        Booking.objects.filter(id=booking_id).update(hold_expires_at=timezone.now())
+        holds.expire_stale_holds()
+
+        response = APIClient().post(f'/api/bookings/{booking_id}/complete-payment/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['payment_status'], 'completed')
+        event.refresh_from_db()
+        self.assertEqual(event.available_seats, 0)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        idempotency._recent.clear()
+        self.event = make_event(seats=5)
+        self.client = APIClient()
+
+    def book(self, key, tickets=1):
+        return self.client.post(f'/api/events/{self.event.id}/book/', {
+            'customer_name': 'Test User', 'roll_number': 'R001', 'section': 'A',
+            'phone': '9999999999', 'number_of_tickets': tickets,
+        }, format='json', headers={'Idempotency-Key': key})
+
+    def test_retried_booking_and_payment_replay_the_first_response(self):
+        first = self.book('book-1', tickets=2)
+        self.assertEqual(first.status_code, 201)
+        retry = self.book('book-1', tickets=2)
+        self.assertEqual((retry.status_code, retry['Idempotent-Replayed']), (201, 'true'))
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(Booking.objects.count(), 1)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.available_seats, 3)
+
+        url = f"/api/bookings/{first.data['id']}/complete-payment/"
+        paid = self.client.post(url, headers={'Idempotency-Key': 'pay-1'})
+        self.assertEqual(len(paid.data['tickets']), 2)
+        # Straight from the in-memory cache, no query at all
+        with self.assertNumQueries(0):
+            retry = self.client.post(url, headers={'Idempotency-Key': 'pay-1'})
+        self.assertEqual(json.loads(retry.content), json.loads(paid.content))
+        self.assertEqual(Ticket.objects.count(), 2)
+
+        # Another worker's cache is empty, it replays the stored response
+        idempotency._recent.clear()
+        retry = self.client.post(url, headers={'Idempotency-Key': 'pay-1'})
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(retry.content), json.loads(paid.content))
+
+    def test_key_reused_for_another_request(self):
+        self.book('key-1', tickets=1)
+        response = self.book('key-1', tickets=2)
+        self.assertEqual(response.status_code, 422)
+        idempotency._recent.clear()
+        self.assertEqual(self.book('key-1', tickets=2).status_code, 422)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_running_failed_and_abandoned_keys(self):
+        fp = idempotency.fingerprint(f'create_booking:{self.event.id}', {})
+        IdempotencyKey.objects.create(key='running', fingerprint=fp)
+        response = self.client.post(f'/api/events/{self.event.id}/book/', {}, format='json',
+                                    headers={'Idempotency-Key': 'running'})
+        self.assertEqual((response.status_code, response['Retry-After']), (409, '1'))
+
+        # Left behind by a crashed worker: the retry takes it over
+        IdempotencyKey.objects.filter(key='running').update(
+            created_at=timezone.now() - datetime.timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS + 1)
+        )
+        response = self.client.post(f'/api/events/{self.event.id}/book/', {}, format='json',
+                                    headers={'Idempotency-Key': 'running'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(IdempotencyKey.objects.get(key='running').status_code, 400)
+
+        # An action that blows up releases its key so the retry runs for real
+        with mock.patch.object(bookings, 'create_booking', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.book('boom')
+        self.assertFalse(IdempotencyKey.objects.filter(key='boom').exists())
+        self.assertEqual(self.book('boom').status_code, 201)
+
+    def test_sweeper_purges_old_keys(self):
+        self.book('old')
+        self.book('new')
+        IdempotencyKey.objects.filter(key='old').update(created_at=timezone.now() - datetime.timedelta(days=2))
+        call_command('expire_holds', stdout=io.StringIO())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+
+
+@override_settings(THROTTLE_RATES={
+    'listing': '3/min', 'booking': '3/min', 'booking_roll_number': '2/min', 'waiting_room': '',
+})
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        throttling.reset()
+        cache.clear()
+        self.event = make_event(seats=20)
+
+    def book(self, roll_number, ip='10.0.0.1'):
+        return APIClient(REMOTE_ADDR=ip).post(f'/api/events/{self.event.id}/book/', {
+            'customer_name': 'Test User', 'roll_number': roll_number, 'section': 'A', 'phone': '9999999999',
+        })
+
+    def test_token_bucket(self):
+        state, wait = None, 0
+        for _ in range(3):
+            state, wait = throttling._take(state, 3, 1, now=100)
+            self.assertEqual(wait, 0)
+        state, wait = throttling._take(state, 3, 1, now=100)
+        self.assertEqual(wait, 1)
+        # Refills at the rate, never above the burst size
+        self.assertEqual(throttling._take(state, 3, 1, now=101)[1], 0)
+        self.assertEqual(throttling._take(state, 3, 1, now=1000)[0][0], 2)
+        self.assertEqual(throttling.parse_rate('20/min'), (20, 20 / 60))
+        self.assertIsNone(throttling.parse_rate(''))
+        for rate in ('20', 'x/min', '20/fortnight', '0/min'):
+            with self.assertRaises(ImproperlyConfigured):
+                throttling.parse_rate(rate)
+        with override_settings(THROTTLE_RATES={'booking': '5/min', 'listing': 'lots'}):
+            with self.assertRaisesMessage(ImproperlyConfigured, "THROTTLE_RATES['listing']"):
+                throttling.check_rates()
+
+    def test_bookings_are_limited_per_ip_and_roll_number(self):
+        self.assertEqual(self.book('R1').status_code, 201)
+        self.assertEqual(self.book('R1').status_code, 201)
+        # Same person from another network
+        response = self.book('r1 ', ip='10.0.0.2')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+        self.assertEqual(self.book('R2').status_code, 201)
+        self.assertEqual(self.book('R3').status_code, 429)
+        self.assertEqual(Booking.objects.count(), 3)
+
+    def test_listing_is_limited_per_ip_and_creating_events_is_not(self):
+        client = APIClient(REMOTE_ADDR='10.0.0.3')
+        for _ in range(3):
+            self.assertEqual(client.get('/api/events/').status_code, 200)
+        self.assertEqual(client.get('/api/events/').status_code, 429)
+        self.assertEqual(client.get('/api/events/search/?q=test').status_code, 429)
+        self.assertEqual(APIClient(REMOTE_ADDR='10.0.0.4').get('/api/events/').status_code, 200)
+
+    @override_settings(THROTTLE_STORE='cache')
+    def test_cache_store_is_shared(self):
+        self.assertEqual(self.book('R1').status_code, 201)
+        self.assertIsNotNone(cache.get('throttle:booking:roll:R1'))
+        throttling.reset()  # only clears the in-process store
+        self.assertEqual(self.book('R1').status_code, 201)
+        self.assertEqual(self.book('R1').status_code, 429)
+
+    async def test_async_views_share_the_limits(self):
+        client = AsyncClient()
+        for _ in range(3):
+            self.assertEqual((await client.get('/api/events/')).status_code, 200)
+        response = await client.get('/api/events/')
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(response.json()['detail'].startswith('Request was throttled.'))
+        self.assertIn('Retry-After', response)
+
+
+class WaitingRoomTests(TestCase):
+    def setUp(self):
+        # One customer every 10 seconds
+        cache.clear()
+        self.event = make_event(seats=10, admission_rate=6)
+        self.client = APIClient()
+
+    def join(self):
+        return self.client.post(f'/api/events/{self.event.id}/waiting-room/')
+
+    def book(self, admission_pass=None):
+        headers = {'Admission-Pass': admission_pass} if admission_pass else {}
+        return self.client.post(f'/api/events/{self.event.id}/book/', {
+            'customer_name': 'Test User', 'roll_number': 'R001', 'section': 'A', 'phone': '9999999999',
+        }, headers=headers)
+
+    def test_customers_are_admitted_at_the_rate(self):
+        self.assertEqual(self.book().status_code, 403)
+
+        first, second = self.join().data, self.join().data
+        self.assertEqual(first['wait_seconds'], 0)
+        self.assertEqual(second['admitted_at'] - first['admitted_at'], datetime.timedelta(seconds=10))
+        self.assertEqual(self.book(first['admission_pass']).status_code, 201)
+
+        response = self.book(second['admission_pass'])
+        self.assertEqual((response.status_code, response.data['error']), (429, 'Not your turn yet'))
+        with mock.patch('django.utils.timezone.now', return_value=second['admitted_at']):
+            self.assertEqual(self.book(second['admission_pass']).status_code, 201)
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.available_seats, 8)
+
+    def test_retry_with_the_same_key_after_waiting(self):
+        self.join()
+        second = self.join().data
+        headers = {'Admission-Pass': second['admission_pass'], 'Idempotency-Key': 'book-1'}
+        url = f'/api/events/{self.event.id}/book/'
+        body = {'customer_name': 'Test User', 'roll_number': 'R001', 'section': 'A', 'phone': '9999999999'}
+        self.assertEqual(self.client.post(url, body, headers=headers).status_code, 429)
+        self.assertFalse(IdempotencyKey.objects.filter(key='book-1').exists())
+        with mock.patch('django.utils.timezone.now', return_value=second['admitted_at']):
+            self.assertEqual(self.client.post(url, body, headers=headers).status_code, 201)
+
+    def test_bad_and_expired_passes(self):
+        other = make_event(admission_rate=6)
+        other_pass = self.client.post(f'/api/events/{other.id}/waiting-room/').data['admission_pass']
+        self.assertEqual(self.book(other_pass).status_code, 403)
+        self.assertEqual(self.book('forged').status_code, 403)
+
+        admission_pass = self.join().data['admission_pass']
+        later = timezone.now() + datetime.timedelta(minutes=11)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            response = self.book(admission_pass)
+        self.assertEqual(response.data['error'], 'Admission pass expired, join the waiting room again')
+
+    def test_a_pass_lets_one_booking_in(self):
+        admission_pass = self.join().data['admission_pass']
+        # A booking that doesn't go through leaves the pass usable
+        with mock.patch('events.bookings.inventory.take_seats', side_effect=inventory.NotEnoughSeats):
+            self.assertEqual(self.book(admission_pass).status_code, 400)
+        self.assertEqual(self.book(admission_pass).status_code, 201)
+
+        response = self.book(admission_pass)
+        self.assertEqual((response.status_code, response.data), (403, waiting_room.USED_PASS))
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.available_seats, 9)
+
+    def test_idle_queue_does_not_bank_slots(self):
+        WaitingRoom.objects.create(event=self.event, next_slot_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(self.join().data['wait_seconds'], 0)
+        self.assertEqual(self.join().data['wait_seconds'], 10)
+
+    def test_events_without_a_waiting_room(self):
+        event = make_event(seats=1)
+        response = self.client.post(f'/api/events/{event.id}/waiting-room/')
+        self.assertEqual(response.data, {'admission_pass': None, 'wait_seconds': 0})
+        self.assertEqual(self.client.post(f'/api/events/{event.id}/book/', {
+            'customer_name': 'A', 'roll_number': '1', 'section': 'A', 'phone': '1',
+        }).status_code, 201)
+
+        # Sold out: no slot handed out
+        inventory.take_seats(self.event, 10)
+        self.assertEqual(self.join().status_code, 400)
+        self.assertFalse(WaitingRoom.objects.exists())
+
+
+class WaitlistTests(TestCase):
+    def setUp(self):
+        self.event = make_event(seats=2)
+        self.client = APIClient()
+
+    def join(self, roll_number, tickets=1, **kwargs):
+        return self.client.post(f'/api/events/{self.event.id}/waitlist/', {
+            'customer_name': f'Fan {roll_number}', 'roll_number': roll_number, 'section': 'A', 'phone': '1',
+            'number_of_tickets': tickets, **kwargs,
+        })
+
+    def sell_out(self):
+        # A checkout holding both seats, its hold already run out
+        inventory.take_seats(self.event, 2)
+        stats.record(self.event, pending_bookings=1, pending_seats=2)
+        return make_booking(self.event, 2, hold_expires_at=timezone.now() - datetime.timedelta(minutes=1))
+
+    def test_join_only_when_sold_out(self):
+        self.assertEqual(self.join('R1').status_code, 400)
+        self.sell_out()
+        first = self.join('R1')
+        self.assertEqual((first.status_code, first.data['position']), (201, 1))
+        self.assertEqual(self.join('R2').data['position'], 2)
+        # Joining again keeps your place
+        again = self.join('R1')
+        self.assertEqual((again.status_code, again.data['id']), (200, first.data['id']))
+        self.assertEqual(WaitlistEntry.objects.count(), 2)
+
+    def test_expired_holds_go_to_the_queue_in_order(self):
+        self.sell_out()
+        first = self.join('R1', 2, email='fan@example.com').data
+        second = self.join('R2', 1).data
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(holds.expire_stale_holds(), (1, 2))
+
+        entry = WaitlistEntry.objects.get(id=first['id'])
+        self.assertEqual(entry.status, 'promoted')
+        self.assertEqual((entry.booking.payment_status, entry.booking.number_of_tickets), ('pending', 2))
+        self.assertIsNotNone(entry.booking.hold_expires_at)
+        self.assertEqual(OutboxEmail.objects.get().recipients, 'fan@example.com')
+        self.assertEqual(stats.for_event(self.event)['pending_seats'], 2)
+
+        data = self.client.get(f'/api/waitlist/{second["id"]}/').data
+        self.assertEqual((data['status'], data['position']), ('waiting', 1))
+        data = self.client.get(f'/api/waitlist/{first["id"]}/').data
+        self.assertEqual(data['booking'], entry.booking.id)
+        response = self.client.post(f'/api/bookings/{entry.booking.id}/complete-payment/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['tickets']), 2)
+
+    def test_nobody_skips_ahead(self):
+        self.sell_out()
+        self.join('R1', 3)
+        self.join('R2', 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            holds.expire_stale_holds()
+        self.assertFalse(WaitlistEntry.objects.filter(status='promoted').exists())
+
+        # More seats from the admin: the head of the queue gets them
+        with self.captureOnCommitCallbacks(execute=True):
+            self.event.total_seats = self.event.available_seats = 4
+            self.event.save()
+        self.assertEqual(list(WaitlistEntry.objects.order_by('id').values_list('status', flat=True)),
+                         ['promoted', 'promoted'])
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.available_seats, 0)
+
+    def test_direct_bookings_wait_for_the_queue(self):
+        self.sell_out()
+        self.join('R1', 1)
+        # A seat came back but promote hasn't run yet
+        inventory.release_seats(self.event, 1)
+        response = self.client.post(f'/api/events/{self.event.id}/book/', {
+            'customer_name': 'Late', 'roll_number': 'R9', 'section': 'A', 'phone': '1',
+        })
+        self.assertEqual((response.status_code, response.data), (400, bookings.WAITLIST_FIRST))
+
+    def test_only_seat_changes_promote(self):
+        self.sell_out()
+        self.join('R1', 1)
+        self.event.refresh_from_db()
+        with mock.patch('events.waitlist.promote_on_commit') as promote:
+            self.event.title = 'Renamed'
+            self.event.save()
+            promote.assert_not_called()
+            self.event.total_seats = self.event.available_seats = 3
+            self.event.save()
+            promote.assert_called_once_with(self.event.id)
+
+
+class BookingArchiveTests(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        storages = {**settings.STORAGES, 'archive': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': root},
+        }}
+        override = override_settings(STORAGES=storages)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.staff = User.objects.create_user('door', password='x', is_staff=True)
+        self.event = make_event(event_date=datetime.date.today() - datetime.timedelta(days=200))
+        self.paid = make_booking(self.event, tickets=2, payment_status='completed', payment_id='pay_1')
+        self.codes = [t.otp_code for t in tickets.mint_tickets(self.paid)]
+        Ticket.objects.filter(otp_code=self.codes[0]).update(
+            is_verified=True, verified_at=timezone.now(), verified_by=self.staff,
+        )
+        self.created_at = timezone.now() - datetime.timedelta(days=230)
+        Booking.objects.filter(id=self.paid.id).update(created_at=self.created_at)
+        self.pending = make_booking(self.event, tickets=1, roll_number='R002')
+        for _ in range(3):
+            make_booking(self.event, roll_number='R003', payment_status='failed')
+        stats.reconcile([self.event.id])
+        self.stats = stats.for_event(self.event)
+
+    def test_only_past_events_with_bookings(self):
+        make_booking(make_event())  # upcoming
+        make_event(event_date=datetime.date.today() - datetime.timedelta(days=300))  # no bookings
+        self.assertEqual(list(archive.archivable(180)), [self.event])
+        self.assertEqual(list(archive.archivable(365)), [])
+
+    def test_archive_moves_bookings_to_a_compressed_file(self):
+        last_id = Booking.objects.latest('id').id
+        result = archive.archive_event(self.event, batch_size=2)
+
+        self.assertFalse(Booking.objects.filter(event=self.event).exists())
+        self.assertFalse(Ticket.objects.exists())
+        self.assertEqual((result.bookings, result.tickets, result.last_booking_id), (5, 2, last_id))
+        with archive.storage().open(result.file, 'rb') as f:
+            lines = [json.loads(line) for line in gzip.decompress(f.read()).splitlines()]
+        self.assertEqual(lines[0]['event'], self.event.id)
+        self.assertEqual([row['id'] for row in lines[1:]], sorted(row['id'] for row in lines[1:]))
+        self.assertEqual(len(lines[1]['tickets']), 2)
+
+        # Nothing left to archive, and the stats still count the archived bookings
+        self.assertIsNone(archive.archive_event(self.event))
+        self.assertEqual(list(archive.archivable(180)), [])
+        self.assertEqual(stats.reconcile([self.event.id]), {})
+        self.assertEqual(stats.actual([self.event.id])[self.event.id], {
+            field: self.stats[field] for field in stats.FIELDS
+        })
+
+    def test_later_bookings_go_to_a_second_archive(self):
+        archive.archive_event(self.event)
+        make_booking(self.event, roll_number='R004', payment_status='completed')
+        stats.record(self.event, paid_bookings=1, tickets_sold=1, revenue=100)
+        archive.archive_event(self.event)
+
+        self.assertEqual(BookingArchive.objects.filter(event=self.event).count(), 2)
+        self.assertEqual(stats.reconcile([self.event.id]), {})
+        self.assertEqual(archive.restore_event(self.event.id), (6, 2))
+
+    def test_interrupted_archive_is_finished_by_the_next_run(self):
+        with mock.patch('events.archive._delete_archived', side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                archive.archive_event(self.event)
+        self.assertEqual(Booking.objects.filter(event=self.event).count(), 5)
+        # Counted once, in the archive, while the rows are still there
+        self.assertEqual(stats.reconcile([self.event.id], fix=False), {})
+        self.assertEqual(list(archive.archivable(180)), [self.event])
+
+        self.assertIsNone(archive.archive_event(self.event))
+        self.assertFalse(Booking.objects.filter(event=self.event).exists())
+        self.assertEqual(BookingArchive.objects.count(), 1)
+        self.assertEqual(stats.reconcile([self.event.id]), {})
+
+    def test_restore_puts_rows_back_as_they_were(self):
+        result = archive.archive_event(self.event)
+        self.staff.delete()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(archive.restore_event(self.event.id, batch_size=2), (5, 2))
+
+        paid = Booking.objects.get(id=self.paid.id)
+        self.assertEqual(paid.created_at, self.created_at)
+        self.assertEqual((paid.payment_status, paid.payment_id, paid.total_amount), ('completed', 'pay_1', 200))
+        self.assertEqual([t.otp_code for t in paid.tickets.order_by('ticket_number')], self.codes)
+        verified = paid.tickets.get(otp_code=self.codes[0])
+        self.assertTrue(verified.is_verified)
+        self.assertIsNone(verified.verified_by_id)  # The scanner account is gone
+        self.assertTrue(Booking.objects.filter(id=self.pending.id, payment_status='pending').exists())
+
+        self.assertFalse(BookingArchive.objects.exists())
+        self.assertFalse(archive.storage().exists(result.file))
+        self.assertEqual(stats.reconcile([self.event.id]), {})
+
+    def test_file_goes_with_the_event(self):
+        result = archive.archive_event(self.event)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.event.delete()
+        self.assertFalse(BookingArchive.objects.exists())
+        self.assertFalse(archive.storage().exists(result.file))
+
+    def test_commands(self):
+        out = io.StringIO()
+        call_command('archive_bookings', older_than_days=180, dry_run=True, stdout=out)
+        self.assertIn('1 events to archive', out.getvalue())
+        self.assertEqual(Booking.objects.count(), 5)
+
+        call_command('archive_bookings', older_than_days=180, stdout=out)
+        self.assertIn('Archived 5 bookings and 2 tickets of 1 events', out.getvalue())
+
+        with self.assertRaisesMessage(CommandError, str(self.event.id + 1)):
+            call_command('restore_bookings', self.event.id, self.event.id + 1, stdout=out)
+        call_command('restore_bookings', self.event.id, stdout=out)
+        self.assertIn('restored 5 bookings and 2 tickets', out.getvalue())
+        self.assertEqual(Booking.objects.count(), 5)
+
+
+class TicketMintingTests(TestCase):
+    def setUp(self):
+        otp.discard_block()
+
+    def test_otp_permutation_covers_keyspace_once(self):
+        codes = {otp.permute(position) for position in range(otp.KEYSPACE)}
+        self.assertEqual(len(codes), otp.KEYSPACE)
+
+    def test_mint_tickets_in_one_insert(self):
+        booking = make_booking(make_event(), tickets=4)
+        otp.allocate(1)  # warm up the cached block of OTP positions
+        with self.assertNumQueries(3):
+            # savepoint + one INSERT + release
+            minted = tickets.mint_tickets(booking)
+        self.assertEqual([t.ticket_number for t in minted], [1, 2, 3, 4])
+        self.assertEqual(len({t.otp_code for t in minted}), 4)
+        self.assertTrue(all(len(t.otp_code) == 6 for t in minted))
+
+    def test_mint_tickets_skips_a_clashing_block(self):
+        taken = otp.allocate(2)[1]
+        otp.discard_block()
+        # Pretend the block we're about to reuse was handed out elsewhere
+        make_booking(make_event(), tickets=1).tickets.create(ticket_number=1, otp_code=taken)
+        OtpCounter.objects.update(next_position=0)
+
+        minted = tickets.mint_tickets(make_booking(make_event(), tickets=2))
+        self.assertNotIn(taken, [t.otp_code for t in minted])
+        self.assertEqual(Ticket.objects.filter(otp_code=taken).count(), 1)
+
+
+class FlakyBackend(LocmemBackend):
+    # Local stand-in for a mail server that refuses some recipients
+    def send_messages(self, messages):
+        if any('bounce' in address for message in messages for address in message.to):
+            raise ConnectionError('recipient refused')
+        return super().send_messages(messages)
+
+
+class OutboxTests(TestCase):
+    def test_payment_queues_email_instead_of_sending(self):
+        event = make_event(seats=2)
+        booking = make_booking(event, email='guest@example.com')
+        response = APIClient().post(f'/api/bookings/{booking.id}/complete-payment/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxEmail.objects.get().recipients, 'guest@example.com')
+
+        call_command('send_outbox', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['guest@example.com'])
+        self.assertEqual(OutboxEmail.objects.get().status, 'sent')
+
+    def test_failed_email_is_retried_with_backoff(self):
+        outbox.queue_email('Hi', 'Body', ['ok@example.com'])
+        outbox.queue_email('Hi', 'Body', ['bounce@example.com'])
+
+        self.assertEqual(outbox.send_pending(connection=FlakyBackend()), (1, 1))
+        failed = OutboxEmail.objects.get(recipients='bounce@example.com')
+        self.assertEqual((failed.status, failed.attempts), ('pending', 1))
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+        # Not due again until the backoff passes
+        self.assertEqual(outbox.send_pending(connection=FlakyBackend()), (0, 0))
+
+        OutboxEmail.objects.filter(id=failed.id).update(attempts=outbox.MAX_ATTEMPTS - 1, next_attempt_at=timezone.now())
+        self.assertEqual(outbox.send_pending(connection=FlakyBackend()), (0, 1))
+        self.assertEqual(OutboxEmail.objects.get(id=failed.id).status, 'failed')
+
+
+# A replica's connection can't see this test's uncommitted rows, ReplicaRoutingTests covers routing
+@override_settings(DATABASE_REPLICAS=[])
+class EventListingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_listing_is_cached_with_etag(self):
+        make_event(title='First')
+        response = self.client.get('/api/events/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([e['title'] for e in response.json()], ['First'])
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/events/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/api/events/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_event_changes_invalidate_the_cache(self):
+        event = make_event(title='First', seats=5)
+        etag = self.client.get('/api/events/')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            event.title = 'Renamed'
+            event.save()
+        response = self.client.get('/api/events/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['title'], 'Renamed')
+
+        # Bookings don't invalidate (they'd empty the cache during a rush), the cached page shows
+        # the new seat count once it expires
+        version = listing.current_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.take_seats(event, 2)
+        self.assertEqual(listing.current_version(), version)
+        self.assertEqual(self.client.get('/api/events/').json()[0]['available_seats'], 5)
+        cached = self.client.get('/api/events/')
+        cache.clear()  # The entry ran out
+        with mock.patch('events.listing.time.time', return_value=time.time() + 5):
+            response = self.client.get('/api/events/', HTTP_IF_MODIFIED_SINCE=cached['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['available_seats'], 3)
+
+    def test_compact_cursor_pages(self):
+        for i in range(3):
+            make_event(title=f'Event {i}', event_date=datetime.date(2030, 1, 1 + i))
+
+        page = self.client.get('/api/events/', {'view': 'compact', 'page_size': 2}).json()
+        self.assertEqual([e['title'] for e in page['results']], ['Event 0', 'Event 1'])
+        self.assertNotIn('description', page['results'][0])
+
+        page = self.client.get(page['next']).json()
+        self.assertEqual([e['title'] for e in page['results']], ['Event 2'])
+        self.assertIsNone(page['next'])
+
+
+def make_poster(width=2000, height=1000, mode='RGB', name='poster.png'):
+    buffer = io.BytesIO()
+    Image.new(mode, (width, height), 'red').save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        today = datetime.date.today()
+        self.jazz = make_event(title='Jazz Night', event_type='movie', ticket_price=0,
+                               event_date=today + datetime.timedelta(days=2))
+        self.workshop = make_event(title='Python Workshop', event_type='workshop', ticket_price=250,
+                                   description='Bring a laptop, we end with a jazz jam',
+                                   event_date=today + datetime.timedelta(days=20))
+        self.seminar = make_event(title='AI Seminar', event_type='seminar', ticket_price=50, organizer='Jazz Club',
+                                  available_seats=0, event_date=today + datetime.timedelta(days=60))
+        make_event(title='Jazz archive', is_active=False)
+
+    def get(self, query):
+        response = self.client.get(f'/api/events/search/?{query}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def facet(self, data, name):
+        return {bucket['value']: bucket['count'] for bucket in data['facets'][name]}
+
+    def test_ranked_by_field(self):
+        data = self.get('q=jazz')
+        # Title hit, then organizer, then description; inactive events never show up
+        self.assertEqual([e['id'] for e in data['results']], [self.jazz.id, self.seminar.id, self.workshop.id])
+        self.assertEqual(data['count'], 3)
+        self.assertNotIn('description', data['results'][0])
+
+    def test_every_word_must_match_and_prefixes_count(self):
+        self.assertEqual([e['id'] for e in self.get('q=jazz lap')['results']], [self.workshop.id])
+        self.assertEqual(self.get('q=opera')['results'], [])
+
+    def test_facets_count_the_other_filters_only(self):
+        data = self.get('q=jazz&event_type=workshop')
+        self.assertEqual([e['id'] for e in data['results']], [self.workshop.id])
+        self.assertEqual(self.facet(data, 'event_type')['movie'], 1)  # still offered
+        self.assertEqual(self.facet(data, 'price'), {'free': 0, 'under_100': 0, '100_500': 1, 'over_500': 0})
+        self.assertEqual(self.facet(data, 'availability'), {'available': 1, 'sold_out': 0})
+        selected = [b['value'] for b in data['facets']['event_type'] if b['selected']]
+        self.assertEqual(selected, ['workshop'])
+
+    def test_filters(self):
+        ids = lambda query: [e['id'] for e in self.get(query)['results']]  # noqa: E731
+        self.assertEqual(ids('price=free,under_100'), [self.jazz.id, self.seminar.id])
+        self.assertEqual(ids('availability=sold_out'), [self.seminar.id])
+        self.assertEqual(ids('date=this_week'), [self.jazz.id])
+        self.assertEqual(ids(f'date_from={self.workshop.event_date}'), [self.workshop.id, self.seminar.id])
+        self.assertEqual(self.client.get('/api/events/search/?date_to=soon').status_code, 400)
+
+    def test_pages_and_queries(self):
+        self.get('q=jazz')  # builds the in-memory index
+        # Facets and total in one aggregate, then the page itself
+        with self.assertNumQueries(2):
+            data = self.get('q=jazz&page_size=2')
+        self.assertEqual(len(data['results']), 2)
+        self.assertEqual(data['count'], 3)
+        self.assertIn('page=2', data['next'])
+
+    def test_index_follows_event_changes(self):
+        self.assertEqual(self.get('q=gala')['count'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_event(title='Winter Gala')
+        self.assertEqual(self.get('q=gala')['count'], 1)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class PosterVariantTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        override = override_settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def make_event_with_poster(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            event = make_event(poster=make_poster(**kwargs))
+        event.refresh_from_db()
+        return event
+
+    def test_variants_are_built_after_upload(self):
+        event = self.make_event_with_poster()
+        variants = event.poster_variants
+        self.assertEqual(variants['source'], event.poster.name)
+        self.assertEqual(set(variants['sizes']), set(posters.SIZES))
+        card = variants['sizes']['card']
+        self.assertEqual((card['width'], card['height']), (480, 240))
+        self.assertRegex(card['webp'], rf'^posters/variants/{event.id}/poster[^/]*-480w\.[0-9a-f]{{16}}\.webp$')
+        with default_storage.open(card['jpeg']) as f:
+            self.assertEqual(Image.open(f).format, 'JPEG')
+
+    def test_small_posters_are_not_upscaled(self):
+        event = self.make_event_with_poster(width=300, height=300, mode='RGBA')
+        sizes = event.poster_variants['sizes']
+        self.assertEqual((sizes['thumb']['width'], sizes['large']['width']), (160, 300))
+        # Same pixels, same file
+        self.assertEqual(sizes['card']['webp'], sizes['large']['webp'])
+
+    def test_listing_exposes_variant_urls(self):
+        self.make_event_with_poster()
+        data = self.client.get('/api/events/').json()[0]
+        urls = data['poster_variants']
+        self.assertEqual(set(urls), set(posters.SIZES))
+        self.assertEqual(urls['thumb']['width'], 160)
+        self.assertTrue(urls['thumb']['webp'].startswith('http://testserver/media/posters/variants/'))
+        compact = self.client.get('/api/events/?view=compact').json()[0]
+        self.assertEqual(compact['poster_variants'], urls)
+
+    def test_replacing_the_poster_rebuilds_and_deletes_old_variants(self):
+        event = self.make_event_with_poster()
+        old_files = list(posters.variant_files(event.poster_variants))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            event.poster = make_poster(width=800, height=800)
+            event.save()
+        event.refresh_from_db()
+
+        self.assertEqual(event.poster_variants['source'], event.poster.name)
+        self.assertEqual(event.poster_variants['sizes']['large']['width'], 800)
+        self.assertFalse(any(default_storage.exists(name) for name in old_files))
+
+    def test_events_with_the_same_poster_keep_their_variants(self):
+        first, second = self.make_event_with_poster(), self.make_event_with_poster()
+        shared = list(posters.variant_files(second.poster_variants))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.poster = make_poster(width=800, height=800)
+            first.save()
+        self.assertTrue(all(default_storage.exists(name) for name in shared))
+
+        legacy = default_storage.save(f'{posters.VARIANT_DIR}/old-160w.0123456789abcdef.webp', io.BytesIO(b'webp'))
+        posters.delete_files(first, [legacy])
+        self.assertTrue(default_storage.exists(legacy))
+
+    def test_stale_variants_are_hidden_and_rebuilt_by_the_command(self):
+        event = make_event(poster=make_poster())  # on_commit never ran, as if the worker died
+        event.refresh_from_db()
+        self.assertEqual(event.poster_variants, {})
+        self.assertIsNone(self.client.get('/api/events/').json()[0]['poster_variants'])
+
+        call_command('build_poster_variants', stdout=io.StringIO())
+        event.refresh_from_db()
+        self.assertTrue(posters.is_current(event))
+
+
+class MediaTests(TestCase):
+    CONTENT = bytes(range(256)) * 4
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        override = override_settings(MEDIA_ROOT=root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.name = default_storage.save('posters/gig.png', io.BytesIO(self.CONTENT))
+        self.url = '/media/' + self.name
+
+    def test_whole_file_with_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], media.ORIGINAL)
+        self.assertFalse(response['ETag'].startswith('W/'))
+
+        again = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again['ETag'], response['ETag'])
+
+    def test_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[10:20])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[-4:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=1000-')
+        self.assertEqual(response['Content-Range'], 'bytes 1000-1023/1024')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=5000-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */1024'))
+        # Several ranges, or an If-Range for an older version: the whole file
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1,5-6').status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"old"').status_code, 200)
+
+    def test_variants_are_immutable(self):
+        name = default_storage.save(f'{posters.VARIANT_DIR}/gig-160w.0123456789abcdef.webp', io.BytesIO(b'webp'))
+        response = self.client.get('/media/' + name)
+        self.assertEqual(response['Cache-Control'], media.IMMUTABLE)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+
+    def test_missing_and_outside_files(self):
+        self.assertEqual(self.client.get('/media/posters/nope.png').status_code, 404)
+        with self.assertRaises(Http404):
+            media.serve(RequestFactory().get('/'), '../settings.py')
+
+    def test_handed_to_the_proxy(self):
+        with override_settings(MEDIA_DELIVERY='x-accel'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.name)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Cache-Control'], media.ORIGINAL)
+        with override_settings(MEDIA_DELIVERY='x-sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], default_storage.path(self.name))
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class EventBookingsTests(TestCase):
+    def setUp(self):
+        self.event = make_event(seats=100)
+        for i in range(6):
+            booking = make_booking(self.event, tickets=2, customer_name=f'Guest {i}', payment_status='completed')
+            tickets.mint_tickets(booking)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+
+    def test_no_query_per_booking(self):
+        # event + tickets are joined / prefetched, not fetched per row
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/events/{self.event.id}/bookings/')
+        self.assertEqual(len(response.data), 6)
+        self.assertEqual(response.data[0]['event_title'], 'Test Event')
+        self.assertEqual(len(response.data[0]['tickets']), 2)
+
+    def test_keyset_pages(self):
+        page = self.client.get(f'/api/events/{self.event.id}/bookings/', {'page_size': 4}).data
+        self.assertEqual(len(page['results']), 4)
+        page = self.client.get(page['next']).data
+        self.assertEqual([b['customer_name'] for b in page['results']], ['Guest 4', 'Guest 5'])
+
+    def test_streaming_exports(self):
+        response = self.client.get(f'/api/events/{self.event.id}/bookings/', {'export': 'csv'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertTrue(lines[0].startswith('id,customer_name'))
+
+        response = self.client.get(f'/api/events/{self.event.id}/bookings/', {'export': 'json'})
+        rows = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0]['venue'], 'Main Hall')
+
+
+class FastSerializerTests(TestCase):
+    def setUp(self):
+        self.event = make_event(seats=100, ticket_price='12.50', description='Line\u2028break, caf\u00e9')
+        variants = {
+            'thumb': {'width': 160, 'height': 90, 'webp': 'posters/variants/a.webp', 'jpeg': 'posters/variants/a.jpg'},
+        }
+        Event.objects.filter(id=self.event.id).update(
+            poster='posters/a.png', poster_variants={'source': 'posters/a.png', 'sizes': variants}
+        )
+        self.event.refresh_from_db()
+        make_event(title='No poster', event_type='workshop', ticket_price=0)
+        make_event(title='Stale variants', poster='posters/b.png', poster_variants={'source': 'posters/old.png'})
+        for i in range(3):
+            booking = make_booking(self.event, tickets=i + 1, email=None if i else 'a@example.com',
+                                   payment_status='completed')
+            tickets.mint_tickets(booking)
+        make_booking(self.event, tickets=1)  # no tickets yet
+        self.request = RequestFactory().get('/api/events/')
+
+    def assertSameOutput(self, serializer_class, queryset, context=None):
+        expected = JSONRenderer().render(serializer_class(queryset, many=True, context=context or {}).data)
+        fast = fast_serializers.for_class(serializer_class)
+        self.assertEqual(renderers.dumps(fast.serialize(queryset, context)), expected)
+
+    def test_same_output_as_drf(self):
+        events = Event.objects.order_by('event_date', 'id')
+        self.assertSameOutput(EventListSerializer, events, {'request': self.request})
+        self.assertSameOutput(EventListSerializer, events)
+        self.assertSameOutput(EventCompactSerializer, events.only(*listing.COMPACT_FIELDS), {'request': self.request})
+        bookings = Booking.objects.select_related('event').prefetch_related('tickets').order_by('id')
+        self.assertSameOutput(BookingWithTicketsSerializer, bookings)
+
+    def test_renderer_matches_drf(self):
+        data = {'a': [1, 2.5, None, True], 'text': 'caf\u00e9 \u2028', 'when': timezone.now(),
+                'day': datetime.date(2030, 1, 2), 'price': self.event.ticket_price,
+                'event': EventCompactSerializer(self.event).data}
+        self.assertEqual(renderers.FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(renderers.dumps({1: 'int key'}), JSONRenderer().render({1: 'int key'}))
+
+    def test_views_use_it_with_the_same_queries(self):
+        cache.clear()
+        client = APIClient()
+        with self.assertNumQueries(1):
+            fast = client.get('/api/events/').content
+        with override_settings(FAST_SERIALIZERS=False):
+            cache.clear()
+            self.assertEqual(client.get('/api/events/').content, fast)
+
+        client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        url = f'/api/events/{self.event.id}/bookings/'
+        with self.assertNumQueries(2):
+            fast = client.get(url).content
+        export = b''.join(client.get(url, {'export': 'json'}).streaming_content)
+        self.assertEqual(export, fast)
+        with override_settings(FAST_SERIALIZERS=False):
+            self.assertEqual(client.get(url).content, fast)
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command('bench_serializers', rows=30, repeat=1, stdout=out)
+        self.assertIn('bookings + tickets', out.getvalue())
+        self.assertFalse(Event.objects.filter(title__startswith='Serializer benchmark').exists())
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class EventStatsTests(TestCase):
+    def setUp(self):
+        self.event = make_event(seats=20)
+        self.client = APIClient()
+
+    def book(self, tickets):
+        return self.client.post(f'/api/events/{self.event.id}/book/', {
+            'customer_name': 'Guest', 'roll_number': 'R1', 'section': 'A', 'phone': '1',
+            'number_of_tickets': tickets,
+        }).data['id']
+
+    def pay(self, booking_id):
+        return self.client.post(f'/api/bookings/{booking_id}/complete-payment/').data
+
+    def test_funnel_keeps_the_totals(self):
+        paid = self.pay(self.book(3))
+        self.pay(self.book(2))
+        stale = self.book(4)
+        self.book(1)
+        Booking.objects.filter(id=stale).update(hold_expires_at=timezone.now())
+        holds.expire_stale_holds()
+
+        staff = User.objects.create_user('admin', is_staff=True)
+        checkin.verify_codes([t['otp_code'] for t in paid['tickets'][:2]], staff)
+        # Paying the expired booking after all moves nothing out of "pending"
+        self.pay(stale)
+
+        self.client.force_authenticate(staff)
+        with self.assertNumQueries(2):
+            data = self.client.get(f'/api/events/{self.event.id}/stats/').data
+        self.assertEqual(
+            {field: data[field] for field in stats.FIELDS},
+            {'paid_bookings': 3, 'tickets_sold': 9, 'revenue': 900, 'pending_bookings': 1,
+             'pending_seats': 1, 'checked_in': 2},
+        )
+        self.assertEqual(data['check_in_rate'], round(2 / 9, 4))
+        self.assertEqual(stats.reconcile([self.event.id]), {})
+
+        self.client.force_authenticate(User.objects.create_user('someone'))
+        self.assertEqual(self.client.get(f'/api/events/{self.event.id}/stats/').status_code, 403)
+
+    def test_rolled_back_payment_is_not_counted(self):
+        booking_id = self.book(2)
+        with mock.patch('events.bookings.tickets.mint_tickets', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                bookings.complete_payment(booking_id)
+        totals = stats.for_event(self.event)
+        self.assertEqual((totals['paid_bookings'], totals['pending_bookings']), (0, 1))
+
+    def test_sharded_events_spread_their_rows(self):
+        inventory.enable_sharding(self.event, shards=4)
+        self.event.refresh_from_db()
+        for _ in range(8):
+            self.pay(self.book(1))
+        self.assertGreater(EventStats.objects.filter(event=self.event).count(), 1)
+        self.assertEqual(stats.for_event(self.event)['tickets_sold'], 8)
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        self.pay(self.book(2))
+        # Changes made behind the funnel's back (admin edits) aren't tracked
+        Booking.objects.update(payment_status='failed')
+        make_event(title='Untouched')
+        EventStats.objects.filter(event__title='Untouched').delete()
+
+        out = io.StringIO()
+        with self.assertRaisesMessage(CommandError, '1 drifted'):
+            call_command('reconcile_stats', dry_run=True, check=True, stdout=out)
+        self.assertIn('paid_bookings 1 -> 0', out.getvalue())
+        self.assertEqual(stats.for_event(self.event)['tickets_sold'], 2)
+
+        call_command('reconcile_stats', batch_size=1, stdout=out)
+        self.assertEqual(stats.for_event(self.event)['tickets_sold'], 0)
+        self.assertEqual(EventStats.objects.filter(event=self.event).count(), 1)
+        self.assertEqual(stats.reconcile([self.event.id]), {})
+
+
+class BulkImportTests(TestCase):
+    EVENTS_CSV = (
+        'title,organizer,venue,location,description,ticket_price,total_seats,event_date,event_time,event_type\n'
+        'Jazz Night,Music Club,Hall A,Campus,Live jazz,50,100,2030-01-10,19:00,other\n'
+        'No Date,Music Club,Hall A,Campus,Oops,50,100,,19:00,other\n'
+        'Robotics 101,Robotics Club,Lab 2,Campus,Intro,0,30,2030-01-12,10:00,workshop\n'
+    )
+
+    def import_file(self, kind, content, fmt, **kwargs):
+        errors = []
+        report = imports.import_rows(kind, imports.read_rows(io.StringIO(content), fmt),
+                                     on_error=lambda line, e: errors.append((line, e)), **kwargs)
+        return report, errors
+
+    def test_events_from_csv(self):
+        report, errors = self.import_file('events', self.EVENTS_CSV, 'csv', chunk_size=2)
+        self.assertEqual((report.created, report.failed), (2, 1))
+        self.assertEqual([(line, list(e)) for line, e in errors], [(3, ['event_date'])])
+        jazz = Event.objects.get(title='Jazz Night')
+        self.assertEqual(jazz.available_seats, 100)
+        self.assertTrue(EventStats.objects.filter(event=jazz).exists())
+
+    def test_bookings_from_jsonl(self):
+        event = make_event(seats=5)
+        row = {'event': event.id, 'customer_name': 'A', 'roll_number': 'R1', 'section': 'A', 'phone': '1'}
+        lines = [
+            json.dumps({**row, 'number_of_tickets': 2, 'payment_id': 'PAY-1', 'created_at': '2025-01-05T10:00:00Z'}),
+            json.dumps({**row, 'number_of_tickets': 4}),  # doesn't fit anymore
+            json.dumps({**row, 'number_of_tickets': 1, 'payment_status': 'failed'}),
+            json.dumps({**row, 'number_of_tickets': 1, 'payment_status': 'pending'}),
+            json.dumps({**row, 'event': 999999, 'number_of_tickets': 1}),
+            '{not json',
+            '',
+            json.dumps({**row, 'number_of_tickets': 3}),
+        ]
+        report, errors = self.import_file('bookings', '\n'.join(lines), 'jsonl', chunk_size=3)
+        self.assertEqual((report.created, report.failed), (3, 4))
+        self.assertEqual(sorted(line for line, _ in errors), [2, 4, 5, 6])
+
+        paid = Booking.objects.filter(payment_status='completed').order_by('id')
+        self.assertEqual([b.number_of_tickets for b in paid], [2, 3])
+        self.assertEqual(paid[0].created_at.year, 2025)
+        self.assertEqual(paid[0].total_amount, 200)
+        self.assertEqual(Ticket.objects.count(), 5)
+        event.refresh_from_db()
+        self.assertEqual(event.available_seats, 0)
+        self.assertEqual(stats.for_event(event)['tickets_sold'], 5)
+
+    def test_command_and_endpoint(self):
+        path = os.path.join(tempfile.mkdtemp(), 'events.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(self.EVENTS_CSV)
+        out = io.StringIO()
+        call_command('bulk_import', 'events', path, errors=path + '.errors', stdout=out)
+        self.assertIn('Imported 2 events, rejected 1 rows', out.getvalue())
+        with open(path + '.errors') as f:
+            self.assertEqual(f.read().splitlines()[1].split(',')[0], '3')
+
+        client = APIClient()
+        upload = SimpleUploadedFile('events.csv', self.EVENTS_CSV.encode())
+        self.assertEqual(client.post('/api/import/events/', {'file': upload}).status_code, 401)
+        client.force_authenticate(User.objects.create_user('importer', is_staff=True))
+        upload = SimpleUploadedFile('events.csv', self.EVENTS_CSV.encode())
+        response = client.post('/api/import/events/', {'file': upload})
+        self.assertEqual((response.data['created'], response.data['rejected']), (2, 1))
+        self.assertEqual(response.data['errors'][0]['line'], 3)
+        self.assertEqual(Event.objects.filter(title='Jazz Night').count(), 2)
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('root', password='x'))
+        self.event = make_event(seats=50)
+
+    def add_bookings(self, count):
+        for i in range(count):
+            booking = make_booking(self.event, 2, customer_name=f'Customer {i}', roll_number=f'R{i:03}',
+                                   payment_status='completed')
+            tickets.mint_tickets(booking)
+
+    def queries_for(self, url):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(context)
+
+    def test_rows_dont_add_queries(self):
+        self.add_bookings(2)
+        few = (self.queries_for('/admin/events/booking/'), self.queries_for('/admin/events/ticket/'))
+        self.add_bookings(8)
+        self.assertEqual((self.queries_for('/admin/events/booking/'), self.queries_for('/admin/events/ticket/')), few)
+
+    def test_estimated_count_past_the_limit(self):
+        self.add_bookings(3)
+        paginator = changelists.EstimatedCountPaginator(Booking.objects.order_by('id'), 100)
+        with mock.patch.object(changelists, 'planner_estimate', return_value=2_000_000):
+            self.assertEqual(paginator.count, 2_000_000)
+        with mock.patch.object(changelists, 'planner_estimate', return_value=5):
+            paginator = changelists.EstimatedCountPaginator(Booking.objects.order_by('id'), 100)
+            self.assertEqual(paginator.count, 3)
+        if connection.vendor != 'postgresql':
+            self.assertIsNone(changelists.planner_estimate(Booking.objects.all()))
+
+    def test_search(self):
+        self.add_bookings(3)
+        response = self.client.get('/admin/events/booking/', {'q': 'R00'})
+        self.assertEqual(response.context['cl'].result_count, 3)
+        # Roll numbers match from the start only
+        response = self.client.get('/admin/events/booking/', {'q': '001'})
+        self.assertEqual(response.context['cl'].result_count, 0)
+
+        code = Ticket.objects.order_by('id').first().otp_code
+        response = self.client.get('/admin/events/ticket/', {'q': code})
+        self.assertEqual([t.otp_code for t in response.context['cl'].result_list], [code])
+        response = self.client.get('/admin/events/ticket/', {'q': 'Customer 1'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+    def test_export_streams_the_filtered_list(self):
+        self.add_bookings(3)
+        make_booking(self.event, 1, customer_name='Unpaid', payment_status='failed')
+        response = self.client.post('/admin/events/booking/?payment_status__exact=completed', {
+            'action': 'export_csv', 'select_across': '1', 'index': '0',
+            '_selected_action': [Booking.objects.first().id],
+        })
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertNotIn('Unpaid', ''.join(lines))
+
+        response = self.client.post('/admin/events/ticket/', {
+            'action': 'export_csv', 'select_across': '1', 'index': '0',
+            '_selected_action': [Ticket.objects.first().id],
+        })
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(','), exports.TICKET_CSV_COLUMNS)
+        self.assertEqual(len(lines), 7)
+
+
+class CheckinTests(TestCase):
+    def setUp(self):
+        booking = make_booking(make_event(), tickets=3, payment_status='completed')
+        self.codes = [t.otp_code for t in tickets.mint_tickets(booking)]
+        self.volunteer = User.objects.create_user('gate1')
+        Volunteer.objects.create(user=self.volunteer, name='Gate 1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.volunteer)
+
+    def test_batch_reports_each_code(self):
+        Ticket.objects.filter(otp_code=self.codes[2]).update(is_verified=True)
+        response = self.client.post('/api/verify-tickets/batch/', {
+            'otp_codes': [self.codes[0], self.codes[1], self.codes[0], self.codes[2], '000000x'],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in response.data['results']],
+                         ['verified', 'verified', 'already_used', 'already_used', 'invalid'])
+        self.assertEqual(response.data['summary'], {'verified': 2, 'already_used': 2, 'invalid': 1})
+        self.assertEqual(Ticket.objects.get(otp_code=self.codes[0]).verified_by, self.volunteer)
+
+    def test_single_verify_keeps_its_responses(self):
+        response = self.client.post('/api/volunteer/verify-ticket/', {'otp_code': self.codes[0]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['ticket']['ticket_number'], 1)
+
+        response = self.client.post('/api/volunteer/verify-ticket/', {'otp_code': self.codes[0]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['verified_by'], 'gate1')
+
+        response = self.client.post('/api/volunteer/verify-ticket/', {'otp_code': 'nope'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_only_volunteers_and_admins(self):
+        self.client.force_authenticate(User.objects.create_user('someone'))
+        response = self.client.post('/api/verify-tickets/batch/', {'otp_codes': self.codes}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class ScannerAuthTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        otp.discard_block()
+        otp.allocate(1)
+        booking = make_booking(make_event(), tickets=3, payment_status='completed')
+        self.codes = [t.otp_code for t in tickets.mint_tickets(booking)]
+        self.user = User.objects.create_user('gate1', password='secret')
+        self.volunteer = Volunteer.objects.create(user=self.user, name='Gate 1')
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post('/api/volunteer/login/', {'username': 'gate1', 'password': 'secret'})
+        return response.data['access']
+
+    def verify(self, token, code, url='/api/volunteer/verify-ticket/'):
+        return self.client.post(url, {'otp_code': code}, HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_check_in_without_auth_queries(self):
+        token = self.login()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.verify(token, self.codes[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 5)  # same as the query budget of a forced login
+        tables = ' '.join(query['sql'].split(' WHERE ')[0] for query in queries)
+        self.assertNotIn('FROM "auth_user"', tables)
+        self.assertNotIn('events_volunteer', tables)
+        self.assertEqual(Ticket.objects.get(otp_code=self.codes[0]).verified_by, self.user)
+
+    def test_deactivated_volunteer_is_turned_away(self):
+        token = self.login()
+        self.volunteer.is_active = False
+        self.volunteer.save()
+        self.assertEqual(self.verify(token, self.codes[0]).status_code, 401)
+        # A new token says the volunteer is inactive (a second later: iat is in whole seconds)
+        self.volunteer.is_active = True
+        self.volunteer.save()
+        cache.set(scanner_auth._revoked_key(self.user.id), int(time.time()) - 1)
+        Volunteer.objects.filter(id=self.volunteer.id).update(is_active=False)
+        self.assertEqual(self.verify(self.login(), self.codes[0]).status_code, 403)
+
+    def test_saving_the_volunteer_keeps_the_user_revoked(self):
+        token = self.login()
+        self.user.is_active = False
+        with mock.patch('events.scanner_auth.time.time', return_value=time.time() + 1):
+            self.user.save()
+        self.volunteer.save()
+        self.assertEqual(self.verify(token, self.codes[0]).status_code, 401)
+
+    def test_refresh_rewrites_the_roles(self):
+        refresh = self.client.post('/api/token/', {'username': 'gate1', 'password': 'secret'}).data['refresh']
+        self.assertEqual(self.verify(self.login(), self.codes[0], '/api/admin/verify-ticket/').status_code, 403)
+        User.objects.filter(id=self.user.id).update(is_staff=True)
+        access = self.client.post('/api/token/refresh/', {'refresh': refresh}).data['access']
+        self.assertEqual(self.verify(access, self.codes[0], '/api/admin/verify-ticket/').status_code, 200)
+
+    def test_deactivated_or_demoted_user_is_turned_away(self):
+        self.user.is_staff = True
+        self.user.save()
+        admin_token = self.login()
+        self.user.is_staff = False
+        with mock.patch('events.scanner_auth.time.time', return_value=time.time() + 1):
+            self.user.save()
+        self.assertEqual(self.verify(admin_token, self.codes[0], '/api/admin/verify-ticket/').status_code, 401)
+        # Tokens issued afterwards carry the new roles (a second later: iat is in whole seconds)
+        cache.set(scanner_auth._revoked_key(self.user.id), int(time.time()) - 1)
+        self.assertEqual(self.verify(self.login(), self.codes[0]).status_code, 200)
+
+        token = self.login()
+        self.user.is_active = False
+        with mock.patch('events.scanner_auth.time.time', return_value=time.time() + 1):
+            self.user.save()
+        self.assertEqual(self.verify(token, self.codes[1]).status_code, 401)
+
+    def test_old_tokens_load_the_user(self):
+        token = self.login()
+        later = time.time() + (settings.SCANNER_CLAIMS_MAX_MINUTES + 1) * 60
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        with mock.patch('events.scanner_auth.time.time', return_value=later):
+            self.assertEqual(self.verify(token, self.codes[0]).status_code, 401)
+
+    def test_tokens_without_roles_still_work(self):
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.assertEqual(self.verify(token, self.codes[0]).status_code, 200)
+        with override_settings(SCANNER_STATELESS_AUTH=False):
+            self.assertEqual(self.verify(self.login(), self.codes[1]).status_code, 200)
+        self.assertFalse(scanner_auth.is_volunteer(User.objects.create_user('someone')))
+
+
+class ManifestTests(TestCase):
+    def setUp(self):
+        self.event = make_event()
+        booking = make_booking(self.event, tickets=3, payment_status='completed')
+        self.codes = [t.otp_code for t in tickets.mint_tickets(booking)]
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+
+    def hashes(self, packed):
+        raw = base64.b64decode(packed)
+        return [raw[i:i + manifest.HASH_BYTES] for i in range(0, len(raw), manifest.HASH_BYTES)]
+
+    def test_full_manifest_and_delta(self):
+        Ticket.objects.filter(otp_code=self.codes[0]).update(is_verified=True, verified_at=timezone.now())
+        data = self.client.get(f'/api/events/{self.event.id}/manifest/').json()
+
+        signature = data.pop('signature')
+        self.assertEqual(signature, manifest.sign(data))
+        valid = self.hashes(data['valid'])
+        self.assertEqual(valid, sorted(valid))
+        self.assertEqual(set(valid), {manifest.hash_code(data['salt'], c) for c in self.codes[1:]})
+        self.assertEqual(self.hashes(data['used']), [manifest.hash_code(data['salt'], self.codes[0])])
+
+        # Nothing changed an hour later, so the delta is empty
+        later = data['version'] + 3600 * 10 ** 6
+        delta = self.client.get(f'/api/events/{self.event.id}/manifest/', {'since': later}).json()
+        self.assertFalse(delta['full'])
+        self.assertEqual(delta['count'], 0)
+
+    def test_reconcile_flags_double_use(self):
+        Ticket.objects.filter(otp_code=self.codes[0]).update(is_verified=True, verified_at=timezone.now())
+        other_event_code = tickets.mint_tickets(make_booking(make_event(), payment_status='completed'))[0].otp_code
+
+        response = self.client.post(f'/api/events/{self.event.id}/checkins/', {'checkins': [
+            {'otp_code': self.codes[0], 'scanned_at': '2030-01-01T18:00:00Z'},
+            {'otp_code': self.codes[1], 'scanned_at': '2030-01-01T18:01:00Z'},
+            {'otp_code': self.codes[1], 'scanned_at': '2030-01-01T18:05:00Z'},
+            {'otp_code': other_event_code, 'scanned_at': '2030-01-01T18:02:00Z'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['verified'], 1)
+        self.assertEqual([c['otp_code'] for c in response.data['conflicts']], [self.codes[0], self.codes[1]])
+        self.assertEqual(response.data['invalid'], [other_event_code])
+
+        ticket = Ticket.objects.get(otp_code=self.codes[1])
+        self.assertEqual(ticket.verified_at, datetime.datetime(2030, 1, 1, 18, 1, tzinfo=datetime.timezone.utc))
+
+
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        db_routing._down.clear()
+        self.addCleanup(db_routing._down.clear)
+
+    def test_router(self):
+        router = db_routing.ReplicaRouter()
+        with self.settings(DATABASE_REPLICAS=['replica_0']):
+            self.assertEqual(router.db_for_read(Event), 'default')
+            with db_routing.use_replica('replica_0'):
+                self.assertEqual(router.db_for_read(Event), 'replica_0')
+                self.assertEqual(router.db_for_write(Event), 'default')
+            self.assertFalse(router.allow_migrate('replica_0', 'events'))
+            self.assertTrue(router.allow_migrate('default', 'events'))
+
+    # The test database stands in for the replica; what matters is who asked for one
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_reads_go_to_replica_until_the_client_writes(self):
+        event = make_event()
+        with mock.patch.object(db_routing, 'choose_replica', wraps=db_routing.choose_replica) as choose:
+            self.client.get('/api/events/')
+            self.client.get(f'/api/events/{event.id}/')
+            self.assertEqual(choose.call_count, 2)
+
+            response = self.client.post(f'/api/events/{event.id}/book/', {
+                'customer_name': 'A', 'roll_number': '1', 'section': 'A', 'phone': '1', 'number_of_tickets': 1,
+            })
+            self.assertEqual(response.status_code, 201)
+            self.client.post(f"/api/bookings/{response.json()['id']}/complete-payment/")
+            self.assertEqual(choose.call_count, 2)
+
+            # Pinned to the primary: sees its own booking straight away
+            self.client.get(f'/api/events/{event.id}/')
+            self.assertEqual(choose.call_count, 2)
+            # Someone else still reads from the replica
+            self.client.get(f'/api/events/{event.id}/', REMOTE_ADDR='10.0.0.2')
+            self.assertEqual(choose.call_count, 3)
+
+    @override_settings(DATABASE_REPLICAS=['default'])
+    def test_failed_replica_is_skipped(self):
+        self.assertEqual(db_routing.choose_replica(), 'default')
+        db_routing.mark_down('default')
+        self.assertIsNone(db_routing.choose_replica())
+
+    def test_listing_miss_right_after_a_change_reads_the_primary(self):
+        used = []
+
+        def build():
+            used.append(db_routing._replica.get())
+            return Response([])
+
+        request = RequestFactory().get('/api/events/')
+        with db_routing.use_replica('replica_0'):
+            listing.invalidate()
+            listing.cached_response(request, build)
+            # Same again once the change is old enough to have replicated
+            cache.incr(listing.VERSION_KEY)
+            cache.set(listing.CHANGED_AT_KEY, time.time() - 60, None)
+            listing.cached_response(request, build)
+        self.assertEqual(used, [None, 'replica_0'])
+
+
+class QueryPlanTests(TestCase):
+    """The hot lookups must keep using their indexes (see the Meta.indexes in models.py)."""
+
+    def assertUsesIndex(self, queryset, index_name):
+        if connection.vendor == 'postgresql':
+            # Test tables are tiny, so make the planner show what it would do on real ones
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, f'{index_name} not used:\n{plan}')
+
+    def test_active_events_by_date(self):
+        self.assertUsesIndex(Event.objects.filter(is_active=True).order_by('event_date', 'id'), 'event_active_date_idx')
+
+    def test_bookings_of_an_event(self):
+        self.assertUsesIndex(Booking.objects.filter(event_id=1).order_by('id'), 'booking_event_id_idx')
+
+    def test_stale_holds(self):
+        stale = Booking.objects.filter(payment_status='pending', hold_expires_at__lte=timezone.now())
+        self.assertUsesIndex(stale.order_by('hold_expires_at'), 'booking_pending_hold_idx')
+
+    def test_bookings_by_status_and_date(self):
+        old = Booking.objects.filter(payment_status='expired', created_at__lt=timezone.now())
+        self.assertUsesIndex(old.order_by('created_at'), 'booking_status_created_idx')
+
+
+# Budgets are counted on the primary connection
+@override_settings(DATABASE_REPLICAS=[])
+class QueryBudgetTests(TestCase):
+    """Queries per request on the hot endpoints. If one of these goes up, find out why."""
+
+    def setUp(self):
+        cache.clear()
+        otp.discard_block()
+        otp.allocate(1)  # OTP block refills are amortised, keep them out of the counts
+        self.event = make_event(seats=50)
+        self.client = APIClient()
+        self.staff = User.objects.create_user('admin', is_staff=True)
+
+    def test_event_list_and_detail(self):
+        make_event(title='Second')
+        with self.assertNumQueries(1):
+            self.client.get('/api/events/')
+        with self.assertNumQueries(0):
+            self.client.get('/api/events/')
+        with self.assertNumQueries(1):
+            self.client.get(f'/api/events/{self.event.id}/')
+
+    def test_booking_funnel(self):
+        with self.assertNumQueries(8):
+            # event (view + serializer PK check), waitlist EXISTS, seat UPDATE, booking INSERT, stats UPDATE
+            # (+ savepoint pair)
+            response = self.client.post(f'/api/events/{self.event.id}/book/', {
+                'customer_name': 'Guest', 'roll_number': 'R1', 'section': 'A', 'phone': '1',
+                'number_of_tickets': 2, 'email': 'guest@example.com',
+            })
+        booking_id = response.data['id']
+        with self.assertNumQueries(12):
+            # booking + event, claim UPDATE, stats UPDATE, tickets exist?, tickets INSERT, outbox INSERT,
+            # reload status + tickets for the response (+ savepoints)
+            response = self.client.post(f'/api/bookings/{booking_id}/complete-payment/')
+        self.assertEqual(response.status_code, 200)
+
+        self.client.force_authenticate(self.staff)
+        code = response.data['tickets'][0]['otp_code']
+        with self.assertNumQueries(5):
+            # conditional UPDATE ... RETURNING + details, stats UPDATE (+ savepoint pair)
+            self.client.post('/api/admin/verify-ticket/', {'otp_code': code})
+        with self.assertNumQueries(2):
+            self.client.get(f'/api/events/{self.event.id}/bookings/')
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+
+    def test_requests_are_recorded_per_view(self):
+        make_event()
+        self.client.get('/api/events/')
+        self.client.get('/api/events/')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('eventra_request_seconds_count{view="EventListCreateView"} 2', body)
+        self.assertIn('eventra_db_queries_bucket{view="EventListCreateView",le="1"} 2', body)
+        self.assertIn('eventra_responses_total{view="EventListCreateView",status="200"} 2', body)
+
+    def test_serializer_time_is_recorded(self):
+        booking = make_booking(make_event())
+        self.client.post(f'/api/bookings/{booking.id}/complete-payment/')
+        histogram = metrics._histograms[('serializer_seconds', 'complete_payment')]
+        self.assertEqual(histogram.count, 1)
+        self.assertGreater(histogram.sum, 0)
+
+    @override_settings(METRICS_ALLOWED_IPS=[])
+    def test_metrics_endpoint_is_restricted(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    @override_settings(METRICS_SLOW_QUERY_MS=0)
+    def test_slow_query_log(self):
+        with self.assertLogs('events.slow_queries', level='WARNING') as logs:
+            self.client.post(f'/api/bookings/{make_booking(make_event()).id}/complete-payment/')
+        self.assertIn('events_booking', logs.output[0])
+        self.assertIn('views.py', logs.output[0])
+
+
+class SeatStressTests(TransactionTestCase):
+    """Hammer one event from many threads and check nobody oversells."""
+
+    workers = 16
+    seats = 60
+
+    def _run_workers(self, event):
+        taken = []
+        lock = threading.Lock()
+        start = threading.Barrier(self.workers)
+
+        def worker(n):
+            start.wait()
+            count = 1 + n % 3
+            try:
+                while True:
+                    try:
+                        inventory.take_seats(event, count)
+                    except inventory.NotEnoughSeats:
+                        # A smaller request may still fit
+                        if count == 1:
+                            break
+                        count = 1
+                        continue
+                    except OperationalError:
+                        # SQLite reports lock contention instead of waiting
+                        continue
+                    with lock:
+                        taken.append(count)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(taken)
+
+    def test_no_oversell_on_event_row(self):
+        event = make_event(seats=self.seats)
+        self.assertEqual(self._run_workers(event), self.seats)
+        event.refresh_from_db()
+        self.assertEqual(event.available_seats, 0)
+
+    def test_no_oversell_on_sharded_event(self):
+        event = make_event(seats=self.seats)
+        inventory.enable_sharding(event, shards=4)
+        event.refresh_from_db()
+        self.assertEqual(self._run_workers(event), self.seats)
+        self.assertEqual(inventory.seats_left(event), 0)
+
+
+@override_settings(ROOT_URLCONF='eventra_backend.asgi_urls', DATABASE_REPLICAS=[])
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.event = make_event(seats=3)
+        volunteer = User.objects.create_user('gate-async')
+        Volunteer.objects.create(user=volunteer, name='Gate')
+        self.token = str(RefreshToken.for_user(volunteer).access_token)
+        self.client = AsyncClient()
+
+    def book(self, tickets):
+        return self.client.post(f'/api/events/{self.event.id}/book/', {
+            'customer_name': 'A', 'roll_number': '1', 'section': 'A', 'phone': '1', 'number_of_tickets': tickets,
+        }, content_type='application/json')
+
+    async def test_funnel(self):
+        response = await self.client.get('/api/events/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([e['id'] for e in json.loads(response.content)], [self.event.id])
+        # Second time straight from the cache, no database and no worker thread
+        metrics.reset()
+        response = await self.client.get('/api/events/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(metrics._histograms[('db_queries', 'event_list')].sum, 0)
+
+        response = await self.book(2)
+        self.assertEqual(response.status_code, 201)
+        booking = response.json()
+        self.assertEqual(booking['message'], 'Booking initiated. Proceed to payment.')
+        self.assertEqual((await self.book(2)).json(), {'error': 'Not enough seats available'})
+
+        response = await self.client.post(f"/api/bookings/{booking['id']}/complete-payment/")
+        self.assertEqual(response.status_code, 200)
+        codes = [t['otp_code'] for t in response.json()['tickets']]
+        self.assertEqual(len(codes), 2)
+        response = await self.client.post(f"/api/bookings/{booking['id']}/complete-payment/")
+        self.assertEqual(response.json()['message'], 'Payment already completed.')
+
+        verify = '/api/volunteer/verify-ticket/'
+        auth = {'headers': {'Authorization': f'Bearer {self.token}'}}
+        response = await self.client.post(verify, {'otp_code': codes[0]}, content_type='application/json', **auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['ticket']['ticket_number'], 1)
+        response = await self.client.post(verify, {'otp_code': codes[0]}, content_type='application/json', **auth)
+        self.assertEqual((response.status_code, response.json()['error']), (400, 'Ticket already verified'))
+
+    async def test_errors_match_the_drf_views(self):
+        self.assertEqual((await self.client.post('/api/bookings/999/complete-payment/')).status_code, 404)
+        self.assertEqual((await self.client.get(f'/api/events/{self.event.id}/book/')).status_code, 405)
+
+        response = await self.client.post('/api/volunteer/verify-ticket/', {'otp_code': '1'},
+                                          content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        response = await self.client.post('/api/admin/verify-ticket/', {'otp_code': '1'},
+                                          content_type='application/json',
+                                          headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual((response.status_code, response.json()), (403, {'error': 'Admin access required'}))
+        response = await self.client.post(f'/api/events/{self.event.id}/book/', 'not json',
+                                          content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_metrics_count_queries_of_async_views(self):
+        metrics.reset()
+        await self.book(1)
+        histogram = metrics._histograms[('db_queries', 'create_booking')]
+        self.assertEqual(histogram.count, 1)
+        self.assertGreater(histogram.sum, 0)
+
+
+class CheckinRaceTests(TransactionTestCase):
+    def test_same_code_scanned_at_two_gates(self):
+        booking = make_booking(make_event(), tickets=1, payment_status='completed')
+        code = tickets.mint_tickets(booking)[0].otp_code
+        gates = [User.objects.create_user(f'gate{i}') for i in range(8)]
+        statuses = []
+        start = threading.Barrier(len(gates))
+
+        def scan(user):
+            start.wait()
+            try:
+                while True:
+                    try:
+                        statuses.append(checkin.verify_codes([code], user)[0]['status'])
+                        break
+                    except OperationalError:
+                        continue
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=scan, args=(user,)) for user in gates]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(statuses), ['already_used'] * 7 + ['verified'])
+
+
+class FunnelBenchmarkTests(TransactionTestCase):
+    def test_funnel_sells_out_without_overselling(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = os.path.join(tmp, 'baseline.json')
+            call_command('bench_funnel', customers=6, concurrency=1, tickets=2, seats=6, save=baseline,
+                         stdout=io.StringIO())
+            with open(baseline) as f:
+                result = json.load(f)
+
+            self.assertTrue(all(result['checks'].values()), result['checks'])
+            self.assertEqual(result['stages']['book']['statuses'], {'201': 3, '400': 3})
+            self.assertEqual(result['stages']['verify']['requests'], 6)
+            self.assertEqual(result['stages']['pay']['errors'], 0)
+            # The throwaway event and volunteer are cleaned up
+            self.assertFalse(Event.objects.exists())
+            self.assertFalse(User.objects.exists())
+
+            # A baseline nothing can match is reported as a regression
+            for stage in result['stages'].values():
+                stage['p95_ms'] = 0.001
+            with open(baseline, 'w') as f:
+                json.dump(result, f)
+            with self.assertRaisesMessage(CommandError, 'p95'):
+                call_command('bench_funnel', customers=2, concurrency=1, compare=baseline,
+                             stdout=io.StringIO())
+
+    def test_asgi_benchmark_runs_both_modes(self):
+        out = io.StringIO()
+        call_command('bench_asgi', customers=3, threads=1, concurrency=1, db_latency_ms=1, events=2, stdout=out)
+
+        rows = {line.split()[0]: line.split() for line in out.getvalue().splitlines()
+                if line.split()[:1] in (['wsgi'], ['asgi'])}
+        self.assertEqual(set(rows), {'wsgi', 'asgi'})
+        for mode, row in rows.items():
+            # list + book + pay + 2 verifies per customer, no errors
+            self.assertEqual(row[1:3], ['15', '0'], mode)
+        self.assertFalse(Event.objects.exists())
+        self.assertFalse(User.objects.exists())
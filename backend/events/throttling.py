@@ -0,0 +1,206 @@
+"""
+Rate limits for the AllowAny endpoints hit hardest when a popular event
+opens: the event listing, booking and joining a waiting room.
+
+Token buckets: a rate of "N/period" in THROTTLE_RATES is a bucket of N
+tokens that refills at N per period. Every request takes a token, an
+empty bucket answers 429 with Retry-After. Bursts of up to N go through,
+sustained traffic is held to the rate. Buckets are keyed by client IP,
+and bookings also by roll number, so switching networks doesn't get one
+person around the limit.
+
+THROTTLE_STORE picks where the buckets live:
+
+- ``local`` (default): a dict in this process. No I/O at all, but every
+  worker process has its own buckets, so the effective limit is the rate
+  times the number of workers.
+- ``cache``: the Django cache, shared by all workers when Cache_url
+  points at Redis. Two workers updating the same bucket at the same
+  instant can both take its last token; for a rate limit that's fine.
+- a dotted path to a class with the same ``take`` / ``atake`` methods.
+
+The DRF views use the throttle classes at the bottom, the async views
+call ``check`` / ``acheck`` directly.
+"""
+import collections
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Request attribute listing the scopes already charged, so an async view
+# falling back to the DRF view doesn't take a second token
+_CHARGED = '_throttle_charged'
+
+
+def parse_rate(rate):
+    """'20/min' -> (capacity 20, 20/60 tokens per second). None if the limit is off."""
+    if not rate:
+        return None
+    count, _, period = rate.partition('/')
+    invalid = ImproperlyConfigured(f"Invalid throttle rate {rate!r}, expected e.g. '20/min'")
+    try:
+        count, seconds = int(count), PERIODS[period.strip()[0]]
+    except (ValueError, KeyError, IndexError):
+        raise invalid from None
+    if count < 1:
+        raise invalid
+    return count, count / seconds
+
+
+def check_rates():
+    """Parse THROTTLE_RATES at startup (AppConfig.ready), so a bad Throttle_* value fails there and not in a request."""
+    for name, rate in settings.THROTTLE_RATES.items():
+        try:
+            parse_rate(rate)
+        except ImproperlyConfigured as e:
+            raise ImproperlyConfigured(f"THROTTLE_RATES[{name!r}]: {e}") from None
+
+
+def _take(state, capacity, per_second, now):
+    """The bucket's new (tokens, timestamp) and how long to wait, 0 if a token was taken."""
+    tokens, stamp = state if state is not None else (capacity, now)
+    tokens = min(capacity, tokens + max(0, now - stamp) * per_second)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / per_second
+
+
+class LocalStore:
+    """Buckets in this process. The least recently used ones are dropped past `size` (they'd be full anyway)."""
+
+    def __init__(self, size=100000):
+        self.size = size
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, per_second):
+        with self._lock:
+            self._buckets[key], wait = _take(self._buckets.get(key), capacity, per_second, time.monotonic())
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.size:
+                self._buckets.popitem(last=False)
+        return wait
+
+    async def atake(self, key, capacity, per_second):
+        return self.take(key, capacity, per_second)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class CacheStore:
+    """Buckets in the Django cache, shared by every worker pointing at it."""
+
+    @staticmethod
+    def _timeout(capacity, per_second):
+        # An untouched bucket is full again after this, no need to keep it
+        return math.ceil(capacity / per_second) + 1
+
+    def take(self, key, capacity, per_second):
+        key = f'throttle:{key}'
+        state, wait = _take(cache.get(key), capacity, per_second, time.time())
+        cache.set(key, state, self._timeout(capacity, per_second))
+        return wait
+
+    async def atake(self, key, capacity, per_second):
+        key = f'throttle:{key}'
+        state, wait = _take(await cache.aget(key), capacity, per_second, time.time())
+        await cache.aset(key, state, self._timeout(capacity, per_second))
+        return wait
+
+    def clear(self):
+        pass
+
+
+_stores = {'local': LocalStore(), 'cache': CacheStore()}
+
+
+def get_store():
+    name = settings.THROTTLE_STORE
+    if name not in _stores:
+        _stores[name] = import_string(name)()
+    return _stores[name]
+
+
+def reset():
+    """Forget every bucket of the in-process store (tests)."""
+    _stores['local'].clear()
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _buckets(request, scope, data):
+    """(rate name, bucket key) pairs a request of `scope` takes a token from."""
+    yield scope, f'{scope}:ip:{client_ip(request)}'
+    roll_number = str((data or {}).get('roll_number') or '').strip().upper()
+    if scope == 'booking' and roll_number:
+        yield 'booking_roll_number', f'booking:roll:{roll_number}'
+
+
+def _limits(request, scope, data):
+    # Unwrap DRF's Request, the charged scopes live on the HttpRequest
+    request = getattr(request, '_request', request)
+    charged = request.__dict__.setdefault(_CHARGED, set())
+    if scope in charged:
+        return
+    charged.add(scope)
+    for name, key in _buckets(request, scope, data):
+        rate = parse_rate(settings.THROTTLE_RATES.get(name))
+        if rate is not None:
+            yield (key, *rate)
+
+
+def check(request, scope, data=None):
+    """Take a token from each of the request's buckets. Returns the seconds to wait, 0 if it may go on."""
+    store = get_store()
+    return max([store.take(*limit) for limit in _limits(request, scope, data)], default=0)
+
+
+async def acheck(request, scope, data=None):
+    store = get_store()
+    return max([await store.atake(*limit) for limit in _limits(request, scope, data)], default=0)
+
+
+class ScopedThrottle(BaseThrottle):
+    scope = None
+    # None = every method
+    methods = None
+
+    def get_data(self, request):
+        return None
+
+    def allow_request(self, request, view):
+        if self.methods is not None and request.method not in self.methods:
+            return True
+        self.wait_seconds = check(request, self.scope, self.get_data(request))
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ListingThrottle(ScopedThrottle):
+    scope = 'listing'
+    methods = ('GET', 'HEAD')
+
+
+class BookingThrottle(ScopedThrottle):
+    scope = 'booking'
+
+    def get_data(self, request):
+        return request.data
+
+
+class WaitingRoomThrottle(ScopedThrottle):
+    scope = 'waiting_room'
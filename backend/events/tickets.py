@@ -0,0 +1,38 @@
+"""
+Ticket minting.
+
+All tickets of a booking are written with one bulk INSERT, with their
+OTPs taken from the collision-free sequence in events/otp.py.
+"""
+from django.db import IntegrityError, transaction
+
+from . import otp
+from .models import Ticket
+
+MAX_ATTEMPTS = 3
+
+
+def mint_tickets(booking):
+    """Create the tickets for a booking in a single bulk_create."""
+    return mint_for_bookings([booking])
+
+
+def mint_for_bookings(bookings):
+    """Create the tickets of several bookings (bulk imports) in a single bulk_create."""
+    count = sum(booking.number_of_tickets for booking in bookings)
+
+    for attempt in range(MAX_ATTEMPTS):
+        codes = iter(otp.allocate(count))
+        try:
+            # Savepoint, so a clash doesn't break the caller's transaction
+            with transaction.atomic():
+                return Ticket.objects.bulk_create([
+                    Ticket(booking=booking, ticket_number=i + 1, otp_code=next(codes))
+                    for booking in bookings
+                    for i in range(booking.number_of_tickets)
+                ])
+        except IntegrityError:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            # Some code in our block is already taken, start from a fresh one
+            otp.discard_block()
@@ -1,19 +1,34 @@
 from django.urls import path
 from .views import EventListCreateView, EventDetailView, create_booking, volunteer_verify_ticket, complete_payment # Added complete_payment
-from django.conf import settings
-from django.conf.urls.static import static
 from .views import event_bookings  # Added event_bookings
+from .views import verify_tickets_batch, event_manifest, upload_checkins, search_events, event_stats
+from .views import join_waiting_room, bulk_import, join_waitlist, waitlist_entry
 urlpatterns = [
     # Events
     path('events/', EventListCreateView.as_view(), name='event-list-create'),
     path('events/<int:pk>/', EventDetailView.as_view(), name='event-detail'),
+    path('events/search/', search_events, name='event-search'),
+
+    # Events with a waiting room: get an admission pass first
+    path('events/<int:event_id>/waiting-room/', join_waiting_room, name='join-waiting-room'),
 
     # Booking - Step 1: Create pending booking
     path('events/<int:event_id>/book/', create_booking, name='create-booking'),
     
+    # Sold out: queue for freed seats
+    path('events/<int:event_id>/waitlist/', join_waitlist, name='join-waitlist'),
+    path('waitlist/<int:entry_id>/', waitlist_entry, name='waitlist-entry'),
+
     # Payment - Step 2: Complete payment and finalize booking
     path('bookings/<int:booking_id>/complete-payment/', complete_payment, name='complete-payment'),
     path('events/<int:event_id>/bookings/', event_bookings, name='event-bookings'),
+    path('events/<int:event_id>/stats/', event_stats, name='event-stats'),
     # Verification  
     path('verify-ticket/', volunteer_verify_ticket, name='verify-ticket'),
-]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    path('verify-tickets/batch/', verify_tickets_batch, name='verify-tickets-batch'),
+    # Admin: bulk import of events / past bookings
+    path('import/<str:kind>/', bulk_import, name='bulk-import'),
+    # Offline scanners
+    path('events/<int:event_id>/manifest/', event_manifest, name='event-manifest'),
+    path('events/<int:event_id>/checkins/', upload_checkins, name='upload-checkins'),
+]
\ No newline at end of file
@@ -1,29 +1,68 @@
 from django.shortcuts import render
-from .models import Event, Booking, Ticket, Volunteer
-from django.core.mail import send_mail
+from django.http import HttpResponse, HttpResponseForbidden
+from django.conf import settings
+from .models import Event, Booking, Volunteer
 from rest_framework import generics, filters, status
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import (
+    api_view, authentication_classes, parser_classes, permission_classes, throttle_classes,
+)
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from .serializers import (EventSerializer, EventListSerializer, BookingSerializer, BookingWithTicketsSerializer, TicketSerializer)
+from .serializers import (EventSerializer, EventListSerializer, EventCompactSerializer, BookingWithTicketsSerializer, TicketSerializer)
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from django.utils import timezone
-import random 
+from django.utils.decorators import method_decorator
+import io
 import datetime
-from rest_framework_simplejwt.tokens import RefreshToken
+from . import (
+    bookings, checkin, exports, fast_serializers, idempotency, imports, listing, manifest, metrics, scanner_auth,
+    search, stats, waiting_room, waitlist,
+)
+from .scanner_auth import ScannerAuthentication
+from .throttling import BookingThrottle, ListingThrottle, WaitingRoomThrottle
+from .pagination import BookingCursorPagination, EventCursorPagination, SearchPagination
+from .db_routing import replica_reads
+
+MAX_VERIFY_BATCH = 1000
+MAX_IMPORT_ERRORS = 1000
 
 # Create your views here.
+# GETs may read from a replica (events/db_routing.py), POSTs go to the primary
+@method_decorator(replica_reads, name='dispatch')
 class EventListCreateView(generics.ListCreateAPIView):
     queryset = Event.objects.filter(is_active=True)
+    # Only kicks in with ?page_size= or ?cursor=
+    pagination_class = EventCursorPagination
+    # GETs only, see events/throttling.py
+    throttle_classes = [ListingThrottle]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method == 'GET' and listing.is_compact(self.request):
+            queryset = queryset.only(*listing.COMPACT_FIELDS)
+        return queryset
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
+            if listing.is_compact(self.request):
+                return EventCompactSerializer
             return EventListSerializer
         return EventSerializer
+
+    def list(self, request, *args, **kwargs):
+        # Served from the versioned cache, with ETag / 304 support
+        return listing.cached_response(request, lambda: self.build_list(request, *args, **kwargs))
+
+    def build_list(self, request, *args, **kwargs):
+        # The whole list (what existing clients fetch) skips the DRF fields, see events/fast_serializers.py
+        fast = fast_serializers.for_class(self.get_serializer_class())
+        if fast is None or self.paginator.is_requested(request):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(fast.serialize(queryset, self.get_serializer_context()))
     
     def get_permissions(self):
         # TEMPORARILY allowing POST (Create Event) without authentication
@@ -32,6 +71,7 @@ class EventListCreateView(generics.ListCreateAPIView):
         # All other methods (PUT, DELETE) still require IsAuthenticated.
         return [IsAuthenticated()]
     
+@method_decorator(replica_reads, name='dispatch')
 class EventDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Event.objects.all()
     serializer_class = EventSerializer
@@ -43,85 +83,90 @@ class EventDetailView(generics.RetrieveUpdateDestroyAPIView):
             return [AllowAny()]
         return [IsAuthenticated()] # PUT (Edit) still requires authentication (make it auth for safety purpose )
 
+@replica_reads
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@throttle_classes([ListingThrottle])
+def search_events(request):
+    """
+    ?q=jazz night&event_type=workshop,seminar&date=this_week&price=free,under_100&availability=available
+    Also date_from / date_to (YYYY-MM-DD), page and page_size.
+    Returns ranked compact events plus facet counts, see events/search.py.
+    """
+    def build():
+        try:
+            events, total, facets = search.search(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(events.only(*listing.COMPACT_FIELDS), request, count=total)
+        serializer = EventCompactSerializer(page, many=True, context={'request': request})
+        response = paginator.get_paginated_response(serializer.data)
+        response.data['facets'] = facets
+        return response
+
+    # Cached per URL and invalidated with the listing
+    return listing.cached_response(request, build)
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([WaitingRoomThrottle])
+def join_waiting_room(request, event_id):
+    """
+    Step 0 for events with a waiting room: get an admission pass and the
+    time from which it lets you book (events/waiting_room.py).
+    """
+    data, status_code = waiting_room.join(event_id)
+    return Response(data, status=status_code)
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([BookingThrottle])
+def join_waitlist(request, event_id):
+    """
+    Sold out: queue for the next free seats instead of retrying the booking.
+    Same customer fields as a booking (events/waitlist.py).
+    """
+    data, status_code = waitlist.join(event_id, request.data)
+    return Response(data, status=status_code)
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def waitlist_entry(request, entry_id):
+    data, status_code = waitlist.entry_status(entry_id)
+    return Response(data, status=status_code)
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([BookingThrottle])
 def create_booking(request, event_id):
     """
-    Step 1: Create a booking with PENDING status.
+    Step 1: Create a booking with PENDING status and hold its seats
+    for SEAT_HOLD_MINUTES.
     The frontend calls this immediately after the registration form is validated.
     """
-    event = get_object_or_404(Event, id=event_id)
-    # Ensure tickets_requested is an integer, default to 1
-    tickets_requested = int(request.data.get('number_of_tickets', 1))
-    
-    if event.available_seats < tickets_requested:
-        return Response(
-            {'error': 'Not enough seats available'}, 
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    
-    booking_data = request.data.copy()
-    booking_data['event'] = event.id
-    # Ensure payment status is pending for the first step
-    booking_data['payment_status'] = 'pending' 
-    booking_data['number_of_tickets'] = tickets_requested
-    
-    serializer = BookingSerializer(data=booking_data)
-    if serializer.is_valid():
-        # Save the booking object (tickets are NOT created yet)
-        booking = serializer.save() 
-        
-        # Return booking details without tickets for the next step (payment)
-        response_data = BookingSerializer(booking).data 
-        response_data['message'] = "Booking initiated. Proceed to payment."
-        return Response(response_data, status=status.HTTP_201_CREATED)
-    
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    return _idempotent(
+        request, f'create_booking:{event_id}',
+        lambda: bookings.create_booking(event_id, request.data, waiting_room.pass_of(request)),
+    )
 
 @api_view(['POST'])
 @permission_classes([AllowAny]) 
 def complete_payment(request, booking_id):
-    booking = get_object_or_404(Booking, id=booking_id)
-
-    # If already paid → return full serializer (required by frontend)
-    if booking.payment_status == 'completed':
-        serializer = BookingWithTicketsSerializer(booking)
-        return Response({
-            "message": "Payment already completed.",
-            **serializer.data
-        }, status=status.HTTP_200_OK)
-
-    # Mark payment as completed
-    booking.payment_status = 'completed'
-    booking.payment_id = request.data.get(
-        'payment_id', 
-        f'PAY-{booking_id}-{random.randint(1000,9999)}'
+    """
+    Step 2. Safe to retry: send the same Idempotency-Key header and the
+    first response comes back without running the payment again.
+    """
+    return _idempotent(
+        request, f'complete_payment:{booking_id}',
+        lambda: bookings.complete_payment(booking_id, request.data.get('payment_id')),
     )
 
-    # Deduct seats
-    event = booking.event
-    event.available_seats -= booking.number_of_tickets
-    event.save()
-
-    # Create tickets
-    if not booking.tickets.exists():
-        for i in range(booking.number_of_tickets):
-            Ticket.objects.create(booking=booking, ticket_number=i+1)
-
-    booking.save()
-
-    # Send Email
-    if booking.email:
-        send_mail(
-            subject=f"Ticket Booking Confirmation for {event.title}",
-            message=f"Your payment for {event.title} is complete. Booking ID: {booking.id}.",
-            from_email=None,
-            recipient_list=[booking.email],
-            fail_silently=True
-        )
-
-    serializer = BookingWithTicketsSerializer(booking)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+# Requests with an Idempotency-Key header run once, retries replay the first response (events/idempotency.py)
+def _idempotent(request, scope, action):
+    data, status_code, headers = idempotency.run(idempotency.key_of(request), scope, request.data, action)
+    return Response(data, status=status_code, headers=headers)
 
 # ===== VOLUNTEER MANAGEMENT VIEWS =====
 
@@ -186,8 +231,8 @@ def volunteer_login(request):
     user = authenticate(username=username, password=password)
     
     if user and hasattr(user, 'volunteer_profile'):
-        # Generate JWT tokens
-        refresh = RefreshToken.for_user(user)
+        # Generate JWT tokens, with the volunteer's roles in them (events/scanner_auth.py)
+        refresh = scanner_auth.tokens_for(user)
         
         return Response({
             'success': True,
@@ -199,52 +244,24 @@ def volunteer_login(request):
     
     return Response({'error': 'Invalid credentials or not a volunteer'}, status=401)
 
+# Shared by the volunteer and admin verify views: one conditional UPDATE, no full-row save()
+def _verify_single_ticket(request, success_message):
+    data, status_code = checkin.verify_single(request.data.get('otp_code'), request.user, success_message)
+    return Response(data, status=status_code)
+
 # Volunteer: Verify ticket (requires volunteer authentication)
 @api_view(['POST'])
+@authentication_classes([ScannerAuthentication])
 @permission_classes([IsAuthenticated])  # Changed to require auth
 def volunteer_verify_ticket(request):
     """
     Verify a ticket using authenticated volunteer and OTP code
     """
-    # Check if user is a volunteer
-    if not hasattr(request.user, 'volunteer_profile'):
+    # Check if user is a volunteer (from the token's claims, see events/scanner_auth.py)
+    if not scanner_auth.is_volunteer(request.user):
         return Response({'error': 'Only volunteers can verify tickets'}, status=403)
     
-    otp_code = request.data.get('otp_code')
-    
-    if not otp_code:
-        return Response({'error': 'OTP code is required'}, status=400)
-    
-    # Find ticket
-    try:
-        ticket = Ticket.objects.select_related('booking', 'booking__event').get(otp_code=otp_code)
-        
-        if ticket.is_verified:
-            return Response({
-                'error': 'Ticket already verified',
-                'verified_at': ticket.verified_at,
-                'verified_by': ticket.verified_by.username if ticket.verified_by else None
-            }, status=400)
-        
-        # Verify ticket
-        ticket.is_verified = True
-        ticket.verified_at = timezone.now()
-        ticket.verified_by = request.user
-        ticket.save()
-        
-        return Response({
-            'success': True,
-            'message': 'Ticket verified successfully',
-            'ticket': {
-                'otp_code': ticket.otp_code,
-                'event': ticket.booking.event.title,
-                'customer': ticket.booking.customer_name,
-                'ticket_number': ticket.ticket_number
-            }
-        })
-        
-    except Ticket.DoesNotExist:
-        return Response({'error': 'Invalid OTP code'}, status=404)
+    return _verify_single_ticket(request, 'Ticket verified successfully')
         
 # Admin: Get or update admin profile
 @api_view(['GET', 'PUT'])
@@ -301,6 +318,7 @@ def admin_profile(request):
         
 # Add this new view to views.py
 @api_view(['POST'])
+@authentication_classes([ScannerAuthentication])
 @permission_classes([IsAuthenticated])
 def admin_verify_ticket(request):
     """
@@ -310,47 +328,172 @@ def admin_verify_ticket(request):
     if not request.user.is_staff:
         return Response({'error': 'Admin access required'}, status=403)
     
-    otp_code = request.data.get('otp_code')
-    
-    if not otp_code:
-        return Response({'error': 'OTP code is required'}, status=400)
-    
-    # Find ticket
-    try:
-        ticket = Ticket.objects.select_related('booking', 'booking__event').get(otp_code=otp_code)
-        
-        if ticket.is_verified:
-            return Response({
-                'error': 'Ticket already verified',
-                'verified_at': ticket.verified_at,
-                'verified_by': ticket.verified_by.username if ticket.verified_by else None
-            }, status=400)
-        
-        # Verify ticket
-        ticket.is_verified = True
-        ticket.verified_at = timezone.now()
-        ticket.verified_by = request.user
-        ticket.save()
-        
-        return Response({
-            'success': True,
-            'message': 'Ticket verified successfully by Admin',
-            'ticket': {
-                'otp_code': ticket.otp_code,
-                'event': ticket.booking.event.title,
-                'customer': ticket.booking.customer_name,
-                'ticket_number': ticket.ticket_number
-            }
-        })
-        
-    except Ticket.DoesNotExist:
-        return Response({'error': 'Invalid OTP code'}, status=404)
+    return _verify_single_ticket(request, 'Ticket verified successfully by Admin')
     
 #for retreiving bookings for a specific event
 # For fetching the bookings of a particular event
+@replica_reads
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def event_bookings(request, event_id):
-    bookings = Booking.objects.filter(event__id=event_id)
+    """
+    ?page_size=N pages through the bookings (follow `next`),
+    ?export=csv or ?export=json streams all of them as a download.
+    """
+    # Event and tickets are loaded up front instead of one query per booking
+    bookings = (
+        Booking.objects.filter(event__id=event_id)
+        .select_related('event')
+        .prefetch_related('tickets')
+        .order_by('id')
+    )
+
+    export = request.query_params.get('export')
+    if export in ('csv', 'json'):
+        return exports.stream_bookings(bookings, export, filename=f'event-{event_id}-bookings')
+
+    paginator = BookingCursorPagination()
+    page = paginator.paginate_queryset(bookings, request)
+    if page is not None:
+        serializer = BookingWithTicketsSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    fast = fast_serializers.for_class(BookingWithTicketsSerializer)
+    if fast is not None:
+        return Response(fast.serialize(bookings))
     serializer = BookingWithTicketsSerializer(bookings, many=True)
     return Response(serializer.data)
+
+# Admin: sales and attendance dashboard of one event
+@replica_reads
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def event_stats(request, event_id):
+    """
+    Read from the running totals in EventStats (events/stats.py),
+    never by aggregating the event's bookings and tickets.
+    """
+    if not request.user.is_staff:
+        return Response({'error': 'Admin access required'}, status=403)
+
+    event = get_object_or_404(Event, id=event_id)
+    totals = stats.for_event(event)
+    sold = totals['tickets_sold']
+    return Response({
+        'event': event.id,
+        'title': event.title,
+        'total_seats': event.total_seats,
+        'available_seats': event.available_seats,
+        **totals,
+        'check_in_rate': round(totals['checked_in'] / sold, 4) if sold else 0,
+    })
+
+# Volunteer or admin: verify many tickets in one request (scanners batch up codes)
+@api_view(['POST'])
+@authentication_classes([ScannerAuthentication])
+@permission_classes([IsAuthenticated])
+def verify_tickets_batch(request):
+    """
+    Body: {"otp_codes": ["482913", ...], "event": 12}
+    Returns one result per code with status verified / already_used / invalid.
+    "event" is optional; when given, tickets of other events count as invalid.
+    """
+    if not checkin.can_verify(request.user):
+        return Response({'error': 'Only volunteers or admins can verify tickets'}, status=403)
+
+    otp_codes = request.data.get('otp_codes')
+    if not isinstance(otp_codes, list) or not otp_codes:
+        return Response({'error': 'otp_codes must be a non-empty list'}, status=400)
+    if len(otp_codes) > MAX_VERIFY_BATCH:
+        return Response({'error': f'At most {MAX_VERIFY_BATCH} codes per request'}, status=400)
+
+    event_id = request.data.get('event')
+    if event_id is not None and not str(event_id).isdigit():
+        return Response({'error': 'event must be an event id'}, status=400)
+
+    results = checkin.verify_codes(otp_codes, request.user, event_id=event_id)
+    summary = {checkin.VERIFIED: 0, checkin.ALREADY_USED: 0, checkin.INVALID: 0}
+    for result in results:
+        summary[result['status']] += 1
+
+    return Response({'results': results, 'summary': summary})
+
+# Volunteer or admin: download the offline verification manifest of an event
+@api_view(['GET'])
+@authentication_classes([ScannerAuthentication])
+@permission_classes([IsAuthenticated])
+def event_manifest(request, event_id):
+    """
+    Full manifest, or ?since=<version> for only what changed after a previous one.
+    """
+    if not checkin.can_verify(request.user):
+        return Response({'error': 'Only volunteers or admins can download manifests'}, status=403)
+
+    event = get_object_or_404(Event, id=event_id)
+    since = request.query_params.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return Response({'error': 'since must be a manifest version'}, status=400)
+
+    return Response(manifest.build_manifest(event, since=since))
+
+# Volunteer or admin: upload check-ins a scanner recorded while offline
+@api_view(['POST'])
+@authentication_classes([ScannerAuthentication])
+@permission_classes([IsAuthenticated])
+def upload_checkins(request, event_id):
+    """
+    Body: {"checkins": [{"otp_code": "482913", "scanned_at": "2025-11-20T18:04:00Z"}, ...]}
+    Tickets used more than once come back in `conflicts`.
+    """
+    if not checkin.can_verify(request.user):
+        return Response({'error': 'Only volunteers or admins can upload check-ins'}, status=403)
+
+    event = get_object_or_404(Event, id=event_id)
+    checkins = request.data.get('checkins')
+    if not isinstance(checkins, list) or not all(isinstance(item, dict) for item in checkins):
+        return Response({'error': 'checkins must be a list of {otp_code, scanned_at}'}, status=400)
+    if len(checkins) > MAX_VERIFY_BATCH:
+        return Response({'error': f'At most {MAX_VERIFY_BATCH} check-ins per request'}, status=400)
+
+    return Response(manifest.reconcile(event, checkins, request.user))
+
+# Admin: import a CSV / JSON Lines file of events or past bookings
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([MultiPartParser])
+def bulk_import(request, kind):
+    """
+    Multipart upload with the file in `file` (optionally `format`: csv or jsonl).
+    Rows are imported a chunk at a time (events/imports.py); the first
+    MAX_IMPORT_ERRORS rejected rows come back with their line numbers.
+    """
+    if not request.user.is_staff:
+        return Response({'error': 'Admin access required'}, status=403)
+    if kind not in imports.KINDS:
+        return Response({'error': 'Import events or bookings'}, status=404)
+
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({'error': 'Upload the file as `file`'}, status=400)
+    fmt = request.data.get('format') or imports.guess_format(upload.name)
+    if fmt not in imports.FORMATS:
+        return Response({'error': 'format must be csv or jsonl'}, status=400)
+
+    # Large uploads are spooled to a temporary file, this reads it a line at a time
+    errors = []
+    def on_error(line, row_errors):
+        if len(errors) < MAX_IMPORT_ERRORS:
+            errors.append({'line': line, 'errors': row_errors})
+    file = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    report = imports.import_rows(kind, imports.read_rows(file, fmt), on_error=on_error)
+
+    return Response({'created': report.created, 'rejected': report.failed, 'errors': errors})
+
+# Prometheus scrape endpoint (plain Django view, no auth: restricted by METRICS_ALLOWED_IPS)
+def metrics_view(request):
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4')
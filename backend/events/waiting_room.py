@@ -0,0 +1,126 @@
+"""
+Virtual waiting room for events that sell out in seconds.
+
+An event with ``admission_rate`` set (customers per minute, in the admin)
+only takes bookings from customers holding an admission pass for it.
+Customers join the queue with POST /api/events/<id>/waiting-room/ and get
+a pass for the next free slot. Slots are handed out first come first
+served, 60 / admission_rate seconds apart, so bookings reach the
+database at that rate however many people show up at once. An idle
+queue doesn't bank slots: the next customer gets one right away.
+
+The pass is signed (django.core.signing) and carries the event and the
+slot, so checking it when booking costs no query. It is good from its
+slot for ADMISSION_PASS_MINUTES, retries and fixing form errors
+included, for one booking: the booking claims the slot in the cache
+(``claim_pass``) and a second one with the same pass is refused, so
+sharing a pass doesn't get several people in. With several workers the
+cache must be shared (Redis). Send it in the ``Admission-Pass`` header.
+"""
+import datetime
+import math
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework import status
+
+from . import inventory
+from .models import Event, WaitingRoom
+
+HEADER = 'HTTP_ADMISSION_PASS'
+SALT = 'events.waiting_room'
+
+INVALID_PASS = {'error': 'Invalid admission pass, join the waiting room again'}
+USED_PASS = {'error': 'Admission pass already used, join the waiting room again'}
+
+
+def pass_of(request):
+    """The request's Admission-Pass header, None if it has none."""
+    return request.META.get(HEADER, '').strip() or None
+
+
+def _window():
+    return datetime.timedelta(minutes=settings.ADMISSION_PASS_MINUTES)
+
+
+def _next_slot(event):
+    now = timezone.now()
+    with transaction.atomic():
+        room, _ = WaitingRoom.objects.select_for_update().get_or_create(
+            event_id=event.id, defaults={'next_slot_at': now}
+        )
+        slot = max(room.next_slot_at, now)
+        WaitingRoom.objects.filter(event_id=event.id).update(
+            next_slot_at=slot + datetime.timedelta(seconds=60 / event.admission_rate)
+        )
+    return slot, now
+
+
+def join(event_id):
+    """Hand out the next slot of the event's queue with a pass for it. Returns (data, status)."""
+    event = get_object_or_404(Event.objects.only('id', 'admission_rate', 'available_seats', 'seat_shards'), id=event_id)
+    if not event.admission_rate:
+        return {'admission_pass': None, 'wait_seconds': 0}, status.HTTP_200_OK
+    # No point queueing for a sold out event
+    if inventory.seats_left(event) < 1:
+        return {'error': 'Not enough seats available'}, status.HTTP_400_BAD_REQUEST
+
+    slot, now = _next_slot(event)
+    return {
+        'admission_pass': signing.dumps({'event': event.id, 'slot': slot.timestamp()}, salt=SALT),
+        'admitted_at': slot,
+        'expires_at': slot + _window(),
+        'wait_seconds': math.ceil((slot - now).total_seconds()),
+    }, status.HTTP_200_OK
+
+
+def check_pass(event, admission_pass):
+    """None if the holder of `admission_pass` may book `event` now, otherwise the (data, status) to answer."""
+    if not event.admission_rate:
+        return None
+    if not admission_pass:
+        return {'error': 'This event has a waiting room, join it first'}, status.HTTP_403_FORBIDDEN
+    try:
+        payload = signing.loads(admission_pass, salt=SALT)
+    except signing.BadSignature:
+        return INVALID_PASS, status.HTTP_403_FORBIDDEN
+    if not isinstance(payload, dict) or payload.get('event') != event.id:
+        return INVALID_PASS, status.HTTP_403_FORBIDDEN
+
+    slot = datetime.datetime.fromtimestamp(payload['slot'], tz=datetime.timezone.utc)
+    now = timezone.now()
+    if now < slot:
+        wait = math.ceil((slot - now).total_seconds())
+        return {'error': 'Not your turn yet', 'wait_seconds': wait}, status.HTTP_429_TOO_MANY_REQUESTS
+    if now > slot + _window():
+        return {'error': 'Admission pass expired, join the waiting room again'}, status.HTTP_403_FORBIDDEN
+    if cache.get(_used_key(event.id, payload['slot'])):
+        return USED_PASS, status.HTTP_403_FORBIDDEN
+    return None
+
+
+def _used_key(event_id, slot):
+    return f'waiting_room:used:{event_id}:{slot}'
+
+
+def claim_pass(event, admission_pass):
+    """
+    Mark a pass ``check_pass`` accepted as used, right before booking with it.
+    False if another booking got it first. Events without a waiting room always get True.
+    """
+    if not event.admission_rate:
+        return True
+    slot = signing.loads(admission_pass, salt=SALT)['slot']
+    expires_at = datetime.datetime.fromtimestamp(slot, tz=datetime.timezone.utc) + _window()
+    timeout = max(1, math.ceil((expires_at - timezone.now()).total_seconds()))
+    return cache.add(_used_key(event.id, slot), True, timeout)
+
+
+def release_pass(event, admission_pass):
+    """Give a claimed pass back (the booking didn't go through)."""
+    if event.admission_rate:
+        cache.delete(_used_key(event.id, signing.loads(admission_pass, salt=SALT)['slot']))
@@ -0,0 +1,174 @@
+"""
+Waitlist for sold out events.
+
+Instead of retrying create_booking until a seat frees up, a customer
+joins the event's queue once (POST /api/events/<id>/waitlist/) and is
+told when they got a seat. Whenever seats come back (an expired hold in
+``expire_holds``, more seats set on the event in the admin) ``promote``
+hands them to the queue in join order, a batch at a time:
+
+* the oldest entries whose tickets fit in the free seats get them, with
+  one seat UPDATE for the whole batch. Nobody skips ahead: when the next
+  customer in line wants more seats than are free, everyone behind them
+  waits too.
+* each promoted customer gets a pending booking holding the seats for
+  WAITLIST_HOLD_MINUTES and an email (through the outbox) asking them to
+  pay, the same complete-payment step as any booking. If they don't, the
+  hold expires and the seats move on down the queue.
+
+While anyone is waiting, create_booking turns direct bookings away, so
+seats freed between the release and the promotion can't be taken by
+someone who never queued.
+
+GET /api/waitlist/<id>/ tells a customer their place in the queue, or
+their booking once promoted.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from rest_framework import status
+
+from . import inventory, outbox, stats
+from .models import Booking, Event, WaitlistEntry
+from .serializers import WaitlistEntrySerializer
+
+BATCH_SIZE = 100
+
+WAITING, PROMOTED = 'waiting', 'promoted'
+
+
+def is_queued(event_id):
+    """Whether anyone is waiting for the event (an EXISTS on waitlist_waiting_idx)."""
+    return WaitlistEntry.objects.filter(event_id=event_id, status=WAITING).exists()
+
+
+def describe(entry):
+    data = {'id': entry.id, 'event': entry.event_id, 'status': entry.status,
+            'number_of_tickets': entry.number_of_tickets}
+    if entry.status == WAITING:
+        # How many are in line ahead, counted on waitlist_waiting_idx
+        data['position'] = WaitlistEntry.objects.filter(
+            event_id=entry.event_id, status=WAITING, id__lt=entry.id
+        ).count() + 1
+    else:
+        data['booking'] = entry.booking_id
+        data['promoted_at'] = entry.promoted_at
+    return data
+
+
+def join(event_id, data):
+    """Queue the customer for the event's next free seats. Returns (data, status)."""
+    event = get_object_or_404(Event, id=event_id)
+    serializer = WaitlistEntrySerializer(data=data)
+    if not serializer.is_valid():
+        return serializer.errors, status.HTTP_400_BAD_REQUEST
+
+    roll_number = serializer.validated_data['roll_number']
+    existing = WaitlistEntry.objects.filter(event=event, status=WAITING, roll_number=roll_number).first()
+    if existing is not None:
+        return describe(existing), status.HTTP_200_OK
+
+    if inventory.seats_left(event) >= serializer.validated_data['number_of_tickets'] and not is_queued(event.id):
+        return {'error': 'Seats are available, book them instead'}, status.HTTP_400_BAD_REQUEST
+
+    try:
+        with transaction.atomic():
+            entry = serializer.save(event=event)
+    except IntegrityError:
+        # Same roll number joined at the same moment
+        entry = WaitlistEntry.objects.get(event=event, status=WAITING, roll_number=roll_number)
+        return describe(entry), status.HTTP_200_OK
+
+    # Seats may have come back between the check above and now
+    promote_on_commit(event.id)
+    return describe(entry), status.HTTP_201_CREATED
+
+
+def entry_status(entry_id):
+    return describe(get_object_or_404(WaitlistEntry, id=entry_id)), status.HTTP_200_OK
+
+
+def _fit(entries, free):
+    """The head of `entries` whose tickets fit in `free` seats, and their seat count."""
+    head, seats = [], 0
+    for entry in entries:
+        if seats + entry.number_of_tickets > free:
+            break
+        head.append(entry)
+        seats += entry.number_of_tickets
+    return head, seats
+
+
+def _notify(event, promoted, expires_at):
+    outbox.queue_emails([
+        (
+            f"A seat for {event.title} is yours",
+            f"You were next on the waitlist for {event.title}. Booking ID: {booking.id}. "
+            f"Complete the payment before {expires_at:%Y-%m-%d %H:%M} UTC to keep your "
+            f"{booking.number_of_tickets} ticket(s).",
+            [entry.email],
+        )
+        for entry, booking in promoted if entry.email
+    ])
+
+
+def _promote_batch(event_id, batch_size):
+    with transaction.atomic():
+        event = Event.objects.filter(id=event_id).first()
+        if event is None:
+            return 0
+        free = inventory.seats_left(event)
+        if free < 1:
+            return 0
+        # Locked, so two promoters never hand out the same entry; no skip_locked, the head has to go first
+        queue = WaitlistEntry.objects.filter(event_id=event_id, status=WAITING).order_by('id')
+        entries, seats = _fit(list(queue.select_for_update()[:batch_size]), free)
+        if not entries:
+            return 0
+        try:
+            inventory.take_seats(event, seats)
+        except inventory.NotEnoughSeats:
+            # Booked by someone else meanwhile; whoever frees seats next promotes again
+            return 0
+
+        now = timezone.now()
+        expires_at = now + datetime.timedelta(minutes=settings.WAITLIST_HOLD_MINUTES)
+        bookings = Booking.objects.bulk_create([
+            Booking(
+                event=event, customer_name=entry.customer_name, roll_number=entry.roll_number,
+                section=entry.section, email=entry.email, phone=entry.phone,
+                number_of_tickets=entry.number_of_tickets,
+                total_amount=event.ticket_price * entry.number_of_tickets,
+                payment_status='pending', hold_expires_at=expires_at,
+            )
+            for entry in entries
+        ])
+        for entry, booking in zip(entries, bookings):
+            entry.status, entry.booking, entry.promoted_at = PROMOTED, booking, now
+        WaitlistEntry.objects.bulk_update(entries, ['status', 'booking', 'promoted_at'])
+        stats.record(event, pending_bookings=len(bookings), pending_seats=seats)
+        _notify(event, list(zip(entries, bookings)), expires_at)
+    return len(entries)
+
+
+def promote(event_id, batch_size=BATCH_SIZE):
+    """Hand the event's free seats to the head of its waitlist. Returns how many customers got them."""
+    promoted = 0
+    while True:
+        count = _promote_batch(event_id, batch_size)
+        promoted += count
+        if count < batch_size:
+            return promoted
+
+
+def promote_on_commit(event_id):
+    transaction.on_commit(lambda: promote(event_id))
+
+
+def promote_all(batch_size=BATCH_SIZE):
+    """``promote`` every event someone is waiting for (catches up on promotions that didn't run)."""
+    event_ids = WaitlistEntry.objects.filter(status=WAITING).values_list('event_id', flat=True).distinct()
+    return sum(promote(event_id, batch_size) for event_id in list(event_ids))